@@ -0,0 +1,314 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import yaml
+
+from utils import load_config, resolve_split_dir
+from config import resolve, set_key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAIN_SCRIPT = os.path.join(ROOT, 'src', 'train.py')
+# Final-epoch columns of Ultralytics' results.csv -> table columns
+METRICS = {
+    'metrics/precision(B)': 'precision',
+    'metrics/recall(B)': 'recall',
+    'metrics/mAP50(B)': 'mAP50',
+    'metrics/mAP50-95(B)': 'mAP50-95',
+}
+# Smoke mode: a few tiny CPU epochs, enough to prove every config still builds, trains and validates
+SMOKE_OVERRIDES = {
+    'epochs': 1,
+    'imgsz': 64,
+    'batch': 4,
+    'device': 'cpu',
+    'weights': None, # No pretrained download
+    'dataset_cache': {'enabled': False},
+    'memory_budget': {'enabled': False}, # Fixed batch, no probe
+    'train_args': {'workers': 0, 'plots': False, 'amp': False},
+}
+# Sections that only affect inference / the demo, left out of the cache key
+INFERENCE_KEYS = ('backend', 'demo', 'multi_stream', 'predict', 'tiling', 'tracking', 'motion', 'telemetry',
+                  'video', 'server', 'server_url', 'evaluate', 'threads')
+COLUMNS = ['run', 'config', 'overrides', 'hash', 'status', 'cached', 'epochs',
+           'precision', 'recall', 'mAP50', 'mAP50-95', 'wall_s', 'img_per_s']
+
+
+def parse_grid(items):
+    """['epochs=50,100', 'wiou_focusing=true,false'] -> list of override dicts (cartesian product)."""
+    axes = []
+    for item in items or []:
+        key, _, values = item.partition('=')
+        if not values:
+            raise ValueError(f"Grid axis '{item}' must look like key=v1,v2")
+        axes.append([(key, yaml.safe_load(v)) for v in values.split(',')])
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+
+def config_hash(cfg):
+    """Hash of the training part of the config plus the model YAML it builds, so an edited architecture is re-run."""
+    train_cfg = {k: v for k, v in cfg.items() if k not in INFERENCE_KEYS}
+    h = hashlib.sha1(json.dumps(train_cfg, sort_keys=True, default=str).encode())
+    model_cfg = os.path.join(ROOT, str(cfg.get('model_cfg', '')))
+    if os.path.isfile(model_cfg):
+        with open(model_cfg, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:12]
+
+
+def make_smoke_dataset(out_dir, data_yaml=None, n=16, seed=0):
+    """
+    Tiny train/val set for smoke runs: the first `n` images of each split of `data_yaml` when that
+    dataset is present, otherwise synthetic images with random boxes (so CI needs no download).
+    Returns:
+        str: Path of the generated data.yaml.
+    """
+    import cv2
+    import numpy as np
+    from predict import list_images
+
+    path = os.path.join(out_dir, 'data.yaml')
+    if os.path.exists(path):
+        return path
+    names = {0: 'hat', 1: 'person'}
+    rng = np.random.default_rng(seed)
+    for split in ('train', 'val'):
+        img_dir = os.path.join(out_dir, 'images', split)
+        lbl_dir = os.path.join(out_dir, 'labels', split)
+        os.makedirs(img_dir, exist_ok=True)
+        os.makedirs(lbl_dir, exist_ok=True)
+        src = []
+        if data_yaml and os.path.exists(data_yaml):
+            with open(data_yaml, 'r', encoding='utf-8') as f:
+                names = yaml.safe_load(f).get('names', names)
+            split_dir = resolve_split_dir(data_yaml, split)
+            src = list_images(split_dir)[:n] if os.path.isdir(split_dir) else []
+        if src:
+            for p in src:
+                shutil.copy(p, img_dir)
+                lbl = os.path.splitext(p.replace(f'{os.sep}images{os.sep}', f'{os.sep}labels{os.sep}'))[0] + '.txt'
+                if os.path.exists(lbl):
+                    shutil.copy(lbl, lbl_dir)
+            continue
+        for i in range(n):
+            im = rng.integers(0, 120, (128, 128, 3), dtype=np.uint8)
+            rows = []
+            for _ in range(rng.integers(1, 4)):
+                w, h = rng.integers(12, 40, 2)
+                x, y = rng.integers(0, 128 - w), rng.integers(0, 128 - h)
+                c = int(rng.integers(0, 2))
+                im[y:y + h, x:x + w] = (255, 200, 0) if c == 0 else (0, 0, 255)
+                rows.append(f"{c} {(x + w / 2) / 128:.6f} {(y + h / 2) / 128:.6f} {w / 128:.6f} {h / 128:.6f}")
+            cv2.imwrite(os.path.join(img_dir, f'{split}_{i:03d}.jpg'), im)
+            with open(os.path.join(lbl_dir, f'{split}_{i:03d}.txt'), 'w') as f:
+                f.write('\n'.join(rows) + '\n')
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump({'path': os.path.abspath(out_dir), 'train': 'images/train', 'val': 'images/val',
+                        'names': names}, f, allow_unicode=True)
+    return path
+
+
+def plan_runs(configs, grid, out_dir, smoke=False, smoke_images=16):
+    """One run per (config, grid point), with its resolved config, hash and run directory."""
+    smoke_data = None
+    runs = []
+    for config in configs:
+        base = load_config(config)
+        for overrides in grid or [{}]:
+            cfg = json.loads(json.dumps(base)) # Deep copy
+            if smoke:
+                smoke_data = smoke_data or make_smoke_dataset(os.path.join(out_dir, 'smoke_data'),
+                                                              os.path.join(ROOT, base['data']), smoke_images)
+                for key, value in {**SMOKE_OVERRIDES, 'data': smoke_data}.items():
+                    cfg[key] = value
+            for key, value in overrides.items():
+                set_key(cfg, key, value)
+            cfg = resolve(cfg) # A mistyped grid key fails here, not in the middle of the sweep
+            cfg.pop('project', None)
+            cfg.pop('name', None)
+            h = config_hash(cfg)
+            label = os.path.splitext(os.path.basename(config))[0]
+            label += ''.join(f"-{k.split('.')[-1]}={v}" for k, v in overrides.items())
+            run_dir = os.path.join(out_dir, f"{label}-{h[:8]}")
+            runs.append({'run': label, 'config': config, 'overrides': overrides, 'hash': h,
+                         'dir': run_dir, 'cfg': cfg})
+    return runs
+
+
+def read_metrics(run_dir):
+    """Last-epoch metrics and training time from the Ultralytics results.csv of a run."""
+    path = os.path.join(run_dir, 'train', 'results.csv')
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        rows = [{k.strip(): v for k, v in row.items()} for row in csv.DictReader(f)]
+    if not rows:
+        return {}
+    last = rows[-1]
+    out = {name: float(last[col]) for col, name in METRICS.items() if col in last}
+    out['epochs'] = len(rows)
+    if 'time' in last:
+        out['train_s'] = float(last['time']) # Cumulative seconds, Ultralytics >= 8.3
+    return out
+
+
+def count_train_images(cfg):
+    from predict import list_images
+
+    try:
+        split_dir = resolve_split_dir(os.path.join(ROOT, cfg['data']), 'train')
+    except OSError:
+        return None
+    return len(list_images(split_dir)) if os.path.isdir(split_dir) else None
+
+
+def execute(run, device=None, threads=None):
+    """Train one run in its own interpreter, so train.py's monkey patches die with the process."""
+    os.makedirs(run['dir'], exist_ok=True)
+    shutil.rmtree(os.path.join(run['dir'], 'train'), ignore_errors=True) # Leftovers of an aborted attempt
+    cfg = {**run['cfg'], 'project': os.path.abspath(run['dir']), 'name': 'train'}
+    if device is not None:
+        cfg['device'] = device
+    cfg_path = os.path.join(run['dir'], 'config.yaml')
+    with open(cfg_path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(cfg, f, allow_unicode=True, sort_keys=False)
+
+    env = dict(os.environ)
+    if threads:
+        env['OMP_NUM_THREADS'] = env['MKL_NUM_THREADS'] = str(threads) # Share the cores between CPU runs
+    t0 = time.perf_counter()
+    with open(os.path.join(run['dir'], 'train.log'), 'w', encoding='utf-8') as log:
+        proc = subprocess.run([sys.executable, TRAIN_SCRIPT, '--config', cfg_path], cwd=ROOT, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    wall = time.perf_counter() - t0
+
+    metrics = read_metrics(run['dir'])
+    n_images = count_train_images(cfg)
+    train_s = metrics.pop('train_s', wall)
+    result = {
+        'status': 'ok' if proc.returncode == 0 and metrics else f'failed ({proc.returncode})',
+        'wall_s': round(wall, 1),
+        'img_per_s': round(n_images * metrics.get('epochs', 0) / train_s, 1) if n_images and train_s else None,
+        **metrics,
+    }
+    if result['status'] == 'ok':
+        with open(os.path.join(run['dir'], 'result.json'), 'w', encoding='utf-8') as f:
+            json.dump({'hash': run['hash'], **result}, f, indent=2)
+    return result
+
+
+def cached_result(run):
+    """Result of an earlier run with the same config hash (also under another label, e.g. an explicit default)."""
+    out_dir = os.path.dirname(run['dir'])
+    dirs = [run['dir']] + [os.path.join(out_dir, d) for d in sorted(os.listdir(out_dir)) if d.endswith(run['hash'][:8])]
+    for d in dirs:
+        path = os.path.join(d, 'result.json')
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            if result.get('hash') == run['hash']:
+                return result
+    return None
+
+
+def run_all(runs, jobs=1, devices=None, rerun=False):
+    """
+    Run everything not cached yet, at most `jobs` at a time. Each job holds one device slot
+    (devices are handed out round-robin); CPU jobs split the cores between them.
+    """
+    todo = []
+    for run in runs:
+        cached = None if rerun else cached_result(run)
+        if cached:
+            run.update(cached, cached=True)
+        else:
+            todo.append(run)
+    print(f"{len(runs)} runs, {len(runs) - len(todo)} cached, {len(todo)} to train (jobs={jobs})")
+
+    slots = queue.Queue()
+    for i in range(max(1, jobs)):
+        slots.put(devices[i % len(devices)] if devices else None)
+    cpu_threads = max(1, (os.cpu_count() or 1) // max(1, jobs))
+    lock = threading.Lock()
+
+    def worker(run):
+        device = slots.get()
+        try:
+            on_cpu = str(device if device is not None else run['cfg'].get('device')) == 'cpu'
+            with lock:
+                print(f"  start {run['run']} on {device if device is not None else run['cfg'].get('device')}")
+            run.update(execute(run, device, cpu_threads if on_cpu else None), cached=False)
+            with lock:
+                print(f"  done  {run['run']}: {run['status']} in {run['wall_s']}s")
+        finally:
+            slots.put(device)
+
+    threads = [threading.Thread(target=worker, args=(run,)) for run in todo]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return runs
+
+
+def write_table(runs, out_dir):
+    """Comparison table of all runs: results.csv in `out_dir` and a console print."""
+    rows = [{c: run.get(c) for c in COLUMNS} | {'overrides': json.dumps(run['overrides'])} for run in runs]
+    path = os.path.join(out_dir, 'results.csv')
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    fmt = lambda v, p: f"{100 * v:.2f}%" if isinstance(v, float) and p else ('-' if v is None else str(v))
+    print(f"{'run':<42} {'status':<12} {'P':>7} {'R':>7} {'mAP50':>7} {'mAP50-95':>8} {'wall s':>8} {'img/s':>7}")
+    for r in rows:
+        print(f"{r['run'][:42]:<42} {(r['status'] or '-') + (' *' if r['cached'] else ''):<12} "
+              f"{fmt(r['precision'], True):>7} {fmt(r['recall'], True):>7} {fmt(r['mAP50'], True):>7} "
+              f"{fmt(r['mAP50-95'], True):>8} {fmt(r['wall_s'], False):>8} {fmt(r['img_per_s'], False):>7}")
+    print(f"(* cached) Table saved to {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ablation runner: one training process per config / grid point")
+    parser.add_argument('--configs', nargs='+',
+                        default=['train_config_baseline.yaml', 'train_config.yaml', 'train_config_p2.yaml'])
+    parser.add_argument('--grid', nargs='*', default=[],
+                        help='Override axes, e.g. epochs=50,100 wiou_focusing=true,false train_args.lr0=0.01,0.005')
+    parser.add_argument('--jobs', type=int, default=1, help='Runs in parallel')
+    parser.add_argument('--devices', nargs='*', default=None, help='Device per slot, e.g. 0 1 or cpu (default: per config)')
+    parser.add_argument('--out', type=str, default='runs/ablation')
+    parser.add_argument('--rerun', action='store_true', help='Ignore cached results')
+    parser.add_argument('--smoke', action='store_true', help='Tiny dataset, 1 epoch at 64px on CPU (for CI)')
+    parser.add_argument('--smoke-images', type=int, default=16, help='Images per split in smoke mode')
+    parser.add_argument('--dry-run', action='store_true', help='Only list the runs and their cache state')
+    args = parser.parse_args()
+
+    configs = [c if os.path.exists(c) else os.path.join(ROOT, c) for c in args.configs]
+    out_dir = os.path.abspath(os.path.join(args.out, 'smoke') if args.smoke else args.out)
+    os.makedirs(out_dir, exist_ok=True)
+    runs = plan_runs(configs, parse_grid(args.grid), out_dir, args.smoke, args.smoke_images)
+    if args.dry_run:
+        for run in runs:
+            print(f"{run['run']:<40} {run['hash']}  {'cached' if cached_result(run) else 'pending'}")
+        return
+
+    devices = args.devices or (['cpu'] if args.smoke else None)
+    run_all(runs, args.jobs, devices, args.rerun)
+    write_table(runs, out_dir)
+    if args.smoke and any(run['status'] != 'ok' for run in runs):
+        sys.exit(1) # Fail the CI job
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+
+# Inference backends and the artifact each one loads, derived from the .pt path
+# e.g. runs/train/exp/weights/best.pt -> best.onnx / best-int8.onnx / best_openvino_model / best.torchscript
+BACKENDS = {
+    'pt': '.pt',
+    'onnx': '.onnx',
+    'onnx-int8': '-int8.onnx',
+    'onnx-int8-static': '-int8-static.onnx', # Calibrated INT8, produced by quantize.py
+    'openvino': '_openvino_model',
+    'torchscript': '.torchscript',
+}
+
+
+def artifact_path(weights, backend='pt'):
+    """
+    Map a .pt weights path to the exported artifact for `backend`.
+    Args:
+        weights (str): Path to the PyTorch weights (.pt).
+        backend (str): One of BACKENDS.
+    Returns:
+        str: Path of the artifact the backend loads.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {list(BACKENDS)}")
+    stem, ext = os.path.splitext(weights)
+    if backend == 'pt' or ext != '.pt':
+        return weights # Already an exported artifact (or a YAML / hub name), load it as given
+    return stem + BACKENDS[backend]
+
+
+def load_model(weights, backend='pt'):
+    """
+    Load `weights` through the requested backend.
+    Non-PyTorch backends expect the artifact produced by `python src/export.py`.
+    """
+    from ultralytics import YOLO
+
+    path = artifact_path(weights, backend)
+    if not os.path.exists(path) and backend != 'pt':
+        raise FileNotFoundError(
+            f"{backend} artifact '{path}' not found. Create it with: "
+            f"python src/export.py --weights {weights} --formats {backend}"
+        )
+    # Exported artifacts carry no task info for older exports, so state it explicitly
+    return YOLO(path, task='detect') if backend != 'pt' else YOLO(path)
+
+
+def limit_onnxruntime_threads(n):
+    """Make every ONNX Runtime session created from now on use `n` intra-op threads."""
+    import onnxruntime as ort
+
+    base = getattr(ort.InferenceSession, '_unlimited', ort.InferenceSession)
+    class Session(base):
+        _unlimited = base
+        def __init__(self, path, sess_options=None, *args, **kwargs):
+            sess_options = sess_options or ort.SessionOptions()
+            sess_options.intra_op_num_threads = n
+            sess_options.inter_op_num_threads = 1
+            super().__init__(path, sess_options, *args, **kwargs)
+    ort.InferenceSession = Session
+
+
+def set_threads(n):
+    """Intra-op CPU threads for inference (PyTorch, and ONNX Runtime if installed); None keeps the library defaults."""
+    if not n:
+        return
+    import torch
+
+    torch.set_num_threads(int(n))
+    try:
+        limit_onnxruntime_threads(int(n))
+    except ImportError:
+        pass
+
+
+def load_from_config(cfg):
+    """
+    Load the configured weights with the configured backend (default: eager PyTorch), or a
+    thin client of a running server.py when `server_url` is set.
+    """
+    if cfg.get('server_url'):
+        from server import RemoteModel
+        return RemoteModel(cfg['server_url'], (cfg.get('server') or {}).get('transport', 'auto'))
+    set_threads(cfg.get('threads'))
+    return load_model(cfg['weights'], cfg.get('backend', 'pt'))
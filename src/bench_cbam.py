@@ -0,0 +1,118 @@
+import argparse
+import time
+
+import torch
+
+from modules import CBAM
+
+
+def reference_forward(m, x):
+    """The original (unfused) CBAM forward, evaluated with the weights of `m`."""
+    ca, sa = m.channel_attention, m.spatial_attention
+    avg_out = ca.fc2(ca.relu1(ca.fc1(ca.avg_pool(x))))
+    max_out = ca.fc2(ca.relu1(ca.fc1(ca.max_pool(x))))
+    out = x * ca.sigmoid(avg_out + max_out)
+
+    avg_s = torch.mean(out, dim=1, keepdim=True)
+    max_s, _ = torch.max(out, dim=1, keepdim=True)
+    s = sa.sigmoid(sa.conv1(torch.cat([avg_s, max_s], dim=1)))
+    return out * s
+
+
+REFERENCE_KEYS = [
+    'channel_attention.fc1.weight',
+    'channel_attention.fc2.weight',
+    'spatial_attention.conv1.weight',
+]
+
+
+def check_equivalence(shapes, atol=1e-5):
+    """Fused CBAM must match the reference forward, gradients and state_dict layout."""
+    torch.manual_seed(0)
+    for b, c, h, w in shapes:
+        for k in (3, 7):
+            m = CBAM(c, kernel_size=k)
+            assert list(m.state_dict()) == REFERENCE_KEYS, list(m.state_dict())
+            x = torch.randn(b, c, h, w)
+
+            # Inference path (in-place spatial gate)
+            with torch.no_grad():
+                ref, out = reference_forward(m, x), m(x)
+            torch.testing.assert_close(out, ref, atol=atol, rtol=1e-5)
+
+            # Training path, including gradients w.r.t. input and every weight
+            xa, xb = x.clone().requires_grad_(), x.clone().requires_grad_()
+            g = torch.randn(b, c, h, w)
+            reference_forward(m, xa).backward(g)
+            ref_grads = [p.grad.clone() for p in m.parameters()]
+            m.zero_grad()
+            m(xb).backward(g)
+            torch.testing.assert_close(xb.grad, xa.grad, atol=atol, rtol=1e-4)
+            for p, rg in zip(m.parameters(), ref_grads):
+                torch.testing.assert_close(p.grad, rg, atol=atol, rtol=1e-4)
+            m.zero_grad()
+        print(f"  ok  {(b, c, h, w)}")
+
+
+def time_fn(fn, x, iters, warmup=10):
+    with torch.no_grad():
+        for _ in range(warmup):
+            fn(x)
+        t0 = time.perf_counter()
+        for _ in range(iters):
+            fn(x)
+    return 1000 * (time.perf_counter() - t0) / iters
+
+
+def peak_alloc(fn, x):
+    # Peak allocator bytes are only measurable on CUDA
+    if x.device.type != 'cuda':
+        return None
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    base = torch.cuda.memory_allocated()
+    with torch.no_grad():
+        fn(x)
+    torch.cuda.synchronize()
+    return (torch.cuda.max_memory_allocated() - base) / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CBAM fused-forward equivalence check and micro-benchmark")
+    parser.add_argument('--channels', type=int, default=512, help='CBAM input channels (512 on the s-scale P5 path)')
+    parser.add_argument('--size', type=int, default=20, help='Feature map side (20 = P5 at imgsz 640)')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--iters', type=int, default=200)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--compile', action='store_true', help='Also time torch.compile(fused CBAM)')
+    parser.add_argument('--check-only', action='store_true')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    print("Equivalence against the reference CBAM:")
+    check_equivalence([(2, 64, 16, 16), (1, args.channels, args.size, args.size), (3, 32, 7, 9)])
+    if args.check_only:
+        return
+
+    m = CBAM(args.channels).to(args.device).eval()
+    variants = [('reference', lambda x: reference_forward(m, x)), ('fused', m)]
+    if args.compile:
+        variants.append(('fused+compile', torch.compile(m)))
+
+    print(f"\nC={args.channels} HxW={args.size}x{args.size} device={args.device}")
+    print(f"{'batch':>6} {'variant':<14} {'ms':>8} {'speedup':>8} {'peak MiB':>9}")
+    for b in args.batch:
+        x = torch.randn(b, args.channels, args.size, args.size, device=args.device)
+        base = None
+        for name, fn in variants:
+            ms = time_fn(fn, x, args.iters)
+            base = base or ms
+            peak = peak_alloc(fn, x)
+            peak = f"{peak:.2f}" if peak is not None else '-'
+            print(f"{b:>6} {name:<14} {ms:>8.3f} {base / ms:>7.2f}x {peak:>9}")
+
+
+if __name__ == '__main__':
+    main()
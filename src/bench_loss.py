@@ -0,0 +1,140 @@
+import argparse
+import time
+
+import torch
+
+from loss import InnerWIoU, inner_wiou_terms
+
+
+def reference_inner_wiou(pred, target, ratio):
+    """The original per-coordinate Inner-WIoU (v1) formulation."""
+    x1, y1, x2, y2 = pred.unbind(-1)
+    tx1, ty1, tx2, ty2 = target.unbind(-1)
+    inter = torch.clamp(torch.min(x2, tx2) - torch.max(x1, tx1), min=0) * \
+        torch.clamp(torch.min(y2, ty2) - torch.max(y1, ty1), min=0)
+    w1, h1 = x2 - x1, y2 - y1
+    w2, h2 = tx2 - tx1, ty2 - ty1
+    px, py, pw, ph = (x1 + x2) / 2, (y1 + y2) / 2, w1, h1
+    tx, ty, tw, th = (tx1 + tx2) / 2, (ty1 + ty2) / 2, w2, h2
+    inner_pw, inner_ph = pw * ratio, ph * ratio
+    inner_tw, inner_th = tw * ratio, th * ratio
+    inner_x1, inner_y1 = px - inner_pw / 2, py - inner_ph / 2
+    inner_x2, inner_y2 = px + inner_pw / 2, py + inner_ph / 2
+    inner_tx1, inner_ty1 = tx - inner_tw / 2, ty - inner_th / 2
+    inner_tx2, inner_ty2 = tx + inner_tw / 2, ty + inner_th / 2
+    inner_inter = torch.clamp(torch.min(inner_x2, inner_tx2) - torch.max(inner_x1, inner_tx1), min=0) * \
+        torch.clamp(torch.min(inner_y2, inner_ty2) - torch.max(inner_y1, inner_ty1), min=0)
+    inner_union = inner_pw * inner_ph + inner_tw * inner_th - inner_inter + 1e-7
+    inner_iou = inner_inter / inner_union
+    cw = torch.max(x2, tx2) - torch.min(x1, tx1)
+    ch = torch.max(y2, ty2) - torch.min(y1, ty1)
+    dist = ((px - tx) ** 2 + (py - ty) ** 2) / (cw ** 2 + ch ** 2 + 1e-7)
+    return torch.exp(dist) * (1 - inner_iou)
+
+
+def make_boxes(n, device, seed=0):
+    """Targets in a 640px image and jittered predictions around them, like matched foreground anchors."""
+    g = torch.Generator().manual_seed(seed)
+    xy = torch.rand(n, 2, generator=g) * 600
+    wh = torch.rand(n, 2, generator=g) * 120 + 4
+    target = torch.cat([xy, xy + wh], -1)
+    pred = target + torch.randn(n, 4, generator=g) * wh.repeat(1, 2) * 0.15
+    return pred.to(device), target.to(device)
+
+
+def check_equivalence(device, n=4096, ratio=0.75):
+    # Float64 so the hand-written backward is checked tightly; include non-overlapping pairs
+    pred, target = make_boxes(n, device)
+    pred, target = pred.double(), target.double()
+    pred[: n // 10] += 300
+    pa, pb = pred.clone().requires_grad_(), pred.clone().requires_grad_()
+    ref = reference_inner_wiou(pa, target, ratio)
+    new = InnerWIoU(ratio=ratio).to(device)(pb, target)
+    torch.testing.assert_close(new, ref, atol=1e-10, rtol=1e-8)
+    g = torch.rand_like(ref)
+    ref.backward(g)
+    new.backward(g)
+    torch.testing.assert_close(pb.grad, pa.grad, atol=1e-10, rtol=1e-8)
+
+    # v3 focusing: running mean only moves in training with grad enabled
+    m = InnerWIoU(ratio=ratio, focusing=True).to(device)
+    m(pred, target)
+    moved = float(m.iou_mean)
+    with torch.no_grad():
+        m(pred, target)
+    assert moved < 1.0 and float(m.iou_mean) == moved, 'iou_mean must only update on training steps'
+    print(f"  ok  v1 loss/grad match reference (N={n}), v3 running mean = {moved:.4f}")
+
+
+def saved_bytes(fn, *args):
+    """Bytes autograd keeps alive for backward (the activation-memory part of a loss step)."""
+    total = [0]
+    def pack(t):
+        total[0] += t.numel() * t.element_size()
+        return t
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        fn(*args)
+    return total[0]
+
+
+def step(fn, pred, target):
+    p = pred.detach().requires_grad_()
+    fn(p, target).sum().backward()
+
+
+def bench(name, fn, pred, target, iters, device):
+    for _ in range(5):
+        step(fn, pred, target)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    t0 = time.perf_counter()
+    for _ in range(iters):
+        step(fn, pred, target)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    ms = 1000 * (time.perf_counter() - t0) / iters
+    peak = torch.cuda.max_memory_allocated() / 2 ** 20 if device.type == 'cuda' else None
+    saved = saved_bytes(lambda p, t: fn(p.detach().requires_grad_(), t), pred, target) / 2 ** 20
+    return {'variant': name, 'ms': ms, 'peak_mib': peak, 'saved_mib': saved}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inner-WIoU step time and memory: reference vs fused")
+    parser.add_argument('--fg', type=int, nargs='+', default=[512, 2048, 8192, 32768],
+                        help='Foreground (matched) boxes per step; batch 8 at 640 gives a few thousand')
+    parser.add_argument('--iters', type=int, default=100)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--compile', action='store_true', help='Also time the torch.compile path')
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    print("Equivalence against the reference Inner-WIoU:")
+    check_equivalence(device)
+
+    ratio = 0.75
+    def autograd_terms(p, t):
+        _, inner_iou, r_wiou = inner_wiou_terms(p, t, ratio)
+        return r_wiou * (1 - inner_iou)
+    variants = [
+        ('reference', lambda p, t: reference_inner_wiou(p, t, ratio)),
+        ('stacked', autograd_terms), # Stacked forward, plain autograd backward
+        ('fused', InnerWIoU(ratio=ratio).to(device)),
+        ('fused+v3', InnerWIoU(ratio=ratio, focusing=True).to(device)),
+    ]
+    if args.compile:
+        variants.append(('compiled', InnerWIoU(ratio=ratio, compile=True).to(device)))
+
+    print(f"\n{'fg boxes':>9} {'variant':<14} {'fwd+bwd ms':>11} {'speedup':>8} {'saved MiB':>10} {'peak MiB':>9}")
+    for n in args.fg:
+        pred, target = make_boxes(n, device)
+        base = None
+        for name, fn in variants:
+            r = bench(name, fn, pred, target, args.iters, device)
+            base = base or r['ms']
+            peak = f"{r['peak_mib']:.2f}" if r['peak_mib'] is not None else '-'
+            print(f"{n:>9} {name:<14} {r['ms']:>11.3f} {base / r['ms']:>7.2f}x {r['saved_mib']:>10.2f} {peak:>9}")
+
+
+if __name__ == '__main__':
+    main()
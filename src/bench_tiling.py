@@ -0,0 +1,127 @@
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from utils import load_config, box_iou, resolve_split_dir
+from config import add_override_argument
+from modules import register_custom_modules
+from backends import load_model
+from dataset_cache import label_path, read_labels
+from predict import list_images, read_image
+from tiling import TILING_DEFAULTS, TiledPredictor
+
+SMALL = 32 # Objects below 32x32 px (COCO "small") are what the P2 head and tiling are for
+
+
+def load_ground_truth(path, upscale=1.0):
+    """Image and its (N, 5) cls, x1, y1, x2, y2 pixel boxes."""
+    im = read_image(path)
+    if upscale != 1.0:
+        im = cv2.resize(im, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+    h, w = im.shape[:2]
+    lb = read_labels(label_path(path))
+    lb = np.zeros((0, 5), np.float32) if lb is None else lb
+    xy, wh = lb[:, 1:3] * [w, h], lb[:, 3:5] * [w, h]
+    return im, np.concatenate([lb[:, :1], xy - wh / 2, xy + wh / 2], 1)
+
+
+def matched_gt(gt, dets, iou_thr=0.5):
+    """Boolean mask of ground-truth boxes matched (same class, greedy by confidence) by a detection."""
+    hit = np.zeros(len(gt), bool)
+    if len(gt) == 0 or len(dets) == 0:
+        return hit
+    iou = box_iou(dets[:, :4], gt[:, 1:])
+    iou[dets[:, 5][:, None] != gt[:, 0][None, :]] = 0
+    for i in np.argsort(-dets[:, 4]):
+        iou[i, hit] = 0
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] >= iou_thr:
+            hit[j] = True
+    return hit
+
+
+def run_variant(predict, samples, conf, iou_thr=0.5):
+    predict(samples[0][0], conf=conf) # Warmup
+    hits, small, n_dets, elapsed = [], [], 0, 0.0
+    for im, gt in samples:
+        t0 = time.perf_counter()
+        dets = predict(im, conf=conf)[0].boxes.data.cpu().numpy()
+        elapsed += time.perf_counter() - t0
+        n_dets += len(dets)
+        hits.append(matched_gt(gt, dets, iou_thr))
+        side = np.sqrt((gt[:, 3] - gt[:, 1]) * (gt[:, 4] - gt[:, 2]))
+        small.append(side < SMALL)
+    hits, small = np.concatenate(hits), np.concatenate(small)
+    return {
+        'recall': float(hits.mean()) if len(hits) else None,
+        'recall_small': float(hits[small].mean()) if small.any() else None,
+        'gt': int(len(hits)), 'gt_small': int(small.sum()), 'detections': n_dets,
+        'img_per_s': len(samples) / max(elapsed, 1e-9),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall / throughput: tiled P3-head vs full-frame P2-head inference")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--p3-weights', type=str, default=None, help='Standard (P3-P5) model, defaults to `weights`')
+    parser.add_argument('--p2-weights', type=str, default=None, help='P2-head model (train_config_p2.yaml)')
+    parser.add_argument('--backend', type=str, default=None)
+    parser.add_argument('--images', type=str, default=None, help='Labelled images, defaults to the valid split')
+    parser.add_argument('--n', type=int, default=100, help='Number of images')
+    parser.add_argument('--upscale', type=float, default=1.0,
+                        help='Upscale images first, a stand-in for 4K footage when no high-res labelled set exists')
+    parser.add_argument('--imgsz', type=int, default=None, help='Full-frame inference size')
+    parser.add_argument('--tile', type=int, default=None)
+    parser.add_argument('--overlap', type=float, default=None)
+    parser.add_argument('--batch', type=int, default=None, help='Tiles per forward pass')
+    parser.add_argument('--merge', type=str, default=None, choices=['nms', 'wbf'])
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--out', type=str, default=None, help='Also write the results as JSON')
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    imgsz = args.imgsz or cfg.get('imgsz', 640)
+    backend = args.backend or cfg.get('backend', 'pt')
+    tcfg = {**TILING_DEFAULTS, **(cfg.get('tiling') or {})}
+    for key in ('tile', 'overlap', 'batch', 'merge'):
+        if getattr(args, key) is not None:
+            tcfg[key] = getattr(args, key)
+    register_custom_modules()
+
+    paths = list_images(args.images or resolve_split_dir(cfg['data'], 'val'))
+    rng = np.random.default_rng(0)
+    paths = [paths[i] for i in sorted(rng.choice(len(paths), min(args.n, len(paths)), replace=False))]
+    samples = [load_ground_truth(p, args.upscale) for p in paths]
+    h, w = samples[0][0].shape[:2]
+    print(f"{len(samples)} images (first {w}x{h}), full-frame imgsz={imgsz}, tile={tcfg['tile']} "
+          f"overlap={tcfg['overlap']} merge={tcfg['merge']}")
+
+    variants = []
+    for head, weights in (('P3', args.p3_weights or cfg['weights']), ('P2', args.p2_weights)):
+        if not weights:
+            continue
+        model = load_model(weights, backend)
+        variants.append((f"{head} full-frame", lambda im, conf, m=model: m(im, conf=conf, imgsz=imgsz, verbose=False)))
+        variants.append((f"{head} tiled", TiledPredictor(model, imgsz=imgsz, **tcfg)))
+
+    report = {}
+    print(f"{'variant':<16} {'recall':>7} {'small':>7} {'dets':>6} {'img/s':>7}")
+    for name, predict in variants:
+        r = report[name] = run_variant(predict, samples, args.conf)
+        fmt = lambda v: f"{v:.3f}" if v is not None else '-'
+        print(f"{name:<16} {fmt(r['recall']):>7} {fmt(r['recall_small']):>7} {r['detections']:>6} {r['img_per_s']:>7.2f}")
+    print(f"({report[next(iter(report))]['gt']} ground-truth boxes, "
+          f"{report[next(iter(report))]['gt_small']} smaller than {SMALL}px)")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'settings': {'imgsz': imgsz, **tcfg, 'upscale': args.upscale}, 'results': report}, f, indent=2)
+        print(f"Results saved to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from utils import load_config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIGS = ['train_config_baseline.yaml', 'train_config.yaml', 'train_config_p2.yaml']
+# A result row is identified by these fields when two runs are compared
+KEY_FIELDS = ('variant', 'backend', 'threads', 'imgsz', 'batch')
+
+
+def default_variants(configs, use_weights=False):
+    """
+    (name, model source) per config: the architecture YAML (random init, which is all latency
+    needs and works before anything is trained) or, with `use_weights`, the configured weights.
+    """
+    variants = []
+    for config in configs:
+        path = config if os.path.exists(config) else os.path.join(ROOT, config)
+        cfg = load_config(path)
+        source = cfg['weights'] if use_weights else cfg['model_cfg']
+        local = os.path.join(ROOT, source)
+        variants.append((os.path.splitext(os.path.basename(config))[0], local if os.path.exists(local) else source))
+    return variants
+
+
+def run_cell(spec):
+    """
+    Benchmark one (variant, backend, threads) in this process over all imgsz x batch points.
+    Runs in a fresh interpreter per cell (see main), so thread settings and peak RSS are not
+    shared between cells.
+    """
+    import torch
+    from ultralytics import YOLO
+    from ultralytics.utils.torch_utils import get_flops
+    from backends import limit_onnxruntime_threads, load_model
+    from export import sample_images
+    from modules import register_custom_modules
+    from telemetry import rss_mb
+
+    torch.manual_seed(spec['seed'])
+    torch.set_num_threads(spec['threads'])
+    if spec['backend'].startswith('onnx'):
+        limit_onnxruntime_threads(spec['threads'])
+    register_custom_modules()
+
+    source = spec['source']
+    t0 = time.perf_counter()
+    if source.endswith('.yaml'):
+        if spec['backend'] != 'pt':
+            return [{'status': 'skipped: YAML variants only run on the pt backend'}]
+        model = YOLO(source)
+    else:
+        model = load_model(source, spec['backend'])
+    load_s = time.perf_counter() - t0
+
+    rows = []
+    for imgsz in spec['imgsz']:
+        images = sample_images(spec['images'], max(spec['batch']), imgsz, spec['seed'])
+        gflops = None
+        if spec['backend'] == 'pt':
+            gflops = round(get_flops(model.model, imgsz), 2) or None # 0.0 without thop
+        for batch in spec['batch']:
+            frames = [images[i % len(images)] for i in range(batch)]
+            run = lambda: model(frames, imgsz=imgsz, conf=spec['conf'], device=spec['device'], verbose=False)
+            for _ in range(spec['warmup']):
+                run()
+            times, peak = [], rss_mb()
+            for _ in range(spec['iters']):
+                t = time.perf_counter()
+                run()
+                times.append(1000 * (time.perf_counter() - t))
+                peak = max(peak, rss_mb())
+            a = np.array(times)
+            rows.append({
+                'status': 'ok', 'imgsz': imgsz, 'batch': batch,
+                'p50_ms': round(float(np.percentile(a, 50)), 3),
+                'p95_ms': round(float(np.percentile(a, 95)), 3),
+                'mean_ms': round(float(a.mean()), 3),
+                'img_per_s': round(batch * len(a) / (a.sum() / 1000), 2),
+                'peak_rss_mb': round(peak, 1),
+                'gflops_per_img': gflops,
+                'load_s': round(load_s, 2),
+            })
+    return rows
+
+
+def run_sweep(args):
+    """One subprocess per (variant, backend, threads); returns all result rows."""
+    variants = list(default_variants(args.configs, args.use_weights)) if args.configs else []
+    variants += [(os.path.splitext(os.path.basename(m))[0], m) for m in args.models]
+    results = []
+    flops = {} # GFLOPs do not depend on the backend, rows of other backends take them from the pt rows
+    for name, source in variants:
+        for backend in args.backends:
+            for threads in args.threads:
+                spec = {'source': source, 'backend': backend, 'threads': threads, 'imgsz': args.imgsz,
+                        'batch': args.batch, 'iters': args.iters, 'warmup': args.warmup, 'seed': args.seed,
+                        'images': args.images, 'conf': args.conf, 'device': args.device}
+                proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(spec)],
+                                      cwd=ROOT, capture_output=True, text=True)
+                if proc.returncode == 0:
+                    rows = json.loads(proc.stdout.strip().splitlines()[-1])
+                else:
+                    rows = [{'status': 'failed: ' + (proc.stderr.strip().splitlines() or ['?'])[-1]}]
+                for row in rows:
+                    row = {'variant': name, 'source': source, 'backend': backend, 'threads': threads, **row}
+                    if row.get('gflops_per_img') is not None:
+                        flops[name, row['imgsz']] = row['gflops_per_img']
+                    elif row.get('status') == 'ok':
+                        row['gflops_per_img'] = flops.get((name, row['imgsz']))
+                    results.append(row)
+                    print_row(row)
+    return results
+
+
+def print_row(r):
+    if r.get('status') != 'ok':
+        print(f"{r['variant']:<24} {r['backend']:<12} {r['threads']:>3}  {r['status']}")
+        return
+    print(f"{r['variant']:<24} {r['backend']:<12} {r['threads']:>3} {r['imgsz']:>5} {r['batch']:>5} "
+          f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['img_per_s']:>8.1f} {r['peak_rss_mb']:>8.0f} "
+          f"{r['gflops_per_img'] if r['gflops_per_img'] is not None else '-':>7}")
+
+
+def environment():
+    import torch
+    import ultralytics
+
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'host': platform.node(),
+        'cpu': platform.processor() or platform.machine(),
+        'cores': os.cpu_count(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'ultralytics': ultralytics.__version__,
+    }
+
+
+def compare(base, new, threshold=0.1):
+    """
+    Rows of `new` against the matching rows of `base` (same variant / backend / threads / imgsz / batch).
+    A regression is a p50 latency increase or a throughput drop of more than `threshold`, or a row
+    that was ok in `base` and is missing or not ok in `new`.
+    Returns:
+        list: Regressed rows as (key, metric, old, new, change); metric 'status' for missing / failed rows.
+    """
+    key = lambda r: tuple(r.get(k) for k in KEY_FIELDS)
+    rows = {key(r): r for r in new['results']}
+    # A worker that crashed reports one row without imgsz / batch for its variant / backend / threads
+    failed = {key(r)[:3]: r for r in new['results'] if r.get('status') != 'ok'}
+    regressions = []
+    print(f"{'variant':<24} {'backend':<12} {'thr':>3} {'imgsz':>5} {'batch':>5} {'p50 old':>9} {'p50 new':>9} "
+          f"{'change':>8}")
+    for o in base['results']:
+        if o.get('status') != 'ok':
+            continue
+        r = rows.get(key(o)) or failed.get(key(o)[:3])
+        if r is None or r.get('status') != 'ok':
+            status = 'missing' if r is None else r['status']
+            regressions.append((key(o), 'status', 'ok', status, None))
+            print(f"{o['variant']:<24} {o['backend']:<12} {o['threads']:>3} {o['imgsz']:>5} {o['batch']:>5} "
+                  f"{o['p50_ms']:>9.1f} {'-':>9} {'-':>8}  REGRESSION ({status})")
+            continue
+        lat = (r['p50_ms'] - o['p50_ms']) / o['p50_ms']
+        tput = (o['img_per_s'] - r['img_per_s']) / o['img_per_s']
+        flag = ''
+        if lat > threshold:
+            regressions.append((key(r), 'p50_ms', o['p50_ms'], r['p50_ms'], lat))
+            flag = '  REGRESSION'
+        elif tput > threshold:
+            regressions.append((key(r), 'img_per_s', o['img_per_s'], r['img_per_s'], -tput))
+            flag = '  REGRESSION (throughput)'
+        print(f"{r['variant']:<24} {r['backend']:<12} {r['threads']:>3} {r['imgsz']:>5} {r['batch']:>5} "
+              f"{o['p50_ms']:>9.1f} {r['p50_ms']:>9.1f} {100 * lat:>+7.1f}%{flag}")
+    print(f"{len(regressions)} regression(s) over {100 * threshold:.0f}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference benchmark: latency / throughput / memory / GFLOPs sweep")
+    parser.add_argument('--configs', nargs='*', default=DEFAULT_CONFIGS, help='Configs whose model_cfg (or weights) to benchmark')
+    parser.add_argument('--use-weights', action='store_true', help="Benchmark the configs' weights instead of their YAMLs")
+    parser.add_argument('--models', nargs='*', default=[], help='Extra model YAMLs or weights')
+    parser.add_argument('--backends', nargs='+', default=['pt'], help='pt onnx onnx-int8 ... (weights only)')
+    parser.add_argument('--imgsz', type=int, nargs='+', default=[320, 640])
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count() or 1])
+    parser.add_argument('--iters', type=int, default=20, help='Timed iterations per point')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--images', type=str, default=None, help='Real images to use instead of seeded random frames')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--out', type=str, default='runs/benchmark/benchmark.json')
+    parser.add_argument('--compare', nargs='+', metavar='JSON',
+                        help='BASE: compare this run against it; BASE NEW: only compare two saved runs')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown flagged as a regression')
+    parser.add_argument('--worker', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_cell(json.loads(args.worker))))
+        return
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as f1, open(args.compare[1]) as f2:
+            sys.exit(1 if compare(json.load(f1), json.load(f2), args.threshold) else 0)
+
+    print(f"{'variant':<24} {'backend':<12} {'thr':>3} {'imgsz':>5} {'batch':>5} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'img/s':>8} {'RSS MB':>8} {'GFLOPs':>7}")
+    report = {'environment': environment(),
+              'settings': {k: v for k, v in vars(args).items() if k not in ('worker', 'compare', 'out')},
+              'results': run_sweep(args)}
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.out}")
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            sys.exit(1 if compare(json.load(f), report, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
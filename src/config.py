@@ -0,0 +1,395 @@
+import copy
+import dataclasses
+import difflib
+import functools
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Literal, Optional, Union, get_args, get_origin
+
+import yaml
+
+from backends import BACKENDS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG = 'train_config.yaml'
+# HELMET_BACKEND=onnx, HELMET_PREDICT__BATCH=32 ('__' separates levels); HELMET_CONFIG picks the YAML file
+ENV_PREFIX = 'HELMET_'
+RESOLVED_NAME = 'config.resolved.yaml'
+
+
+class ConfigError(ValueError):
+    """Unknown key, wrong type or malformed override in a config."""
+
+
+# --- Schema: one dataclass per section, the defaults every module merges its section over ---
+
+@dataclass
+class DatasetCacheConfig:
+    enabled: bool = False
+    dir: Optional[str] = None          # Defaults to '.index' next to the data YAML
+    hash: bool = False                 # Detect changes by content hash instead of mtime
+
+
+@dataclass
+class MemoryBudgetConfig:
+    enabled: bool = False
+    budget_gb: Optional[float] = None  # Memory the training step may use; null = 90% of what is free on the device
+    effective_batch: int = 64          # Images per optimizer step (Ultralytics `nbs`), reached by gradient accumulation
+    max_batch: int = 64                # Largest micro-batch probed
+    checkpoint: Union[bool, Literal['auto']] = False # Activation checkpointing of the high-resolution C3k2 blocks
+    checkpoint_stride: int = 4         # Blocks whose output stride is <= this are checkpointed (4 = the P2 blocks)
+
+
+@dataclass
+class DemoConfig:
+    queue_depth: int = 1               # Frames buffered between decode/inference/display (only the newest are kept)
+    loop_files: bool = False           # Restart video files when they end (cameras are unaffected)
+    model_cache: int = 3               # Loaded models kept in memory
+    warmup: bool = True                # Dummy forward pass right after a load
+
+
+@dataclass
+class MultiStreamConfig:
+    batch: int = 8                     # Max frames (one per stream) per forward pass
+    max_wait: float = 0.02             # Seconds to wait for a batch to fill
+
+
+@dataclass
+class PredictConfig:
+    source: str = "datasets/Safety-Helmet-Wearing-Dataset.v3-base-dataset.yolov11/test/images"
+    batch: int = 16                    # Images per forward pass
+    workers: int = 4                   # Image decoding threads
+    prefetch: int = 2                  # Decoded batches kept ahead of the model
+    write_queue: int = 256             # Results buffered for the writer thread
+    format: Literal['jsonl', 'parquet', 'coco'] = 'jsonl'
+    output: Optional[str] = None       # Defaults to runs/predict/predictions.<format>
+    conf: float = 0.25
+    save_images: bool = False
+
+
+@dataclass
+class VideoConfig:
+    output_dir: str = 'runs/video'
+    batch: int = 8                     # Frames per forward pass
+    conf: float = 0.25
+    save: Literal['clips', 'full', 'none'] = 'clips' # clips (only around no-helmet events) | full | none
+    pre_roll: float = 3.0              # Seconds of video before an event that its clip starts with
+    post_roll: float = 3.0             # Seconds recorded after the last event of a clip
+    codec: str = 'mp4v'                # FourCC of the written videos
+    hw_accel: bool = True              # Let OpenCV pick a hardware decoder / encoder if there is one
+    queue: int = 32                    # Frames buffered between decode, inference and encode (bounds memory)
+    save_detections: bool = False      # Per-frame detections as JSON lines
+    jobs: int = 1                      # Files processed concurrently (one process and model each)
+
+
+@dataclass
+class TilingConfig:
+    enabled: bool = False
+    tile: int = 640                    # Tile side in pixels, also the inference size of each tile (no resizing)
+    overlap: float = 0.2               # Fraction of a tile shared with its neighbour
+    batch: int = 16                    # Tiles per forward pass
+    merge: Literal['nms', 'wbf'] = 'nms'
+    iou: float = 0.5                   # Merge threshold
+    full_frame: bool = True            # Also run the whole (downscaled) frame for objects larger than the overlap
+
+
+@dataclass
+class TrackingConfig:
+    enabled: bool = False
+    stride: int = 3                    # Run the detector every k-th frame, tracks are propagated in between
+    target_fps: Optional[float] = None # If set, adapt the stride so the pipeline keeps up with this rate
+    max_stride: int = 10
+    motion_threshold: float = 8.0      # Mean abs. grey-level change that forces a detection early (0 = off)
+    low_conf: float = 0.1              # Second-stage (ByteTrack) association threshold
+    iou: float = 0.3                   # Minimum IoU between a track and a detection
+    max_age: float = 1.0               # Seconds a track survives without a matching detection
+    min_hits: int = 2                  # Detections before a track is shown
+    smoothing: float = 0.3             # EMA weight of a new detection in the per-track class scores
+    no_helmet_class: str = 'person'    # SHWD: 'hat' = head with helmet, 'person' = bare head
+    no_helmet_seconds: float = 3.0
+    event_log: Optional[str] = None    # JSON-lines file for "no helmet" events
+
+
+@dataclass
+class MotionConfig:
+    enabled: bool = False
+    method: Literal['diff', 'mog2'] = 'diff' # diff (against the last detected frame) | mog2 (background subtraction)
+    width: int = 320                   # Motion analysis runs on a grey copy this wide
+    pixel_threshold: float = 25        # Grey-level change for a pixel to count as moving (diff) / MOG2 varThreshold
+    min_area: float = 0.0005           # Smallest moving blob, as a fraction of the frame
+    history: int = 300                 # MOG2 background history in frames
+    refresh: float = 5.0               # Seconds after which the full frame is detected again even without motion
+    roi: bool = True                   # Detect only inside the moving regions (needs dynamic input shapes)
+    roi_pad: int = 32                  # Pixels of context added around each moving region
+    max_roi_area: float = 0.5          # Regions covering more than this fraction of the frame -> full-frame pass
+    max_rois: int = 4                  # More regions than this are merged into their bounding box
+
+
+@dataclass
+class ServerConfig:
+    host: str = '127.0.0.1'
+    port: int = 8510
+    max_batch: int = 8                 # Requests per forward pass
+    max_wait_ms: float = 10            # Latency budget: how long the first request of a batch waits for others
+    max_queue: int = 32                # Pending requests before new ones are rejected with 503 (backpressure)
+    timeout: float = 10.0              # Seconds a request may take in total before it is answered with 504
+    transport: Literal['auto', 'shm', 'raw', 'jpeg'] = 'auto' # Client side; auto = shm for localhost
+
+
+@dataclass
+class EvaluateConfig:
+    split: Literal['val', 'test'] = 'val'
+    conf: float = 0.25                 # Operating point for precision / recall / size-bucket recall
+    iou: float = 0.7                   # NMS IoU, as in model.val()
+    max_det: int = 300
+    batch: int = 16
+    cache_dir: str = 'runs/eval'
+    matching: Literal['auto', 'iou', 'confidence'] = 'auto' # auto = the rule of the installed Ultralytics' model.val()
+
+
+@dataclass
+class TelemetryConfig:
+    window: int = 512                  # Samples per stage kept for the rolling percentiles
+    log: Optional[str] = None          # JSON-lines file, one snapshot every `log_every` seconds
+    log_every: float = 10.0
+    port: Optional[int] = None         # Serve http://127.0.0.1:<port>/metrics (Prometheus text) and /metrics.json
+    overlay: bool = True               # Demo: draw the stage timings onto the video
+
+
+@dataclass
+class Config:
+    use_innovations: bool = True       # CBAM + Inner-WIoU patches (false = baseline YOLOv11)
+    wiou_focusing: bool = False        # Inner-WIoU v3 non-monotonic focusing
+    data: str = 'datasets/data.yaml'
+    model_cfg: str = 'models/yolov11s-cbam.yaml'
+    weights: Optional[str] = None      # Pretrained weights for training, the model for inference; null = from scratch
+    backend: Literal[tuple(BACKENDS)] = 'pt'
+    server_url: Optional[str] = None   # Thin-client mode against a running server.py
+    threads: Optional[int] = None      # Intra-op CPU threads for inference (torch / ONNX Runtime); null = library default
+    epochs: int = 50
+    batch: int = 8
+    imgsz: int = 640
+    device: Union[int, str, None] = 0  # 0 | '0,1' | cpu
+    project: str = 'runs/train'
+    name: str = 'exp'
+    train_args: dict = field(default_factory=dict) # Any other Ultralytics train argument (checked by Ultralytics)
+    dataset_cache: DatasetCacheConfig = field(default_factory=DatasetCacheConfig)
+    memory_budget: MemoryBudgetConfig = field(default_factory=MemoryBudgetConfig)
+    demo: DemoConfig = field(default_factory=DemoConfig)
+    multi_stream: MultiStreamConfig = field(default_factory=MultiStreamConfig)
+    predict: PredictConfig = field(default_factory=PredictConfig)
+    video: VideoConfig = field(default_factory=VideoConfig)
+    tiling: TilingConfig = field(default_factory=TilingConfig)
+    tracking: TrackingConfig = field(default_factory=TrackingConfig)
+    motion: MotionConfig = field(default_factory=MotionConfig)
+    server: ServerConfig = field(default_factory=ServerConfig)
+    evaluate: EvaluateConfig = field(default_factory=EvaluateConfig)
+    telemetry: TelemetryConfig = field(default_factory=TelemetryConfig)
+
+
+def defaults(section):
+    """Default values of one config section as a plain dict, e.g. defaults('tiling')."""
+    return dataclasses.asdict(_section_types()[section]())
+
+
+@functools.lru_cache(maxsize=None)
+def _section_types():
+    return {f.name: f.type for f in dataclasses.fields(Config) if dataclasses.is_dataclass(f.type)}
+
+
+# --- Validation ---
+
+def _type_name(tp):
+    if get_origin(tp) is Literal:
+        return ' | '.join(repr(a) for a in get_args(tp))
+    if get_origin(tp) is Union:
+        return ' | '.join(_type_name(a) for a in get_args(tp))
+    return 'null' if tp is type(None) else getattr(tp, '__name__', str(tp))
+
+
+def _check(value, tp, path):
+    """`value` converted to `tp` (ints are accepted for floats); ConfigError if it does not fit."""
+    origin = get_origin(tp)
+    if origin is Union:
+        for arg in get_args(tp):
+            try:
+                return _check(value, arg, path)
+            except ConfigError:
+                pass
+    elif origin is Literal:
+        if any(value == a and type(value) is type(a) for a in get_args(tp)):
+            return value
+    elif dataclasses.is_dataclass(tp):
+        return _build(tp, value, path)
+    elif tp is type(None):
+        if value is None:
+            return None
+    elif tp is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    elif tp is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    elif isinstance(value, tp):
+        return copy.deepcopy(value)
+    raise ConfigError(f"{path}: expected {_type_name(tp)}, got {value!r}")
+
+
+def _build(cls, data, path=''):
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ConfigError(f"{path or 'config'}: expected a mapping, got {data!r}")
+    known = {f.name: f for f in dataclasses.fields(cls)}
+    for key in data:
+        if key not in known:
+            hint = difflib.get_close_matches(str(key), known, n=1)
+            where = f"section '{path}'" if path else 'the config'
+            raise ConfigError(f"Unknown key '{key}' in {where}" + (f", did you mean '{hint[0]}'?" if hint else ''))
+    out = {}
+    for name, f in known.items():
+        key = f"{path}.{name}" if path else name
+        if name in data:
+            out[name] = _check(data[name], f.type, key)
+        elif dataclasses.is_dataclass(f.type):
+            out[name] = _build(f.type, {}, key)
+        else:
+            default = f.default_factory() if f.default is dataclasses.MISSING else f.default
+            out[name] = copy.deepcopy(default)
+    return out
+
+
+def resolve(data):
+    """
+    Validate a raw config dict and fill in every default.
+    Returns:
+        dict: Complete config (plain nested dicts, as the scripts use it).
+    Raises:
+        ConfigError: On an unknown key or a value of the wrong type.
+    """
+    return _build(Config, data)
+
+
+# --- Layers: defaults <- YAML <- HELMET_* environment <- --set overrides ---
+
+def set_key(cfg, dotted, value):
+    """cfg['a']['b'] = value for 'a.b' (missing levels are created)."""
+    *parents, last = dotted.split('.')
+    for p in parents:
+        if not isinstance(cfg.get(p), dict):
+            cfg[p] = {}
+        cfg = cfg[p]
+    cfg[last] = value
+
+
+def parse_override(item):
+    """'predict.batch=32' -> ('predict.batch', 32); values are parsed as YAML."""
+    key, sep, value = item.partition('=')
+    if not sep or not key:
+        raise ConfigError(f"Override '{item}' must look like key.path=value")
+    return key.strip(), yaml.safe_load(value)
+
+
+def env_overrides(env=None):
+    """
+    (dotted key, value) pairs from HELMET_* variables, in a stable order. Only variables whose first
+    segment is a top-level config key count; other HELMET_* names (HELMET_HOME, ...) belong to
+    something else and are skipped with a warning.
+    """
+    env = os.environ if env is None else env
+    known = frozenset(f.name for f in dataclasses.fields(Config))
+    out = []
+    for name in sorted(env):
+        if not name.startswith(ENV_PREFIX) or name == ENV_PREFIX + 'CONFIG':
+            continue
+        key = name[len(ENV_PREFIX):].lower().split('__')
+        if key[0] not in known:
+            _warn_env(name, key[0], known)
+            continue
+        out.append(('.'.join(key), yaml.safe_load(env[name])))
+    return out
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_env(name, key, known):
+    hint = difflib.get_close_matches(key, sorted(known), n=1)
+    print(f"Warning: ignoring environment variable {name}, '{key}' is not a config key"
+          + (f" (did you mean {ENV_PREFIX}{hint[0].upper()}?)" if hint else ''))
+
+
+def find_config(path=None, env=None):
+    """
+    Config file to load: `path` (as given, else relative to the project root), HELMET_CONFIG, or
+    the project's train_config.yaml. A path that exists in neither place is an error.
+    """
+    env = os.environ if env is None else env
+    path = path or env.get(ENV_PREFIX + 'CONFIG') or DEFAULT_CONFIG
+    for candidate in (path, os.path.join(ROOT, path)):
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+    raise FileNotFoundError(f"Config file '{path}' not found (also looked in {ROOT})")
+
+
+@functools.lru_cache(maxsize=16)
+def _load(path, stamp, layers):
+    # `stamp` (size, mtime) is only part of the cache key, so an edited file is read again.
+    # `layers` is the JSON of the env + CLI (key, value) pairs: YAML values may be unhashable lists
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f) or {}
+    if not isinstance(data, dict):
+        raise ConfigError(f"{path}: top level must be a mapping")
+    for key, value in json.loads(layers):
+        set_key(data, key, value)
+    try:
+        return resolve(data)
+    except ConfigError as e:
+        raise ConfigError(f"{path}: {e}") from None
+
+
+def load(path=None, overrides=(), env=None):
+    """
+    Load, layer and validate a config. Repeated calls with the same file (unchanged on disk),
+    environment and overrides return a copy of the cached result.
+    Args:
+        path (str): YAML file, see find_config.
+        overrides (list): 'key.path=value' strings or (key, value) pairs, applied last.
+        env (dict): Environment to read HELMET_* variables from (default: os.environ).
+    Returns:
+        dict: The resolved config.
+    """
+    path = find_config(path, env)
+    st = os.stat(path)
+    pairs = [parse_override(o) if isinstance(o, str) else tuple(o) for o in overrides or ()]
+    layers = json.dumps(env_overrides(env) + pairs, default=str)
+    return copy.deepcopy(_load(path, (st.st_size, st.st_mtime_ns), layers))
+
+
+def add_override_argument(parser):
+    """The --set option every entry point takes next to --config."""
+    parser.add_argument('--set', nargs='+', default=[], metavar='KEY=VALUE',
+                        help='Config overrides applied after the YAML and HELMET_* variables, e.g. predict.batch=32')
+
+
+# --- Reproducibility ---
+
+def fingerprint(cfg):
+    """Short content hash of a resolved config."""
+    return hashlib.sha1(json.dumps(cfg, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def save_resolved(cfg, out_dir):
+    """
+    Write the resolved config next to a run's outputs, so the run can be repeated with
+    `--config <out_dir>/config.resolved.yaml`.
+    Returns:
+        str: Path of the written file.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, RESOLVED_NAME)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"# Resolved config {fingerprint(cfg)}, {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        yaml.safe_dump(cfg, f, allow_unicode=True, sort_keys=False)
+    return path
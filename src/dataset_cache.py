@@ -0,0 +1,397 @@
+import argparse
+import hashlib
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from ultralytics.data.dataset import YOLODataset
+
+from utils import load_config, resolve_split_dir
+from config import add_override_argument
+
+# Box side (sqrt of area, original-image pixels) histogram edges; helmets are mostly < 32px
+SIZE_BINS = np.array([0, 8, 16, 32, 64, 96, 128, 256, np.inf])
+INDEX_VERSION = 1
+
+
+def index_dir(cache_root, img_dir):
+    """Index directory of one image folder, e.g. <root>/valid-1a2b3c4d."""
+    img_dir = os.path.normpath(os.path.abspath(img_dir))
+    parent = os.path.basename(os.path.dirname(img_dir)) or 'images'
+    return os.path.join(cache_root, f"{parent}-{hashlib.sha1(img_dir.encode()).hexdigest()[:8]}")
+
+
+def label_path(img_path):
+    # Same convention as Ultralytics: the last /images/ component becomes /labels/
+    head, sep, tail = img_path.rpartition(f'{os.sep}images{os.sep}')
+    return os.path.splitext(head + f'{os.sep}labels{os.sep}' + tail if sep else img_path)[0] + '.txt'
+
+
+def file_stamp(path, use_hash=False):
+    """'size:mtime_ns' of a file, or 'size:sha1' with use_hash (survives touch/copy); None if missing."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if use_hash:
+        with open(path, 'rb') as f:
+            return f"{st.st_size}:{hashlib.sha1(f.read()).hexdigest()}"
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def read_labels(path):
+    """
+    Parse a YOLO label file into an (N, 5) float32 array of cls, x, y, w, h (normalized).
+    Polygon rows (segment labels) are reduced to their bounding box; duplicate rows are dropped.
+    Returns None for a corrupt file (unparsable, or box and polygon rows mixed), like Ultralytics does.
+    """
+    rows, kinds = [], set()
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    v = line.split()
+                    if len(v) == 5:
+                        rows.append([float(x) for x in v])
+                    elif len(v) > 5:
+                        xy = np.array(v[1:], dtype=np.float32).reshape(-1, 2)
+                        (x1, y1), (x2, y2) = xy.min(0), xy.max(0)
+                        rows.append([float(v[0]), (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+                    elif v:
+                        return None
+                    if v:
+                        kinds.add(len(v) == 5)
+            except ValueError:
+                return None
+    if len(kinds) > 1:
+        return None
+    if not rows:
+        return np.zeros((0, 5), dtype=np.float32)
+    lb = np.array(rows, dtype=np.float32)
+    lb[:, 1:] = lb[:, 1:].clip(0, 1)
+    lb = lb[(lb[:, 3] > 0) & (lb[:, 4] > 0)]
+    _, keep = np.unique(lb, axis=0, return_index=True)
+    return lb[np.sort(keep)]
+
+
+def load_resized(path, imgsz):
+    """Decode and resize the long side to `imgsz`, exactly as Ultralytics' load_image(rect_mode=True) does."""
+    from predict import read_image
+
+    im = read_image(path)
+    if im is None:
+        return None, None
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(im), (h0, w0)
+
+
+class SplitIndex:
+    """
+    Read side of one indexed image folder:
+      index.npz   - file list, stamps, shard offsets/shapes and all labels in one (M, 5) array
+      images.bin  - resized BGR images back to back, read through a memory map
+    The memory map is opened lazily so dataloader workers (fork or spawn) each map it themselves.
+    """
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, 'index.npz')) as z:
+            self.meta = {k: z[k] for k in z.files}
+        self.files = [str(f) for f in self.meta['files']]
+        self.imgsz = int(self.meta['imgsz'])
+        self._shard = None
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getstate__(self):
+        return {**self.__dict__, '_shard': None}
+
+    @property
+    def shard(self):
+        if self._shard is None:
+            bin_path = os.path.join(self.path, 'images.bin')
+            # Copy-on-write: augmentations that modify an image in place never touch the file
+            self._shard = np.memmap(bin_path, dtype=np.uint8, mode='c') if os.path.getsize(bin_path) else np.zeros(0, np.uint8)
+        return self._shard
+
+    def image(self, i):
+        """Zero-copy (h, w, 3) view of image i and its original (h0, w0)."""
+        off = int(self.meta['offsets'][i])
+        h, w = self.meta['hw'][i]
+        return self.shard[off:off + h * w * 3].reshape(h, w, 3), tuple(int(x) for x in self.meta['hw0'][i])
+
+    def labels(self, i):
+        b = self.meta['box_offsets']
+        return self.meta['labels'][b[i]:b[i + 1]]
+
+    def summary(self):
+        return {
+            'images': len(self),
+            'boxes': int(self.meta['box_offsets'][-1]),
+            'class_counts': self.meta['class_counts'].tolist(),
+            'size_hist': self.meta['size_hist'].tolist(),
+            'shard_mb': os.path.getsize(os.path.join(self.path, 'images.bin')) / 2 ** 20,
+        }
+
+
+def build_split(img_dir, out_dir, imgsz, use_hash=False, workers=8, compact_ratio=0.5):
+    """
+    Create or incrementally update the index of one image folder.
+    Unchanged images (same size/mtime, or hash) keep their bytes in the shard; changed and new
+    ones are appended. The shard is rewritten once dead bytes exceed `compact_ratio` of it.
+    Returns:
+        dict: Counts of reused / re-decoded images and labels, and whether the shard was compacted.
+    """
+    from predict import list_images
+
+    os.makedirs(out_dir, exist_ok=True)
+    bin_path, idx_path = os.path.join(out_dir, 'images.bin'), os.path.join(out_dir, 'index.npz')
+    old = None
+    if os.path.exists(idx_path) and os.path.exists(bin_path):
+        old = SplitIndex(out_dir)
+        if int(old.meta['version']) != INDEX_VERSION or old.imgsz != imgsz or bool(old.meta['hashed']) != use_hash:
+            old = None # Different resize / stamp scheme, start over
+    if old is None:
+        open(bin_path, 'wb').close()
+    prev = {f: i for i, f in enumerate(old.files)} if old else {}
+
+    paths = list_images(img_dir)
+    files = [os.path.relpath(p, img_dir) for p in paths]
+    img_stamps = [file_stamp(p, use_hash) for p in paths]
+    lbl_stamps = [file_stamp(label_path(p), use_hash) or '' for p in paths]
+
+    n = len(paths)
+    offsets, hw, hw0 = np.zeros(n, np.int64), np.zeros((n, 2), np.int32), np.zeros((n, 2), np.int32)
+    labels, keep = [], np.ones(n, bool)
+    todo, stats = [], {'images': n, 'reused': 0, 'decoded': 0, 'labels_parsed': 0, 'unreadable': 0, 'compacted': False}
+    for i, f in enumerate(files):
+        j = prev.get(f)
+        if j is not None and old.meta['img_stamps'][j] == img_stamps[i]:
+            offsets[i], hw[i], hw0[i] = old.meta['offsets'][j], old.meta['hw'][j], old.meta['hw0'][j]
+            stats['reused'] += 1
+        else:
+            todo.append(i)
+        if j is not None and old.meta['lbl_stamps'][j] == lbl_stamps[i]:
+            labels.append(old.labels(j))
+            continue
+        lb = read_labels(label_path(paths[i]))
+        stats['labels_parsed'] += 1
+        if lb is None:
+            print(f"Warning: corrupt label file {label_path(paths[i])}, leaving {files[i]} out of the index")
+            keep[i] = False
+            if todo and todo[-1] == i:
+                todo.pop() # No need to decode an image that is left out
+        labels.append(lb)
+
+    # Decode changed images on a thread pool (cv2 releases the GIL) and append them in order
+    if todo:
+        with ThreadPoolExecutor(max_workers=workers) as pool, open(bin_path, 'ab') as out:
+            end = out.seek(0, os.SEEK_END)
+            for i, (im, shape0) in zip(todo, pool.map(lambda k: load_resized(paths[k], imgsz), todo)):
+                if im is None:
+                    print(f"Warning: could not read {paths[i]}, leaving it out of the index")
+                    keep[i] = False
+                    stats['unreadable'] += 1
+                    continue
+                out.write(im.data)
+                offsets[i], hw[i], hw0[i] = end, im.shape[:2], shape0
+                end += im.nbytes
+                stats['decoded'] += 1
+
+    idx = np.flatnonzero(keep)
+    sizes = hw[idx].prod(1).astype(np.int64) * 3
+    dead = os.path.getsize(bin_path) - int(sizes.sum())
+    if dead > compact_ratio * os.path.getsize(bin_path):
+        offsets[idx] = compact_shard(bin_path, offsets[idx], sizes)
+        stats['compacted'] = True
+
+    labels = [labels[i] for i in idx]
+    all_labels = np.concatenate(labels) if labels else np.zeros((0, 5), np.float32)
+    counts = np.array([len(lb) for lb in labels], np.int64)
+    box_hw0 = np.repeat(hw0[idx], counts, axis=0)
+    side = np.sqrt(all_labels[:, 3] * box_hw0[:, 1] * all_labels[:, 4] * box_hw0[:, 0])
+    np.savez(
+        idx_path + '.tmp.npz',
+        version=INDEX_VERSION, imgsz=imgsz, hashed=use_hash,
+        files=np.array([files[i] for i in idx]),
+        img_stamps=np.array([img_stamps[i] for i in idx]),
+        lbl_stamps=np.array([lbl_stamps[i] for i in idx]),
+        offsets=offsets[idx], hw=hw[idx], hw0=hw0[idx],
+        box_offsets=np.concatenate([[0], np.cumsum(counts)]),
+        labels=all_labels,
+        class_counts=np.bincount(all_labels[:, 0].astype(np.int64), minlength=1),
+        size_hist=np.histogram(side, SIZE_BINS)[0],
+    )
+    # Replace the index only once the shard holds every byte it points to
+    os.replace(idx_path + '.tmp.npz', idx_path)
+    return stats
+
+
+def compact_shard(bin_path, offsets, sizes):
+    """Rewrite the shard with only the live images (in index order); returns their new offsets."""
+    src = np.memmap(bin_path, dtype=np.uint8, mode='r')
+    new = np.zeros_like(offsets)
+    with open(bin_path + '.tmp', 'wb') as out:
+        pos = 0
+        for k, (off, size) in enumerate(zip(offsets, sizes)):
+            out.write(src[off:off + size].data)
+            new[k] = pos
+            pos += size
+    del src
+    os.replace(bin_path + '.tmp', bin_path)
+    return new
+
+
+def build_index(data_yaml, imgsz=640, cache_root=None, splits=('train', 'val', 'test'), use_hash=False, workers=8):
+    """
+    Index every split of `data_yaml` that exists on disk.
+    Args:
+        data_yaml (str): Path to the dataset YAML.
+        imgsz (int): Training size; images are stored with their long side resized to it.
+        cache_root (str): Where shards go, defaults to '.index' next to the data YAML.
+        use_hash (bool): Compare content hashes instead of mtimes (files that were only touched or
+            re-copied are not re-decoded, at the cost of reading every file on each refresh).
+    Returns:
+        str: The cache root, to be passed to use_dataset_cache().
+    """
+    import yaml
+
+    with open(data_yaml, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    cache_root = cache_root or os.path.join(os.path.dirname(os.path.abspath(data_yaml)), '.index')
+    seen = set()
+    for split in splits:
+        if not data.get(split):
+            continue
+        img_dir = resolve_split_dir(data_yaml, split)
+        if not os.path.isdir(img_dir) or img_dir in seen:
+            continue
+        seen.add(img_dir)
+        t0 = time.perf_counter()
+        out = index_dir(cache_root, img_dir)
+        stats = build_split(img_dir, out, imgsz, use_hash, workers)
+        print(f"[{split}] {img_dir}: {stats['images']} images, {stats['reused']} reused, {stats['decoded']} decoded, "
+              f"{stats['labels_parsed']} label files parsed{', shard compacted' if stats['compacted'] else ''} "
+              f"({time.perf_counter() - t0:.1f}s)")
+    return cache_root
+
+
+def use_dataset_cache(cache_root):
+    """
+    Make Ultralytics build CachedYOLODataset for training and validation.
+    Folders without an index under `cache_root` silently use the normal loader.
+    """
+    from ultralytics.data import build
+
+    CachedYOLODataset.cache_root = cache_root
+    build.YOLODataset = CachedYOLODataset
+
+
+class CachedYOLODataset(YOLODataset):
+    """
+    YOLODataset that reads labels from the index and images zero-copy from the shard.
+    Hooks that only newer Ultralytics releases have (verify_labels, channels, resize_short) are
+    used when present, so the whole ultralytics>=8.3.0 range works.
+    """
+    cache_root = None
+
+    def __init__(self, *args, **kwargs):
+        img_path = kwargs.get('img_path', args[0] if args else None)
+        self.index = None
+        if self.cache_root and isinstance(img_path, str):
+            path = index_dir(self.cache_root, img_path)
+            if os.path.exists(os.path.join(path, 'index.npz')):
+                self.index = SplitIndex(path)
+                if self.index.imgsz != kwargs.get('imgsz', 640):
+                    print(f"Index {path} was built for imgsz={self.index.imgsz}, decoding images normally")
+                    self.index = None
+        super().__init__(*args, **kwargs)
+
+    def get_img_files(self, img_path):
+        if self.index is None:
+            return super().get_img_files(img_path)
+        files = self.index.files
+        # Same as Ultralytics: `fraction` is a 0-1 share of the split, applied only below 1
+        if self.fraction < 1:
+            files = files[:round(len(files) * self.fraction)]
+        self.index_pos = {os.path.join(img_path, f): k for k, f in enumerate(files)}
+        return [os.path.join(img_path, f) for f in files]
+
+    def get_labels(self):
+        if self.index is None:
+            return super().get_labels()
+        labels = []
+        for f in self.im_files:
+            k = self.index_pos[f]
+            lb = self.index.labels(k)
+            labels.append({
+                'im_file': f,
+                'shape': tuple(int(x) for x in self.index.meta['hw0'][k]),
+                'cls': lb[:, :1],
+                'bboxes': lb[:, 1:],
+                'segments': [],
+                'keypoints': None,
+                'normalized': True,
+                'bbox_format': 'xywh',
+            })
+        if hasattr(self, 'verify_labels'):
+            self.verify_labels(labels, self.index.path)
+        elif not any(len(lb['cls']) for lb in labels):
+            print(f"Warning: no labels found in {self.index.path}, training may not work correctly")
+        return labels
+
+    def load_image(self, i, rect_mode=True, resize_short=False):
+        if self.index is None or not rect_mode or resize_short or getattr(self, 'channels', 3) != 3 or self.ims[i] is not None:
+            # resize_short is only passed on by releases whose load_image takes it
+            return super().load_image(i, rect_mode, **({'resize_short': True} if resize_short else {}))
+        im, hw0 = self.index.image(self.index_pos[self.im_files[i]])
+        if self.augment and self.cache != 'ram':
+            # Keep the mosaic buffer bookkeeping; the "cached" image is only a view into the shard
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, hw0, im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, hw0, im.shape[:2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / refresh the label index and memory-mapped image shards")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--data', type=str, default=None, help='Override data YAML from config')
+    parser.add_argument('--imgsz', type=int, default=None)
+    parser.add_argument('--dir', type=str, default=None, help="Cache root (default: '.index' next to the data YAML)")
+    parser.add_argument('--splits', nargs='+', default=['train', 'val', 'test'])
+    parser.add_argument('--hash', action='store_true', help='Compare content hashes instead of mtimes')
+    parser.add_argument('--workers', type=int, default=8)
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    ccfg = cfg.get('dataset_cache') or {}
+    data = args.data or cfg['data']
+    imgsz = args.imgsz or cfg.get('imgsz', 640)
+    root = build_index(data, imgsz, args.dir or ccfg.get('dir'), args.splits,
+                       args.hash or ccfg.get('hash', False), args.workers)
+
+    import yaml
+    with open(data, 'r', encoding='utf-8') as f:
+        names = yaml.safe_load(f).get('names') or []
+    names = list(names.values()) if isinstance(names, dict) else names
+    for d in sorted(os.listdir(root)):
+        s = SplitIndex(os.path.join(root, d)).summary()
+        counts = ', '.join(f"{names[c] if c < len(names) else c}={n}" for c, n in enumerate(s['class_counts']))
+        hist = ' '.join(f"<{int(e)}:{n}" for e, n in zip(SIZE_BINS[1:-1], s['size_hist'])) + f" >=256:{s['size_hist'][-1]}"
+        print(f"{d}: {s['images']} images, {s['boxes']} boxes ({counts}), shard {s['shard_mb']:.1f} MB")
+        print(f"    box size (px): {hist}")
+
+
+if __name__ == '__main__':
+    main()
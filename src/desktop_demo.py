@@ -1,14 +1,32 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-import cv2
+from tkinter import filedialog, ttk
 import numpy as np
 import threading
+import queue
 import time
-from PIL import Image, ImageTk
-from ultralytics import YOLO
+import collections
 from utils import load_config
+from config import resolve
+from backends import set_threads
+from model_cache import ModelCache
+from pipeline import LatestQueue, QueueClosed
+from tiling import TILING_DEFAULTS, TiledPredictor
+from telemetry import telemetry_from_config, draw_overlay
+from vis import draw_result, resize_for_display
+from tracking import TRACKING_DEFAULTS, TrackingDetector
+from motion import MOTION_DEFAULTS, MotionGatedPredictor
+from server import RemoteModel
 import os
 import sys
+# ultralytics / torch (the bulk of a cold start) are only imported by the model loader thread,
+# cv2 on the first opened file or frame (here and in vis / tracking / motion) and PIL on the first
+# displayed frame, so the window shows up before any of them is loaded
+
+# Image mode runs the model once with these loose settings and keeps the raw boxes; the confidence /
+# IoU sliders and class toggles then only re-filter that cache instead of running the network again
+IMAGE_CACHE_CONF = 0.01
+IMAGE_CACHE_IOU = 0.95
+IMAGE_CACHE_MAX_DET = 1000
 
 class DesktopDemoApp:
     def __init__(self, root):
@@ -16,22 +34,70 @@ class DesktopDemoApp:
         self.root.title("工地安全帽检测系统 (Safety Helmet Detection)")
         self.root.geometry("1400x800")
         
-        # Load Config
+        # Load Config ($HELMET_CONFIG or train_config.yaml); a broken config fails here instead of
+        # showing up later as a silently ignored setting, a missing file falls back to the defaults
         try:
             self.cfg = load_config()
-            self.default_model = self.cfg.get('weights', 'yolo11s.pt')
-        except:
-            self.default_model = "yolo11s.pt"
+        except FileNotFoundError as e:
+            print(f"{e}, using the default settings")
+            self.cfg = resolve({})
+        self.default_model = self.cfg.get('weights') or "yolo11s.pt"
+        self.backend = self.cfg.get('backend', 'pt')
+        # Thin client mode: detections come from a running server.py instead of an in-process model
+        self.server_url = self.cfg.get('server_url')
+        # Per-stage timings / counters (overlay, optional JSON log and metrics endpoint) and the startup timeline
+        self.telemetry = telemetry_from_config(self.cfg).start()
+        self.telemetry.mark('app_init')
 
+        demo_cfg = self.cfg.get('demo') or {}
+        # Loaded + warmed-up models, so switching back to a model is instant
+        self.models = ModelCache(demo_cfg.get('model_cache', 3), demo_cfg.get('warmup', True), self.cfg.get('imgsz', 640))
+        self.loading = None # Model load running on the worker thread
         self.model = None
-        self.thread = None
+        self.tiled_model = None
+        self.tiling = {**TILING_DEFAULTS, **(self.cfg.get('tiling') or {})}
+        # Video only: detector every k-th frame + IoU tracks in between, per-person "no helmet" events
+        self.tracking = {**TRACKING_DEFAULTS, **(self.cfg.get('tracking') or {})}
+        self.video_detector = None
+        # Video only: skip the detector on static frames / detect only the moving regions
+        self.motion = {**MOTION_DEFAULTS, **(self.cfg.get('motion') or {})}
+        self.motion_gate = None
+        self.recent_events = collections.deque(maxlen=3)
+        self.threads = []
         self.stop_event = threading.Event()
         self.current_image = None # Helper for re-inference
-        
+        self.current_result = None # Last image-mode result, redrawn on resize without re-inference
+        self.image_cache = None # Raw low-threshold detections of current_image (see IMAGE_CACHE_*)
+        self.class_vars = {} # Class id -> BooleanVar of the class toggles
+        self.class_names = {}
+        self.hidden_classes = set() # Read by the video worker, so kept as a plain set
+
+        # Video pipeline: decoder -> inference worker -> UI consumer.
+        # Each hand-off keeps only the newest frames so a slow stage drops stale frames instead of lagging.
+        self.queue_depth = demo_cfg.get('queue_depth', 1)
+        self.loop_files = demo_cfg.get('loop_files', False)
+        self.frame_queue = None
+        self.display_queue = None
+        self.frames_shown = 0
+        self.fps_mark = (time.perf_counter(), 0)
+        # Display path: frames are resized to the cached display size on the worker thread and
+        # pasted into a single PhotoImage; Tk callbacks are coalesced so the event queue never floods
+        self.display_size = (1096, 796) # Updated from <Configure>
+        self.photo = None
+        self.pending = {} # key -> after() job id
+
         self.setup_ui()
-        
-        # Load default model after UI setup
-        self.load_model(self.default_model)
+        self.telemetry.mark('ui_built')
+
+        # Load the default model once the window is on screen
+        self.root.after_idle(self.on_window_shown)
+
+    def on_window_shown(self):
+        self.telemetry.mark('window_shown')
+        if self.server_url:
+            self.load_model(self.server_url, 'remote')
+        else:
+            self.load_model(self.default_model, self.backend)
 
     def setup_ui(self):
         # LEFT SIDEBAR
@@ -48,7 +114,9 @@ class DesktopDemoApp:
         
         self.lbl_model_path = tk.Label(labelframe_model, text=self.default_model, wraplength=250, bg='#f0f0f0', fg="blue")
         self.lbl_model_path.pack(pady=5)
-        tk.Button(labelframe_model, text="选择模型文件 (Load .pt)", command=self.select_model).pack(fill=tk.X)
+        self.btn_model = tk.Button(labelframe_model, text="选择模型文件 (Load model)", command=self.select_model)
+        self.btn_model.pack(fill=tk.X)
+        self.progress = ttk.Progressbar(labelframe_model, mode='indeterminate') # Shown while a model loads
         
         # Confidence
         labelframe_conf = tk.LabelFrame(sidebar, text="置信度 (Confidence)", bg='#f0f0f0', padx=5, pady=5)
@@ -60,6 +128,23 @@ class DesktopDemoApp:
         scale = tk.Scale(labelframe_conf, from_=0.0, to=1.0, resolution=0.01, orient=tk.HORIZONTAL, 
                          variable=self.var_conf, command=self.on_conf_change)
         scale.pack(fill=tk.X)
+        self.var_iou = tk.DoubleVar(value=0.7)
+        tk.Scale(labelframe_conf, from_=0.1, to=0.95, resolution=0.05, orient=tk.HORIZONTAL, label="NMS IoU (Image)",
+                 variable=self.var_iou, command=self.on_filter_change).pack(fill=tk.X)
+        # One checkbox per class, filled in once the model (and its class names) is loaded
+        self.frame_classes = tk.Frame(labelframe_conf, bg='#f0f0f0')
+        self.frame_classes.pack(fill=tk.X)
+
+        # Sliced inference for high-resolution cameras
+        self.var_tiled = tk.BooleanVar(value=self.tiling['enabled'])
+        tk.Checkbutton(labelframe_conf, text=f"切片推理 (Tiled {self.tiling['tile']}px)", variable=self.var_tiled,
+                       bg='#f0f0f0', command=self.on_tiling_toggle).pack(anchor=tk.W)
+        self.var_tracking = tk.BooleanVar(value=self.tracking['enabled'])
+        tk.Checkbutton(labelframe_conf, text="跟踪 / 抽帧检测 (Tracking, video)", variable=self.var_tracking,
+                       bg='#f0f0f0').pack(anchor=tk.W)
+        self.var_motion = tk.BooleanVar(value=self.motion['enabled'])
+        tk.Checkbutton(labelframe_conf, text="运动门控 (Motion gate, video)", variable=self.var_motion,
+                       bg='#f0f0f0').pack(anchor=tk.W)
 
         # Input Mode
         labelframe_input = tk.LabelFrame(sidebar, text="输入模式 (Input)", bg='#f0f0f0', padx=5, pady=5)
@@ -87,29 +172,143 @@ class DesktopDemoApp:
         
         self.lbl_image = tk.Label(self.display_frame, text="请选择输入 (Please select input)", bg="#2b2b2b", fg="white")
         self.lbl_image.pack(expand=True)
+        self.display_frame.bind("<Configure>", self.on_display_configure)
 
-    def load_model(self, path):
+    def load_model(self, path, backend='pt'):
+        # Loads on a worker thread (a cached model returns at once); the UI keeps running meanwhile
+        if self.loading is not None:
+            self.lbl_status.config(text="A model is still loading...")
+            return
+        self.lbl_status.config(text=f"Loading model: {os.path.basename(path)} ({backend})...", fg="gray")
+        self.btn_model.config(state=tk.DISABLED)
+        self.progress.pack(fill=tk.X, pady=(5, 0))
+        self.progress.start(15)
+        self.loading = {'path': path, 'backend': backend}
+        threading.Thread(target=self.load_worker, args=(self.loading,), daemon=True).start()
+        self.schedule('model_poll', 50, self.poll_model_load)
+
+    def load_worker(self, job):
+        # Worker thread: never touches Tk, the result is picked up by poll_model_load
         try:
-            self.lbl_status.config(text=f"Loading model: {os.path.basename(path)}...")
-            self.root.update()
-            self.model = YOLO(path)
-            self.lbl_model_path.config(text=os.path.basename(path))
-            self.lbl_status.config(text="Model loaded successfully.")
-            messagebox.showinfo("Success", "模型加载成功!")
+            import ultralytics # First import is a large part of a cold start, timed separately
+            self.telemetry.mark('ultralytics_imported')
+            set_threads(self.cfg.get('threads'))
+            if job['backend'] == 'remote':
+                t0 = time.perf_counter()
+                job['model'] = RemoteModel(job['path'], (self.cfg.get('server') or {}).get('transport', 'auto'))
+                job['info'] = {'hit': False, 'load_ms': 1000 * (time.perf_counter() - t0), 'warmup_ms': 0.0}
+            else:
+                job['model'] = self.models.get(job['path'], job['backend'])
+                job['info'] = dict(self.models.last)
         except Exception as e:
-            self.lbl_status.config(text="Model load failed.")
-            messagebox.showerror("Error", f"模型加载失败:\n{str(e)}")
+            job['error'] = e
+        job['done'] = True
+
+    def poll_model_load(self):
+        job = self.loading
+        if not job.get('done'):
+            self.schedule('model_poll', 50, self.poll_model_load)
+            return
+        self.loading = None
+        self.progress.stop()
+        self.progress.pack_forget()
+        self.btn_model.config(state=tk.NORMAL)
+        if 'error' in job:
+            self.lbl_status.config(text=f"模型加载失败 (Model load failed):\n{job['error']}", fg="red")
+            return
+
+        self.model = job['model']
+        self.tiled_model = TiledPredictor(self.model, imgsz=self.cfg.get('imgsz', 640), **self.tiling)
+        self.lbl_model_path.config(text=os.path.basename(job['path']))
+        self.build_class_toggles(self.model.names)
+        info = job['info']
+        how = "cached" if info['hit'] else f"load {info['load_ms'] / 1000:.1f}s, warmup {info['warmup_ms'] / 1000:.1f}s"
+        self.lbl_status.config(text=f"Model loaded ({how})", fg="gray")
+        if 'model_ready' not in self.telemetry.timeline:
+            self.telemetry.mark('model_ready')
+            print("Startup: " + ", ".join(f"{k} {v:.2f}s" for k, v in self.telemetry.timeline.items()))
+        if self.current_image is not None and not self.is_running():
+            self.inference_image(self.current_image)
 
     def select_model(self):
-        path = filedialog.askopenfilename(filetypes=[("Model Files", "*.pt")])
+        path = filedialog.askopenfilename(filetypes=[("Model Files", "*.pt *.onnx *.torchscript")])
         if path:
             self.load_model(path)
 
+    def build_class_toggles(self, names):
+        # Keep the ticks of classes that exist in the new model as well
+        shown = {self.class_names[c]: v.get() for c, v in self.class_vars.items()}
+        for w in self.frame_classes.winfo_children():
+            w.destroy()
+        self.class_vars = {}
+        for c, name in names.items():
+            var = self.class_vars[c] = tk.BooleanVar(value=shown.get(name, True))
+            tk.Checkbutton(self.frame_classes, text=name, variable=var, bg='#f0f0f0',
+                           command=self.on_filter_change).pack(side=tk.LEFT)
+        self.class_names = names
+        self.hidden_classes = {c for c, v in self.class_vars.items() if not v.get()}
+
     def on_conf_change(self, val):
         self.lbl_conf.config(text=f"{float(val):.2f}")
-        # Build-in debounce or just direct update for image
+        self.on_filter_change()
+
+    def on_filter_change(self, *_):
+        self.hidden_classes = {c for c, v in self.class_vars.items() if not v.get()}
+        # Image mode: re-filter the cached detections once the slider rests (video picks it up on the next frame)
+        if self.combo_mode.get() == "图片检测 (Image)" and self.image_cache is not None:
+            self.debounce('refilter', 15, self.refilter_image)
+
+    def on_display_configure(self, event):
+        # Cache the target size here instead of querying winfo_* for every frame
+        size = (max(event.width - 4, 10), max(event.height - 4, 10)) # Leave room for the label border
+        if size != self.display_size:
+            self.display_size = size
+            if self.current_result is not None and not self.is_running():
+                self.schedule('redraw_image', 50, self.redraw_image)
+
+    def schedule(self, key, ms, fn):
+        """Run fn on the Tk thread after `ms`; requests made while one is pending are coalesced."""
+        if key in self.pending:
+            return
+        def run():
+            self.pending.pop(key, None)
+            fn()
+        self.pending[key] = self.root.after(ms, run)
+
+    def debounce(self, key, ms, fn):
+        """Like schedule(), but every request restarts the delay, so fn runs once things settle."""
+        self.cancel(key)
+        self.schedule(key, ms, fn)
+
+    def cancel(self, key):
+        job = self.pending.pop(key, None)
+        if job is not None:
+            self.root.after_cancel(job)
+
+    def on_tiling_toggle(self):
+        # A different predictor, so the image cache has to be rebuilt
         if self.combo_mode.get() == "图片检测 (Image)" and self.current_image is not None:
-             self.inference_image(self.current_image)
+            self.schedule('infer_image', 30, lambda: self.inference_image(self.current_image))
+
+    def predictor(self):
+        # Tiled wrapper when enabled, otherwise the plain model (both return Ultralytics Results)
+        return self.tiled_model if self.var_tiled.get() else self.model
+
+    def frame_predictor(self):
+        # Video frames: predictor (plain or tiled) -> motion gate -> tracker, each rebuilt when what it wraps changes
+        base = self.predictor()
+        if not self.var_motion.get():
+            self.motion_gate = None
+        else:
+            if self.motion_gate is None or self.motion_gate.model is not base:
+                self.motion_gate = MotionGatedPredictor(base, imgsz=self.cfg.get('imgsz', 640), **self.motion)
+            base = self.motion_gate
+        if not self.var_tracking.get():
+            self.video_detector = None
+            return base
+        if self.video_detector is None or self.video_detector.model is not base:
+            self.video_detector = TrackingDetector(base, self.model.names, **self.tracking)
+        return self.video_detector
 
     def on_mode_change(self, event):
         self.stop_video()
@@ -122,14 +321,20 @@ class DesktopDemoApp:
             self.btn_cam.pack_forget()
             self.btn_open.pack(fill=tk.X, pady=2)
             self.lbl_image.config(text="请选择文件", image="")
+        self.photo = None
+        self.current_result = None
+        self.image_cache = None
 
     def open_file(self):
+        import cv2
+
         mode = self.combo_mode.get()
         if "Image" in mode:
             path = filedialog.askopenfilename(filetypes=[("Images", "*.jpg *.jpeg *.png *.bmp")])
             if path:
                 img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
                 self.current_image = img
+                self.image_cache = None
                 self.inference_image(img)
         elif "Video" in mode:
             path = filedialog.askopenfilename(filetypes=[("Videos", "*.mp4 *.avi *.mkv")])
@@ -137,7 +342,7 @@ class DesktopDemoApp:
                 self.start_video(path)
 
     def toggle_cam(self):
-        if self.thread and self.thread.is_alive():
+        if self.is_running():
             self.stop_video()
             self.btn_cam.config(text="开启摄像头 (Start Cam)")
         else:
@@ -146,68 +351,208 @@ class DesktopDemoApp:
 
     def inference_image(self, img_bgr):
         if self.model is None: return
-        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        results = self.model(img_rgb, conf=self.var_conf.get())
-        res_plotted = results[0].plot()
-        self.show_image(res_plotted)
+        # The model takes BGR arrays like cv2 decodes them. One pass at a very low threshold and with
+        # almost no NMS (the tiled predictor also merges its tiles at this IoU, refilter_image dedups them)
+        results = self.predictor()(img_bgr, conf=IMAGE_CACHE_CONF, iou=IMAGE_CACHE_IOU,
+                                   max_det=IMAGE_CACHE_MAX_DET, verbose=False)
+        self.telemetry.record_speed(results[0].speed)
+        self.image_cache = {'dets': results[0].boxes.data.cpu().numpy(), 'names': results[0].names}
+        self.refilter_image()
+
+    def refilter_image(self):
+        # Confidence filter + class-aware NMS on the cached boxes: milliseconds, no forward pass
+        import torch
+        from ultralytics.engine.results import Results
+        from tiling import merge_detections
+
+        with self.telemetry.stage('refilter'):
+            d = self.image_cache['dets']
+            d = merge_detections(d[d[:, 4] >= self.var_conf.get()], 'nms', self.var_iou.get())
+            self.current_result = Results(self.current_image, path='', names=self.image_cache['names'],
+                                          boxes=torch.from_numpy(d))
+        self.redraw_image()
+
+    def redraw_image(self):
+        if self.current_image is not None:
+            self.show_image(self.render_frame(self.current_image, self.current_result, overlay=False))
+
+    def render_frame(self, frame, result=None, overlay=True):
+        """
+        BGR frame -> RGB image at display size with detections drawn on it.
+        Resizes once with a cheap interpolation and draws on the small frame instead of plotting
+        at full resolution. Touches no Tk state, so it runs on the inference thread.
+        """
+        import cv2
+
+        with self.telemetry.stage('resize'):
+            small, scale = resize_for_display(frame, *self.display_size)
+        with self.telemetry.stage('plot'):
+            if result is not None:
+                draw_result(small, self.visible(result), scale)
+            img_rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        if overlay and self.telemetry.overlay:
+            draw_overlay(img_rgb, self.telemetry.overlay_lines())
+        return img_rgb
+
+    def visible(self, result):
+        # Class toggles only affect what is drawn
+        hidden = self.hidden_classes
+        if not hidden or not len(result.boxes):
+            return result
+        return result[~np.isin(result.boxes.cls.cpu().numpy(), list(hidden))]
+
+    def is_running(self):
+        return any(t.is_alive() for t in self.threads)
 
     def start_video(self, source):
         self.stop_video()
         self.stop_event.clear()
-        self.thread = threading.Thread(target=self.video_loop, args=(source,), daemon=True)
-        self.thread.start()
+        self.frame_queue = LatestQueue(self.queue_depth)
+        self.display_queue = LatestQueue(self.queue_depth)
+        self.frames_shown = 0
+        self.fps_mark = (time.perf_counter(), 0)
+        self.video_detector = None # Fresh tracks and motion reference for every source
+        self.motion_gate = None
+        self.recent_events.clear()
+        self.threads = [
+            threading.Thread(target=self.decode_loop, args=(source, self.frame_queue), daemon=True),
+            threading.Thread(target=self.inference_loop, args=(self.frame_queue, self.display_queue), daemon=True),
+        ]
+        for t in self.threads:
+            t.start()
+        self.poll_display()
 
     def stop_video(self):
-        if self.thread:
-            self.stop_event.set()
-            self.thread.join(timeout=1.0)
-            self.thread = None
+        self.stop_event.set()
+        for q in (self.frame_queue, self.display_queue):
+            if q is not None:
+                q.close()
+        for t in self.threads:
+            t.join(timeout=1.0)
+        self.threads = []
+        self.cancel('poll')
+
+    def decode_loop(self, source, out_q):
+        import cv2
 
-    def video_loop(self, source):
+        # Stage 1: read frames and hand the newest one to the inference worker
         cap = cv2.VideoCapture(source)
-        while not self.stop_event.is_set():
-            ret, frame = cap.read()
-            if not ret:
-                if isinstance(source, str):
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0) # Loop
+        # Files are paced at their native frame rate; live sources are read as fast as they deliver
+        fps = cap.get(cv2.CAP_PROP_FPS) if isinstance(source, str) else 0
+        interval = 1.0 / fps if fps and fps > 0 else 0
+        next_t = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                with self.telemetry.stage('decode'):
+                    ret, frame = cap.read()
+                if not ret:
+                    if isinstance(source, str) and self.loop_files:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0) # Loop (demo.loop_files)
+                        continue
+                    break # End of file / camera gone: the pipeline drains and stops
+                if out_q.put(frame):
+                    self.telemetry.count('dropped_frames')
+
+                if interval:
+                    next_t += interval
+                    delay = next_t - time.perf_counter()
+                    if delay > 0:
+                        self.stop_event.wait(delay)
+                    else:
+                        next_t = time.perf_counter() # Fell behind, don't try to catch up
+        finally:
+            cap.release()
+            out_q.close()
+
+    def inference_loop(self, in_q, out_q):
+        # Stage 2: run the model on the newest decoded frame
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    frame = in_q.get(timeout=0.1)
+                except queue.Empty:
                     continue
-                else: 
+                except QueueClosed:
                     break
-            
-            if self.model:
-                results = self.model(frame, conf=self.var_conf.get())
-                res_plotted = results[0].plot()
-                # Convert BGR to RGB
-                img_rgb = cv2.cvtColor(res_plotted, cv2.COLOR_BGR2RGB)
-            else:
-                img_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                
-            # Update UI in main thread safely? 
-            # Tkinter is not thread safe but usually Image update works if handled carefully or via after()
-            # For simplicity/speed we will try invoking valid update
-            self.root.after(0, self.show_image, img_rgb)
-            
-            time.sleep(0.01)
-        cap.release()
+
+                result = None
+                if self.model:
+                    detector = self.frame_predictor()
+                    # iou / max_det always passed: the model keeps predictor arguments between calls,
+                    # and image mode just ran it with the loose IMAGE_CACHE_* settings
+                    result = detector(frame, conf=self.var_conf.get(), iou=self.var_iou.get(), max_det=300,
+                                      verbose=False)[0]
+                    self.telemetry.record_speed(result.speed)
+                    for e in getattr(detector, 'new_events', ()):
+                        self.telemetry.count('no_helmet_events')
+                        self.recent_events.append(f"#{e['track_id']} no helmet {e['seconds']:.0f}s "
+                                                  f"({time.strftime('%H:%M:%S', time.localtime(e['time']))})")
+                img_rgb = self.render_frame(frame, result)
+                if out_q.put(img_rgb):
+                    self.telemetry.count('dropped_frames')
+        finally:
+            out_q.close()
+
+    def poll_display(self):
+        # Stage 3: runs on the Tk main thread, so widgets are only touched from here
+        if self.display_queue is None:
+            return
+        try:
+            img_rgb = self.display_queue.get_nowait()
+        except queue.Empty:
+            pass
+        except QueueClosed:
+            self.update_pipeline_status(force=True)
+            return
+        else:
+            with self.telemetry.stage('display'):
+                self.show_image(img_rgb)
+            self.frames_shown += 1
+            self.telemetry.frame_done()
+        self.update_pipeline_status()
+        self.schedule('poll', 10, self.poll_display)
+
+    def update_pipeline_status(self, force=False):
+        now = time.perf_counter()
+        t0, n0 = self.fps_mark
+        if not force and now - t0 < 0.5:
+            return
+        fps = (self.frames_shown - n0) / max(now - t0, 1e-6)
+        self.fps_mark = (now, self.frames_shown)
+        dec, inf = self.frame_queue.stats(), self.display_queue.stats()
+        self.telemetry.gauge('decode_queue_depth', dec['depth'])
+        self.telemetry.gauge('display_queue_depth', inf['depth'])
+        text = (
+            f"Decode q {dec['depth']}/{self.frame_queue.maxsize} drop {dec['dropped']}\n"
+            f"Infer q {inf['depth']}/{self.display_queue.maxsize} drop {inf['dropped']}\n"
+            f"Display {fps:.1f} FPS"
+        )
+        detector = self.video_detector
+        if detector is not None:
+            s = detector.stats()
+            text += f"\nTrack stride {s['stride']} det {s['detections']}/{s['frames']} tracks {s['tracks']}"
+            text += ''.join(f"\n{e}" for e in self.recent_events)
+        gate = self.motion_gate
+        if gate is not None:
+            s = gate.stats()
+            self.telemetry.gauge('motion_skipped_frames', round(s['skipped_frames'], 4))
+            self.telemetry.gauge('motion_skipped_pixels', round(s['skipped_pixels'], 4))
+            text += (f"\nMotion skip {100 * s['skipped_frames']:.0f}% frames "
+                     f"{100 * s['skipped_pixels']:.0f}% px ({s['analysis_ms']:.1f} ms)")
+        self.lbl_status.config(text=text)
 
     def show_image(self, img_array):
-        # img_array is RGB numpy array
+        # img_array is an RGB numpy array already at display size (see render_frame)
+        from PIL import Image, ImageTk
+
         h, w, _ = img_array.shape
-        # Resize to fit display
-        display_w = self.display_frame.winfo_width()
-        display_h = self.display_frame.winfo_height()
-        
-        if display_w < 10 or display_h < 10: return
-        
-        scale = min(display_w/w, display_h/h)
-        new_w, new_h = int(w*scale), int(h*scale)
-        
         img = Image.fromarray(img_array)
-        img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        
-        photo = ImageTk.PhotoImage(img)
-        self.lbl_image.config(image=photo, text="")
-        self.lbl_image.image = photo # Keep reference
+        if self.photo is not None and (self.photo.width(), self.photo.height()) == (w, h):
+            self.photo.paste(img) # Reuse the Tk image buffer, no new PhotoImage per frame
+        else:
+            self.photo = ImageTk.PhotoImage(img)
+            self.lbl_image.config(image=self.photo, text="")
+        self.telemetry.mark('first_frame')
 
 def main():
     root = tk.Tk()
@@ -216,6 +561,7 @@ def main():
     # Handle window close
     def on_closing():
         app.stop_video()
+        app.telemetry.close()
         root.destroy()
         sys.exit(0)
         
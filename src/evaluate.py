@@ -0,0 +1,421 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from utils import load_config, resolve_split_dir
+from backends import BACKENDS
+from dataset_cache import file_stamp, label_path, read_labels
+from predict import list_images, prefetch_batches
+from config import add_override_argument, defaults, save_resolved
+
+# Defaults for the `evaluate:` section of the config
+EVALUATE_DEFAULTS = defaults('evaluate')
+# The network runs once per (weights, split) with these loose settings; every threshold at or
+# above them is then re-applied offline on the cached boxes (same idea as the demo's IMAGE_CACHE_*)
+CACHE_CONF = 0.001
+CACHE_IOU = 0.95
+CACHE_MAX_DET = 1000
+CACHE_VERSION = 1
+IOUV = np.linspace(0.5, 0.95, 10).astype(np.float32) # mAP@0.5:0.95 thresholds
+# Ground-truth size buckets by box side (sqrt of area, original-image pixels); P2 targets tiny/small
+SIZE_BUCKETS = {'tiny': (0, 16), 'small': (16, 32), 'medium': (32, 96), 'large': (96, np.inf)}
+MAX_PAIRS = 2_000_000 # Detection x target pairs materialized at once while matching
+NMS_CHUNK = 500 # Boxes per offline NMS call
+
+
+class PredictionStore:
+    """
+    Raw detections and ground truth of one split, as flat arrays memory-mapped from a cache directory:
+        dets.npy     (N, 6) float32  x1, y1, x2, y2, conf, cls in original-image pixels
+        det_offsets  (n_images + 1,)  detections of image i are dets[det_offsets[i]:det_offsets[i + 1]]
+        gt.npy       (G, 5) float32  cls, x1, y1, x2, y2
+        gt_offsets   (n_images + 1,)
+        meta.json    image paths, class names and the settings the cache was built with
+    """
+    FILES = ('dets', 'det_offsets', 'gt', 'gt_offsets')
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        for name in self.FILES:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        self.names = {int(k): v for k, v in self.meta['names'].items()}
+
+    def __len__(self):
+        return len(self.det_offsets) - 1
+
+    @staticmethod
+    def save(path, dets, det_offsets, gt, gt_offsets, meta):
+        os.makedirs(path, exist_ok=True)
+        for name, a in zip(PredictionStore.FILES, (dets, det_offsets, gt, gt_offsets)):
+            np.save(os.path.join(path, name + '.npy'), a)
+        # meta.json last: a cache without it is incomplete and gets rebuilt
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+
+def cache_path(cache_dir, weights, backend, imgsz, img_dir, paths):
+    """Cache directory of one (weights, backend, imgsz, split); any change to the weights or labels gives a new one."""
+    key = {
+        'version': CACHE_VERSION, 'weights': os.path.abspath(weights), 'stamp': file_stamp(weights),
+        'backend': backend, 'imgsz': imgsz, 'split': os.path.abspath(img_dir),
+        'settings': [CACHE_CONF, CACHE_IOU, CACHE_MAX_DET],
+        'files': [(p, file_stamp(p), file_stamp(label_path(p))) for p in paths],
+    }
+    h = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:10]
+    return os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(weights))[0]}-{backend}-{h}")
+
+
+def build_cache(weights, backend, img_dir, imgsz, cache_dir, batch=16, refresh=False):
+    """
+    Run the model once over every image of `img_dir` and store its raw detections plus the labels.
+    Returns:
+        PredictionStore: The (possibly already existing) cache.
+    """
+    paths = list_images(img_dir)
+    if not paths:
+        raise FileNotFoundError(f"No images found in {img_dir}")
+    path = cache_path(cache_dir, weights, backend, imgsz, img_dir, paths)
+    if os.path.exists(os.path.join(path, 'meta.json')) and not refresh:
+        return PredictionStore(path)
+
+    from modules import register_custom_modules
+    from backends import load_model
+
+    register_custom_modules()
+    model = load_model(weights, backend)
+    dets, gts, shapes, files = [], [], [], []
+    t0 = time.perf_counter()
+    for chunk, images in prefetch_batches(paths, batch, workers=4):
+        results = model(images, imgsz=imgsz, conf=CACHE_CONF, iou=CACHE_IOU, max_det=CACHE_MAX_DET, verbose=False)
+        for p, r in zip(chunk, results):
+            h, w = r.orig_shape
+            lb = read_labels(label_path(p))
+            if lb is None:
+                print(f"Warning: corrupt label file {label_path(p)}, image counted without targets")
+                lb = np.zeros((0, 5), np.float32)
+            xy, wh = lb[:, 1:3] * [w, h], lb[:, 3:5] * [w, h]
+            gts.append(np.concatenate([lb[:, :1], xy - wh / 2, xy + wh / 2], 1).astype(np.float32))
+            d = r.boxes.data.cpu().numpy().astype(np.float32)
+            dets.append(d[np.argsort(-d[:, 4], kind='stable')])
+            shapes.append([h, w])
+            files.append(p)
+        print(f"\rCaching predictions: {len(files)}/{len(paths)}", end='', flush=True)
+    elapsed = time.perf_counter() - t0
+    print(f"\rCached {len(files)} images in {elapsed:.1f}s ({len(files) / elapsed:.1f} img/s) -> {path}")
+
+    offsets = lambda arrays: np.concatenate([[0], np.cumsum([len(a) for a in arrays])]).astype(np.int64)
+    meta = {'weights': os.path.abspath(weights), 'backend': backend, 'imgsz': imgsz, 'split': os.path.abspath(img_dir),
+            'files': files, 'shapes': shapes, 'names': {str(k): v for k, v in model.names.items()},
+            'settings': {'conf': CACHE_CONF, 'iou': CACHE_IOU, 'max_det': CACHE_MAX_DET}, 'predict_s': elapsed}
+    PredictionStore.save(path, np.concatenate(dets).reshape(-1, 6), offsets(dets),
+                         np.concatenate(gts).reshape(-1, 5), offsets(gts), meta)
+    return PredictionStore(path)
+
+
+def image_index(offsets):
+    """Image id of every row of a flat array split by `offsets`."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def apply_thresholds(store, conf=CACHE_CONF, iou=0.7, max_det=300):
+    """
+    Re-run the post-processing on the cached detections: confidence filter, per-class NMS, max_det.
+    Equivalent to predicting with these settings for any conf >= CACHE_CONF and iou <= CACHE_IOU.
+    Returns:
+        tuple: (dets, det_offsets) in the store's layout (per image, descending confidence).
+    """
+    dets = np.asarray(store.dets)
+    img = image_index(store.det_offsets)
+    keep = np.flatnonzero(dets[:, 4] >= conf)
+    if iou < store.meta['settings']['iou'] and len(keep):
+        keep = nms(dets[keep], img[keep], iou, len(store), max(len(store.names), int(dets[:, 5].max()) + 1), keep)
+    keep = keep[np.lexsort((-dets[keep, 4], img[keep]))]
+    # Rank within the image, to cut each image at max_det
+    counts = np.bincount(img[keep], minlength=len(store))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(keep)) - np.repeat(starts, counts)
+    keep = keep[rank < max_det]
+    counts = np.minimum(counts, max_det)
+    return dets[keep], np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def nms(dets, img, iou, n_images, nc, index):
+    """
+    Per-(image, class) NMS of `dets` (sorted by image), returning the kept entries of `index`.
+    A few images go through one torchvision call at a time, their (image, class) groups shifted
+    apart in float64 so they never overlap; one call per group or one call over everything are
+    both far slower.
+    """
+    import torch
+    import torchvision
+
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(img, minlength=n_images))])
+    group = (img - img[0]) * nc + dets[:, 5].astype(np.int64)
+    span = float(np.abs(dets[:, :4]).max()) * 2 + 1
+    kept, i = [], 0
+    while i < n_images:
+        j = max(int(np.searchsorted(offsets, offsets[i] + NMS_CHUNK, 'right')) - 1, i + 1)
+        a, b = offsets[i], offsets[j]
+        if b > a:
+            boxes = torch.from_numpy(dets[a:b, :4].astype(np.float64) + (group[a:b] - group[a])[:, None] * span)
+            kept.append(a + torchvision.ops.nms(boxes, torch.from_numpy(dets[a:b, 4].astype(np.float64)), iou).numpy())
+        i = j
+    return index[np.concatenate(kept)] if kept else index[:0]
+
+
+def pair_iou(a, b):
+    """Element-wise IoU of two (N, 4) x1, y1, x2, y2 arrays."""
+    lt = np.maximum(a[:, :2], b[:, :2])
+    rb = np.minimum(a[:, 2:], b[:, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    area_a = (a[:, 2:] - a[:, :2]).prod(-1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(-1)
+    return inter / (area_a + area_b - inter + 1e-7)
+
+
+def ultralytics_matching():
+    """
+    Matching rule of the installed Ultralytics' DetectionValidator.match_predictions, probed on a
+    case the two rules disagree on: detection 0 overlaps target A (IoU 0.9), detection 1 overlaps
+    A (0.8) and B (0.6). By confidence, detection 1 falls back to B; by IoU it only competes for
+    A and loses. Older releases (e.g. 8.3.0) match by IoU, recent ones (8.4) by confidence.
+    """
+    import torch
+    from ultralytics.models.yolo.detect import DetectionValidator
+
+    iou = torch.tensor([[0.9, 0.8], [0.0, 0.6]]) # targets x detections
+    correct = DetectionValidator().match_predictions(torch.tensor([0, 0]), torch.tensor([0, 0]), iou)
+    return 'confidence' if bool(correct[1, 0]) else 'iou'
+
+
+def match(dets, det_offsets, gt, gt_offsets, iouv=IOUV, rule='confidence'):
+    """
+    One-to-one matching of detections (sorted by confidence per image) to same-class targets at every
+    IoU threshold, with either of the rules Ultralytics' DetectionValidator.match_predictions has used:
+        'confidence'  detections in descending confidence order each claim the best unclaimed target
+                      (COCO style; recent Ultralytics, e.g. 8.4)
+        'iou'         pairs above the threshold by descending IoU, each detection keeps its best target,
+                      then each target its most confident remaining detection (older Ultralytics, e.g. 8.3.0)
+    Vectorized over images; the 'confidence' rule loops over the k-th candidate detection of all images
+    at once (candidates = detections with IoU >= iouv[0] to some target), the 'iou' rule over thresholds.
+    Returns:
+        tuple: (correct (N, T) bool per detection, gt_score (G, T) confidence of the detection that
+        matched each target, 0 if none).
+    """
+    correct = np.zeros((len(dets), len(iouv)), bool)
+    gt_score = np.zeros((len(gt), len(iouv)), np.float32)
+    nd, ng = np.diff(det_offsets), np.diff(gt_offsets)
+    pairs = np.cumsum(nd * ng)
+    start = 0
+    while start < len(nd):
+        # Images [start, end) whose detection x target pairs fit in MAX_PAIRS (at least one image)
+        end = max(int(np.searchsorted(pairs, (pairs[start - 1] if start else 0) + MAX_PAIRS, 'right')), start + 1)
+        _match_images(dets, det_offsets, gt, gt_offsets, iouv, start, end, correct, gt_score, rule)
+        start = end
+    return correct, gt_score
+
+
+def _match_images(dets, det_offsets, gt, gt_offsets, iouv, start, end, correct, gt_score, rule):
+    nd, ng = np.diff(det_offsets[start:end + 1]), np.diff(gt_offsets[start:end + 1])
+    counts = nd * ng
+    if not counts.any():
+        return
+    # Every same-image (detection, target) pair as flat index arrays
+    img = np.repeat(np.arange(end - start), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    gi_local = k % ng[img]
+    di = det_offsets[start + img] + k // ng[img]
+    gi = gt_offsets[start + img] + gi_local
+    iou = pair_iou(dets[di, :4], gt[gi, 1:])
+    iou[dets[di, 5] != gt[gi, 0]] = 0
+    cand = iou >= iouv[0]
+    if not cand.any():
+        return
+    img, di, gi, gi_local, iou = img[cand], di[cand], gi[cand], gi_local[cand], iou[cand]
+    if rule == 'iou':
+        _match_by_iou(dets, di, gi, iou, iouv, correct, gt_score)
+        return
+
+    # Candidate detections ranked within their image (global index order = confidence order)
+    cand_d = np.unique(di)
+    cand_img = np.searchsorted(det_offsets, cand_d, 'right') - 1 - start
+    rank = np.arange(len(cand_d)) - np.searchsorted(cand_img, cand_img, 'left')
+    n, R, G = end - start, int(rank.max()) + 1, int(ng.max())
+    grid = np.zeros((n, R, G), np.float32) # IoU of the r-th candidate of each image with each target
+    grid[img, rank[np.searchsorted(cand_d, di)], gi_local] = iou
+    slot = np.full((n, R), -1)
+    slot[cand_img, rank] = cand_d
+    claimed = np.zeros((n, G, len(iouv)), np.float32) # Confidence of the claiming detection, 0 = unclaimed
+
+    rows, cols = np.arange(n)[:, None], np.arange(len(iouv))[None, :]
+    for r in range(R):
+        available = np.where(claimed > 0, 0, grid[:, r, :, None]) # (n, G, T)
+        best = available.argmax(1)
+        hit = available[rows, best, cols] >= iouv
+        valid = slot[:, r] >= 0
+        score = np.where(hit, dets[np.maximum(slot[:, r], 0), 4][:, None], 0)
+        claimed[rows, best, cols] = np.maximum(claimed[rows, best, cols], score)
+        correct[slot[valid, r]] = hit[valid]
+
+    # Scatter back to the global target rows
+    t_img = np.repeat(np.arange(n), ng)
+    t_local = np.arange(ng.sum()) - np.repeat(np.cumsum(ng) - ng, ng)
+    gt_score[gt_offsets[start] + np.arange(ng.sum())] = claimed[t_img, t_local]
+
+
+def _match_by_iou(dets, di, gi, iou, iouv, correct, gt_score):
+    """The 'iou' rule on candidate pairs (global detection / target rows); pairs of all images at once."""
+    for t, threshold in enumerate(iouv):
+        sel = iou >= threshold
+        order = np.argsort(-iou[sel], kind='stable')
+        d, g = di[sel][order], gi[sel][order]
+        # Best target per detection; np.unique leaves them in detection (= confidence) order,
+        # so the second pass keeps each target's most confident detection
+        _, first = np.unique(d, return_index=True)
+        d, g = d[first], g[first]
+        _, first = np.unique(g, return_index=True)
+        correct[d[first], t] = True
+        gt_score[g[first], t] = dets[d[first], 4]
+
+
+def box_side(boxes):
+    return np.sqrt(np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None))
+
+
+def operating_point(dets, correct, gt, gt_score, n_images, conf, names):
+    """Precision / recall / F1 at IoU 0.5 of the detections with confidence >= conf, plus recall per size bucket and class."""
+    keep = dets[:, 4] >= conf
+    tp = int(correct[keep, 0].sum())
+    hit = gt_score[:, 0] >= conf
+    side = box_side(gt[:, 1:])
+    p = tp / max(int(keep.sum()), 1)
+    r = float(hit.mean()) if len(hit) else 0.0
+    buckets = {}
+    for name, (lo, hi) in SIZE_BUCKETS.items():
+        m = (side >= lo) & (side < hi)
+        buckets[name] = {'gt': int(m.sum()), 'recall': round(float(hit[m].mean()), 4) if m.any() else None}
+    classes = {}
+    for c, name in names.items():
+        m = gt[:, 0] == c
+        k = keep & (dets[:, 5] == c)
+        if not (m.any() or k.any()):
+            continue
+        classes[name] = {'gt': int(m.sum()), 'recall': round(float(hit[m].mean()), 4) if m.any() else None,
+                         'precision': round(float(correct[k, 0].mean()), 4) if k.any() else None}
+    return {'conf': conf, 'precision': round(p, 4), 'recall': round(r, 4), 'f1': round(2 * p * r / max(p + r, 1e-16), 4),
+            'dets_per_img': round(int(keep.sum()) / max(n_images, 1), 2), 'size_recall': buckets, 'classes': classes}
+
+
+def evaluate_store(store, conf=0.25, iou=0.7, max_det=300, sweep_conf=(), plot_dir=None, matching='confidence'):
+    """
+    mAP@0.5, mAP@0.5:0.95 and the IoU-0.5 PR curve (at CACHE_CONF, like model.val()) plus the metrics
+    at each operating confidence, all from the cached detections at NMS IoU `iou`, with the
+    `matching` rule of match().
+    """
+    from ultralytics.utils.metrics import ap_per_class
+
+    dets, det_offsets = apply_thresholds(store, CACHE_CONF, iou, max_det)
+    gt = np.asarray(store.gt)
+    correct, gt_score = match(dets, det_offsets, gt, store.gt_offsets, rule=matching)
+    names = store.names
+    if plot_dir:
+        os.makedirs(plot_dir, exist_ok=True)
+    _, _, p, r, _, ap, classes, _, _, _, x, prec = ap_per_class(
+        correct, dets[:, 4], dets[:, 5], gt[:, 0], plot=bool(plot_dir), save_dir=Path(plot_dir or '.'), names=names)
+    return {
+        'iou': iou, 'max_det': max_det, 'matching': matching, 'images': len(store), 'targets': len(gt),
+        'mAP50': round(float(ap[:, 0].mean()), 4) if len(ap) else 0.0,
+        'mAP50-95': round(float(ap.mean()), 4) if len(ap) else 0.0,
+        'precision': round(float(p.mean()), 4) if len(p) else 0.0, # At the max-F1 confidence, like model.val()
+        'recall': round(float(r.mean()), 4) if len(r) else 0.0,
+        'ap_per_class': {names.get(int(c), str(int(c))): {'AP50': round(float(a[0]), 4), 'AP50-95': round(float(a.mean()), 4)}
+                         for c, a in zip(classes, ap)},
+        # Precision at recall x (IoU 0.5), every 10th of the 1000 points Ultralytics samples
+        'pr_curve': {'recall': np.round(x[::10], 3).tolist(),
+                     **{names.get(int(c), str(int(c))): np.round(pc[::10], 4).tolist() for c, pc in zip(classes, prec)}},
+        'operating_points': [operating_point(dets, correct, gt, gt_score, len(store), c, names)
+                             for c in sorted({conf, *sweep_conf})],
+    }
+
+
+def print_table(model, rows):
+    for r in rows:
+        for op in r['operating_points']:
+            sr = op['size_recall']
+            fmt = lambda v: f"{v:.3f}" if v is not None else '-'
+            print(f"{model:<22} {r['iou']:>5.2f} {op['conf']:>6.3f} {r['mAP50']:>7.4f} {r['mAP50-95']:>9.4f} "
+                  f"{op['precision']:>6.3f} {op['recall']:>6.3f} {fmt(sr['tiny']['recall']):>6} "
+                  f"{fmt(sr['small']['recall']):>6} {fmt(sr['medium']['recall']):>6} {fmt(sr['large']['recall']):>6} "
+                  f"{op['dets_per_img']:>7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cached, vectorized mAP / PR / size-bucket recall evaluation")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--weights', nargs='+', default=None, help='One or more weights to compare (default: config weights)')
+    parser.add_argument('--backend', type=str, default=None, choices=list(BACKENDS))
+    parser.add_argument('--split', type=str, default=None, choices=['val', 'test'])
+    parser.add_argument('--imgsz', type=int, default=None)
+    parser.add_argument('--conf', type=float, default=None, help='Operating confidence for P / R / size-bucket recall')
+    parser.add_argument('--iou', type=float, default=None, help='NMS IoU')
+    parser.add_argument('--sweep-conf', type=float, nargs='*', default=[], help='Extra operating confidences')
+    parser.add_argument('--sweep-iou', type=float, nargs='*', default=[], help='Extra NMS IoUs (mAP is recomputed per IoU)')
+    parser.add_argument('--matching', type=str, default=None, choices=['auto', 'iou', 'confidence'],
+                        help='Detection-to-target matching rule (auto: the one of the installed Ultralytics)')
+    parser.add_argument('--refresh', action='store_true', help='Rebuild the prediction cache')
+    parser.add_argument('--plot', action='store_true', help="Save PR / F1 curve plots into each model's cache directory")
+    parser.add_argument('--out', type=str, default=None, help='Report JSON (default: <cache_dir>/report.json)')
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    ecfg = {**EVALUATE_DEFAULTS, **(cfg.get('evaluate') or {})}
+    split = args.split or ecfg['split']
+    conf = args.conf if args.conf is not None else ecfg['conf']
+    ious = sorted({args.iou if args.iou is not None else ecfg['iou'], *args.sweep_iou})
+    if max(ious) > CACHE_IOU or min([conf, *args.sweep_conf]) < CACHE_CONF:
+        parser.error(f"Thresholds must be within the cache settings (conf >= {CACHE_CONF}, iou <= {CACHE_IOU})")
+    backend = args.backend or cfg.get('backend', 'pt')
+    imgsz = args.imgsz or cfg['imgsz']
+    img_dir = resolve_split_dir(cfg['data'], split)
+    out = args.out or os.path.join(ecfg['cache_dir'], 'report.json')
+    matching = args.matching or ecfg['matching']
+    if matching == 'auto':
+        matching = ultralytics_matching()
+        print(f"Matching rule: {matching} (as model.val() of ultralytics in this environment)")
+
+    weights_list = args.weights or [cfg['weights']]
+    stores = [build_cache(w, backend, img_dir, imgsz, ecfg['cache_dir'], ecfg['batch'], args.refresh) for w in weights_list]
+
+    report = {'split': img_dir, 'size_buckets': {k: list(v) for k, v in SIZE_BUCKETS.items()}, 'models': {}}
+    t0 = time.perf_counter()
+    print(f"{'model':<22} {'iou':>5} {'conf':>6} {'mAP50':>7} {'mAP50-95':>9} {'P':>6} {'R':>6} {'R tiny':>6} "
+          f"{'R sml':>6} {'R med':>6} {'R lrg':>6} {'det/img':>7}")
+    for weights, store in zip(weights_list, stores):
+        # Full relative paths when comparing, e.g. two runs' best.pt
+        name = os.path.relpath(weights) if len(weights_list) > 1 else os.path.basename(weights)
+        t1 = time.perf_counter()
+        rows = [evaluate_store(store, conf, iou, ecfg['max_det'], args.sweep_conf,
+                               os.path.join(store.path, f"plots_iou{iou}") if args.plot else None, matching)
+                for iou in ious]
+        print_table(name[-22:], rows)
+        report['models'][name] = {'weights': weights, 'cache': store.path, 'eval_s': round(time.perf_counter() - t1, 3),
+                                  'results': rows}
+    print(f"Evaluated {len(stores)} model(s) x {len(ious)} NMS IoU(s) from cache in {time.perf_counter() - t0:.2f}s")
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    save_resolved(cfg, os.path.dirname(os.path.abspath(out)))
+    print(f"Report saved to {out}")
+
+
+if __name__ == '__main__':
+    main()
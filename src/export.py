@@ -0,0 +1,161 @@
+from ultralytics import YOLO
+import argparse
+import os
+import time
+
+import numpy as np
+
+from utils import load_config, box_iou
+from config import add_override_argument
+from modules import register_custom_modules
+from backends import BACKENDS, artifact_path, load_model
+
+
+def export(weights, formats, imgsz=640):
+    """
+    Export `weights` to optimized CPU artifacts next to the .pt file.
+    Args:
+        weights (str): Path to trained .pt weights (baseline, CBAM or P2).
+        formats (list): Subset of BACKENDS (without 'pt').
+        imgsz (int): Export resolution.
+    Returns:
+        dict: backend -> artifact path.
+    """
+    # CBAM has to be resolvable before a CBAM/P2 checkpoint can be rebuilt for export
+    register_custom_modules()
+    model = YOLO(weights)
+    out = {}
+
+    if 'onnx' in formats or 'onnx-int8' in formats:
+        # Dynamic axes so batched predict/multi-stream can feed several images per call
+        out['onnx'] = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    if 'onnx-int8' in formats:
+        out['onnx-int8'] = quantize_onnx_dynamic(out['onnx'], artifact_path(weights, 'onnx-int8'))
+    if 'openvino' in formats:
+        out['openvino'] = model.export(format='openvino', imgsz=imgsz, dynamic=True)
+    if 'torchscript' in formats:
+        out['torchscript'] = model.export(format='torchscript', imgsz=imgsz)
+    return out
+
+
+def quantize_onnx_dynamic(fp32_path, int8_path):
+    """
+    Weight-only INT8 variant of an ONNX model (no calibration data needed).
+    For static INT8 with calibrated activations see quantize.py.
+    """
+    import onnx
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QUInt8)
+    # Carry over Ultralytics metadata (names, stride, imgsz) so YOLO() can load the INT8 file directly
+    src, dst = onnx.load(fp32_path), onnx.load(int8_path)
+    del dst.metadata_props[:]
+    dst.metadata_props.extend(src.metadata_props)
+    onnx.save(dst, int8_path)
+    return int8_path
+
+
+def sample_images(source, n, imgsz, seed=0):
+    """Up to `n` images from `source`, or random frames if no source is available."""
+    from predict import list_images, read_image
+
+    if source and os.path.exists(source):
+        paths = list_images(source)
+        rng = np.random.default_rng(seed)
+        paths = [paths[i] for i in sorted(rng.choice(len(paths), min(n, len(paths)), replace=False))]
+        return [read_image(p) for p in paths]
+    print(f"No images at '{source}', using random frames (parity check will be weak).")
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 255, (imgsz, imgsz, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def match_detections(ref, test, iou_thr=0.5):
+    """
+    Greedy same-class matching between two (N, 6) detection arrays.
+    Returns:
+        tuple: (matched IoUs, matched |conf| differences, number of unmatched boxes)
+    """
+    if len(ref) == 0 or len(test) == 0:
+        return [], [], len(ref) + len(test)
+    iou = box_iou(ref[:, :4], test[:, :4])
+    iou[ref[:, 5][:, None] != test[:, 5][None, :]] = 0
+    ious, dconf, used = [], [], set()
+    for i in np.argsort(-ref[:, 4]):
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] >= iou_thr and j not in used:
+            used.add(j)
+            ious.append(iou[i, j])
+            dconf.append(abs(ref[i, 4] - test[j, 4]))
+    return ious, dconf, len(ref) + len(test) - 2 * len(used)
+
+
+def run_detections(model, images, imgsz, conf):
+    # Batch 1 so the latency numbers are comparable across backends
+    dets, times = [], []
+    model(images[0], imgsz=imgsz, conf=conf, verbose=False) # Warmup
+    for im in images:
+        t0 = time.perf_counter()
+        res = model(im, imgsz=imgsz, conf=conf, verbose=False)[0]
+        times.append(time.perf_counter() - t0)
+        dets.append(res.boxes.data.cpu().numpy())
+    return dets, times
+
+
+def check(weights, backends, images, imgsz=640, conf=0.25):
+    """Parity of every backend against the .pt outputs, plus a latency comparison."""
+    register_custom_modules()
+    ref_dets, ref_times = run_detections(load_model(weights, 'pt'), images, imgsz, conf)
+    ref_ms = 1000 * np.median(ref_times)
+
+    print(f"{'backend':<12} {'p50 ms':>8} {'speedup':>8} {'mean IoU':>9} {'max dconf':>10} {'unmatched':>10}")
+    print(f"{'pt':<12} {ref_ms:>8.1f} {1.0:>7.2f}x {'-':>9} {'-':>10} {'-':>10}")
+    report = {'pt': {'p50_ms': ref_ms}}
+    for backend in backends:
+        dets, times = run_detections(load_model(weights, backend), images, imgsz, conf)
+        ious, dconf, unmatched = [], [], 0
+        for r, t in zip(ref_dets, dets):
+            i, d, u = match_detections(r, t)
+            ious += i
+            dconf += d
+            unmatched += u
+        ms = 1000 * np.median(times)
+        report[backend] = {
+            'p50_ms': ms, 'speedup': ref_ms / ms,
+            'mean_iou': float(np.mean(ious)) if ious else None,
+            'max_dconf': float(np.max(dconf)) if dconf else None,
+            'unmatched': unmatched,
+        }
+        mean_iou = f"{np.mean(ious):.4f}" if ious else '-'
+        max_dconf = f"{np.max(dconf):.4f}" if dconf else '-'
+        print(f"{backend:<12} {ms:>8.1f} {ref_ms / ms:>7.2f}x {mean_iou:>9} {max_dconf:>10} {unmatched:>10}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export weights for CPU deployment and check parity")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--weights', type=str, default=None, help='Override weights from config')
+    parser.add_argument('--formats', nargs='+', default=['onnx', 'onnx-int8'],
+                        choices=[b for b in BACKENDS if b not in ('pt', 'onnx-int8-static')])
+    parser.add_argument('--imgsz', type=int, default=None)
+    parser.add_argument('--check', action='store_true', help='Compare exported outputs and latency against the .pt')
+    parser.add_argument('--images', type=str, default=None, help='Images for the parity check')
+    parser.add_argument('--n', type=int, default=50, help='Number of images for the parity check')
+    parser.add_argument('--conf', type=float, default=0.25)
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    weights = args.weights or cfg['weights']
+    imgsz = args.imgsz or cfg.get('imgsz', 640)
+
+    for backend, path in export(weights, args.formats, imgsz).items():
+        print(f"Exported {backend}: {path}")
+
+    if args.check:
+        source = args.images or (cfg.get('predict') or {}).get('source')
+        check(weights, args.formats, sample_images(source, args.n, imgsz), imgsz, args.conf)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from utils import load_config
+from server import SERVER_DEFAULTS, Overloaded, RemoteModel
+from config import add_override_argument
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_frames(source, n=32, seed=0):
+    """Up to `n` images of `source`, or seeded random 640x480 frames when it is missing."""
+    from predict import list_images, read_image
+
+    paths = list_images(source)[:n] if source and os.path.exists(source) else []
+    frames = [im for im in (read_image(p) for p in paths) if im is not None]
+    if frames:
+        return frames
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def wait_for_server(url, timeout=120.0, proc=None):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}")
+        try:
+            return RemoteModel(url, retries=0)
+        except OSError:
+            time.sleep(0.5)
+    raise TimeoutError(f"No server at {url} after {timeout:.0f}s")
+
+
+def run_level(client, frames, concurrency, duration, conf=0.25):
+    """
+    `concurrency` threads send requests back to back for `duration` seconds (no client-side
+    retries, so rejected requests show up as such).
+    Returns:
+        dict: Latency percentiles, throughput, rejections and the mean server batch size.
+    """
+    latencies, batches = [], []
+    counts = {'ok': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def worker(k):
+        i = k
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            try:
+                record = client.predict_one(frames[i % len(frames)], conf)
+                key = 'ok'
+            except Overloaded:
+                key = 'rejected'
+            except Exception:
+                key = 'errors'
+            ms = 1000 * (time.perf_counter() - t0)
+            with lock:
+                counts[key] += 1
+                if key == 'ok':
+                    latencies.append(ms)
+                    batches.append(record['server']['batch'])
+                elif key == 'rejected':
+                    time.sleep(0.01) # A real client backs off too
+            i += concurrency
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    a = np.array(latencies) if latencies else np.zeros(1)
+    total = sum(counts.values())
+    return {
+        'concurrency': concurrency,
+        **counts,
+        'req_per_s': round(counts['ok'] / elapsed, 2),
+        'p50_ms': round(float(np.percentile(a, 50)), 2),
+        'p95_ms': round(float(np.percentile(a, 95)), 2),
+        'p99_ms': round(float(np.percentile(a, 99)), 2),
+        'rejected_pct': round(100 * counts['rejected'] / max(total, 1), 2),
+        'mean_batch': round(float(np.mean(batches)), 2) if batches else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for server.py: latency / throughput vs. concurrency")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--url', type=str, default=None, help='Server URL (default: host / port of `server` in the config)')
+    parser.add_argument('--spawn', action='store_true', help='Start server.py with --config for the test')
+    parser.add_argument('--images', type=str, default=None, help='Request images (default: predict.source, else random frames)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+    parser.add_argument('--transport', type=str, default=None, choices=['auto', 'shm', 'raw', 'jpeg'])
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--out', type=str, default='runs/load_test/report.json')
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    scfg = {**SERVER_DEFAULTS, **(cfg.get('server') or {})}
+    url = args.url or f"http://{scfg['host']}:{scfg['port']}"
+    frames = load_frames(args.images or (cfg.get('predict') or {}).get('source'))
+
+    proc = None
+    if args.spawn:
+        proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'src', 'server.py'), '--config', args.config,
+                                 *(['--set', *args.set] if args.set else [])])
+    try:
+        client = wait_for_server(url, proc=proc)
+        client.transport = args.transport if args.transport not in (None, 'auto') else client.transport
+        print(f"{url}: {client.info['weights']} ({client.info['backend']}), batch <= {client.info['max_batch']}, "
+              f"wait <= {client.info['max_wait_ms']} ms, queue <= {client.info['max_queue']}, transport {client.transport}")
+        client.predict_one(frames[0], args.conf) # Warm the connection
+        print(f"{'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'batch':>6} {'rejected':>9} {'errors':>7}")
+        levels = []
+        for c in args.concurrency:
+            r = run_level(client, frames, c, args.duration, args.conf)
+            levels.append(r)
+            print(f"{c:>5} {r['req_per_s']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+                  f"{r['mean_batch'] if r['mean_batch'] is not None else '-':>6} {r['rejected_pct']:>8.1f}% {r['errors']:>7}")
+        client.close()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'server': client.info, 'transport': client.transport, 'duration': args.duration,
+                   'levels': levels}, f, indent=2)
+    print(f"Report saved to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
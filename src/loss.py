@@ -1,13 +1,127 @@
 import torch
 import torch.nn as nn
-import math
+
+def inner_wiou_terms(pred, target, ratio=0.7, eps=1e-7):
+    """
+    IoU, Inner-IoU and the WIoU distance attention for paired boxes.
+    Both box sets go into one stacked (2, 4, N) tensor, coordinate-major so every
+    row is contiguous, and each term is computed for x and y at once on (2, N) slices.
+    Args:
+        pred (Tensor): (N, 4) predicted boxes, x1y1x2y2.
+        target (Tensor): (N, 4) target boxes, x1y1x2y2.
+    Returns:
+        tuple: (iou, inner_iou, r_wiou), each of shape (N,)
+    """
+    boxes = torch.stack((pred, target)).transpose(1, 2).contiguous()
+    xy1, xy2 = boxes[:, :2], boxes[:, 2:] # (box, xy, N)
+    wh = xy2 - xy1
+    center = (xy1 + xy2) * 0.5
+    area_sum = (wh[:, 0] * wh[:, 1]).sum(0)
+
+    # Standard IoU
+    inter_wh = (torch.min(xy2[0], xy2[1]) - torch.max(xy1[0], xy1[1])).clamp(min=0)
+    inter = inter_wh[0] * inter_wh[1]
+    iou = inter / (area_sum - inter + eps)
+
+    # Inner-IoU: same centers, sides scaled by `ratio`
+    half = wh * (ratio * 0.5)
+    lo, hi = center - half, center + half
+    inner_wh = (torch.min(hi[0], hi[1]) - torch.max(lo[0], lo[1])).clamp(min=0)
+    inner = inner_wh[0] * inner_wh[1]
+    inner_iou = inner / (area_sum * ratio ** 2 - inner + eps)
+
+    # WIoU v1 distance attention: exp(center distance^2 / enclosing-box diagonal^2)
+    enclose = torch.max(xy2[0], xy2[1]) - torch.min(xy1[0], xy1[1])
+    dist = (center[0] - center[1]).square().sum(0) / (enclose.square().sum(0) + eps)
+    return iou, inner_iou, torch.exp(dist)
+
+
+def _lt(a, b):
+    # d min(a, b) / da as autograd defines it: 1 where a < b, 0.5 on ties
+    return (a < b).to(a.dtype) + 0.5 * (a == b).to(a.dtype)
+
+
+class InnerWIoUFunction(torch.autograd.Function):
+    """
+    Inner-WIoU v1 with a hand-written backward.
+    Autograd would keep dozens of (N,) intermediates alive per step; here only pred/target are
+    saved and the gradient w.r.t. pred is recomputed in one pass on (2, N) x/y pairs.
+    Targets are treated as constants (they never require grad in the detection loss).
+    """
+    @staticmethod
+    def forward(ctx, pred, target, ratio, eps):
+        iou, inner_iou, r_wiou = inner_wiou_terms(pred, target, ratio, eps)
+        ctx.save_for_backward(pred, target)
+        ctx.ratio, ctx.eps = ratio, eps
+        ctx.mark_non_differentiable(iou)
+        return r_wiou * (1 - inner_iou), iou
+
+    @staticmethod
+    def backward(ctx, grad, _):
+        pred, target = ctx.saved_tensors
+        r, eps = ctx.ratio, ctx.eps
+        a, b = (1 + r) / 2, (1 - r) / 2 # Inner edges: x1' = a*x1 + b*x2, x2' = b*x1 + a*x2
+        p, t = pred.T.contiguous(), target.T.contiguous()
+        p1, p2, t1, t2 = p[:2], p[2:], t[:2], t[2:]
+        wh = p2 - p1
+
+        # Recompute the forward terms
+        i1, i2 = a * p1 + b * p2, b * p1 + a * p2
+        ti1, ti2 = a * t1 + b * t2, b * t1 + a * t2
+        inner_raw = torch.min(i2, ti2) - torch.max(i1, ti1)
+        inner_wh = inner_raw.clamp(min=0)
+        inner = inner_wh[0] * inner_wh[1]
+        union = (r * r) * (wh[0] * wh[1] + (t2[0] - t1[0]) * (t2[1] - t1[1])) - inner + eps
+        d = (p1 + p2 - t1 - t2) * 0.5
+        c = torch.max(p2, t2) - torch.min(p1, t1)
+        c2 = c.square().sum(0) + eps
+        d2 = d.square().sum(0)
+        r_wiou = torch.exp(d2 / c2)
+
+        # L = R * (1 - I), R = exp(d2 / c2), I = inner / union
+        g_dist = grad * (1 - inner / union) * r_wiou
+        g_iou = grad * r_wiou
+        g_d = (g_dist / c2) * d
+        g_c = (-2 * g_dist * d2 / (c2 * c2)) * c
+        union2 = union * union
+        g_inner = (-g_iou * (union + inner) / union2) * inner_wh.flip(0) * (inner_raw >= 0)
+        g_area = (g_iou * inner * (r * r) / union2) * wh.flip(0)
+        g_i2, g_i1 = g_inner * _lt(i2, ti2), -g_inner * _lt(ti1, i1)
+
+        g1 = a * g_i1 + b * g_i2 + g_d - g_c * _lt(p1, t1) - g_area
+        g2 = b * g_i1 + a * g_i2 + g_d + g_c * _lt(t2, p2) + g_area
+        return torch.cat((g1, g2)).T, None, None, None
+
 
 class InnerWIoU(nn.Module):
-    def __init__(self, ratio=0.7, monotonic=False):
+    """
+    Inner-WIoU loss: L = R_WIoU * (1 - InnerIoU).
+    With `focusing=True` the WIoU gradient gain is applied on top, using a running
+    mean of the IoU loss kept in the `iou_mean` buffer (no extra passes needed):
+      - monotonic=True:  v2, r = (L_IoU / mean) ** 0.5
+      - monotonic=False: v3, r = beta / (delta * alpha ** (beta - delta)), beta = L_IoU / mean
+    """
+    def __init__(self, ratio=0.7, monotonic=False, focusing=False, alpha=1.9, delta=3.0,
+                 momentum=0.01, compile=False):
         super().__init__()
         self.ratio = ratio
         self.monotonic = monotonic
-        
+        self.focusing = focusing
+        self.alpha = alpha
+        self.delta = delta
+        self.momentum = momentum
+        # Running mean of L_IoU = 1 - IoU; a buffer so it follows .to(device) and shows up in state_dict()
+        self.register_buffer('iou_mean', torch.tensor(1.0))
+
+        # Optional compiled path: the stacked terms are fused into a few kernels and
+        # autograd differentiates the compiled graph instead of InnerWIoUFunction
+        self.compiled_terms = None
+        if compile:
+            if hasattr(torch, 'compile'):
+                self.compiled_terms = torch.compile(inner_wiou_terms, dynamic=True)
+            else:
+                self.compiled_terms = torch.jit.script(inner_wiou_terms) # torch < 2.0
+
     def forward(self, pred, target):
         """
         pred: [x1, y1, x2, y2]
@@ -17,99 +131,31 @@ class InnerWIoU(nn.Module):
         if pred.shape[0] == 0:
             return torch.tensor(0.0, device=pred.device)
 
-        # 1. Inner-IoU Calculation
-        # Standard IoU first for WIoU terms
-        x1, y1, x2, y2 = pred.unbind(-1)
-        tx1, ty1, tx2, ty2 = target.unbind(-1)
-        
-        # Intersection
-        inter_x1 = torch.max(x1, tx1)
-        inter_y1 = torch.max(y1, ty1)
-        inter_x2 = torch.min(x2, tx2)
-        inter_y2 = torch.min(y2, ty2)
-        inter = torch.clamp(inter_x2 - inter_x1, min=0) * torch.clamp(inter_y2 - inter_y1, min=0)
-        
-        # Union
-        w1, h1 = x2 - x1, y2 - y1
-        w2, h2 = tx2 - tx1, ty2 - ty1
-        union = w1 * h1 + w2 * h2 - inter + 1e-7
-        ious = inter / union
-        
-        # Inner Box scaling
-        # Transform to center-wh
-        px, py, pw, ph = (x1 + x2) / 2, (y1 + y2) / 2, w1, h1
-        tx, ty, tw, th = (tx1 + tx2) / 2, (ty1 + ty2) / 2, w2, h2
-        
-        # Inner boxes
-        inner_pw, inner_ph = pw * self.ratio, ph * self.ratio
-        inner_tw, inner_th = tw * self.ratio, th * self.ratio
-        
-        inner_x1 = px - inner_pw / 2
-        inner_y1 = py - inner_ph / 2
-        inner_x2 = px + inner_pw / 2
-        inner_y2 = py + inner_ph / 2
-        
-        inner_tx1 = tx - inner_tw / 2
-        inner_ty1 = ty - inner_th / 2
-        inner_tx2 = tx + inner_tw / 2
-        inner_ty2 = ty + inner_th / 2
-        
-        # Inner IoU
-        inner_inter_x1 = torch.max(inner_x1, inner_tx1)
-        inner_inter_y1 = torch.max(inner_y1, inner_ty1)
-        inner_inter_x2 = torch.min(inner_x2, inner_tx2)
-        inner_inter_y2 = torch.min(inner_y2, inner_ty2)
-        inner_inter = torch.clamp(inner_inter_x2 - inner_inter_x1, min=0) * torch.clamp(inner_inter_y2 - inner_inter_y1, min=0)
-        
-        inner_union = inner_pw * inner_ph + inner_tw * inner_th - inner_inter + 1e-7
-        inner_iou = inner_inter / inner_union
-        
-        # 2. WIoU Calculation (v3)
-        # Distance metric
-        # Smallest Enclosing Box
-        c_x1 = torch.min(x1, tx1)
-        c_y1 = torch.min(y1, ty1)
-        c_x2 = torch.max(x2, tx2)
-        c_y2 = torch.max(y2, ty2)
-        cw = c_x2 - c_x1
-        ch = c_y2 - c_y1
-        
-        # Distance term
-        dist = ((px - tx) ** 2 + (py - ty) ** 2) / (cw ** 2 + ch ** 2 + 1e-7)
-        
-        # WIoU v1
-        # R_WIoU = torch.exp(dist)
-        # L_WIoUv1 = R_WIoU * (1 - ious)  (Standard)
-        
-        # Fusing: L_InnerWIoU = R_WIoU * (1 - InnerIoU)
-        r_wiou = torch.exp(dist)
-        
-        # WIoU v3 non-monotonic focusing
-        # beta: outlier degree
-        # For simplicity, we implement a simplified WIoU v3 logic or v1 if v3 gradients are too complex for this snippet
-        # Let's use WIoU v1 combined with Inner first as it's robust.
-        # But user asked for WIoU v3 ("dynamic non-monotonic").
-        
-        # Outlier degree (beta) = L_IoU_star / L_IoU_avg
-        # This requires tracking history, which is hard in a pure function.
-        # WIoU author provides a simplified v3 implementation.
-        
-        # Let's stick to the core described by User: "In WIoU dynamic weighting basis, use Inner-IoU".
-        # Let's use the robust WIoU v1 term (exp(dist)) * (1 - InnerIoU) first. 
-        # But to really verify "v3", we need gradient scaling. 
-        # For undergraduate thesis, WIoU v1 (Distance attention) + InnerIoU is already very strong "Inner-WIoU".
-        # Let's add the non-monotonic term `gamma`
-        
-        loss = r_wiou * (1 - inner_iou)
-        return loss
+        if self.compiled_terms is not None or target.requires_grad:
+            terms = self.compiled_terms or inner_wiou_terms
+            iou, inner_iou, r_wiou = terms(pred, target, self.ratio)
+            loss = r_wiou * (1 - inner_iou)
+        else:
+            loss, iou = InnerWIoUFunction.apply(pred, target, self.ratio, 1e-7)
+        if not self.focusing:
+            return loss
+
+        l_iou = (1 - iou).detach()
+        if self.training and torch.is_grad_enabled():
+            # Only training steps move the running mean, validation losses must not
+            self.iou_mean.mul_(1 - self.momentum).add_(self.momentum * l_iou.mean())
+        beta = l_iou / self.iou_mean
+        if self.monotonic:
+            return beta.sqrt() * loss
+        return beta / (self.delta * torch.pow(self.alpha, beta - self.delta)) * loss
 
 # We need to wrap this into the Ultralytics loss class
 from ultralytics.utils.loss import v8DetectionLoss, BboxLoss
 
 class CustomBboxLoss(BboxLoss):
-    def __init__(self, reg_max, use_dfl=False):
+    def __init__(self, reg_max, use_dfl=False, focusing=False):
         super().__init__(reg_max, use_dfl)
-        self.inner_wiou = InnerWIoU(ratio=0.75) # ratio can be tuned
+        self.inner_wiou = InnerWIoU(ratio=0.75, focusing=focusing) # ratio can be tuned
 
     def forward(self, pred_dist, pred_bboxes, anchor_points, target_bboxes, target_scores, target_scores_sum, fg_mask):
         # Override standard bbox loss calculation
@@ -136,8 +182,8 @@ class CustomBboxLoss(BboxLoss):
         return loss_bbox, loss_dfl
 
 class CustomDetectionLoss(v8DetectionLoss):
-    def __init__(self, model):
+    def __init__(self, model, focusing=False):
         super().__init__(model)
-        # Replace the bbox_loss attribute
-        self.bbox_loss = CustomBboxLoss(self.model.reg_max - 1, use_dfl=self.use_dfl)
+        # Replace the bbox_loss attribute (moved to the model device for the iou_mean buffer)
+        self.bbox_loss = CustomBboxLoss(self.model.reg_max - 1, use_dfl=self.use_dfl, focusing=focusing).to(self.device)
 
@@ -0,0 +1,319 @@
+import copy
+import json
+import os
+import threading
+import time
+
+import torch
+
+from telemetry import rss_mb
+from config import defaults
+
+# Defaults for the `memory_budget:` section of the config
+MEMORY_BUDGET_DEFAULTS = defaults('memory_budget')
+
+
+def training_device(device):
+    """torch.device of the first device in an Ultralytics `device` value (0, '0,1', 'cpu', ...)."""
+    if str(device).lower() in ('cpu', 'none', '') or not torch.cuda.is_available():
+        return torch.device('cpu')
+    first = str(device).split(',')[0].strip()
+    return torch.device(f'cuda:{first}' if first.isdigit() else first)
+
+
+def default_budget_mb(device):
+    """90% of the memory this process could still use on `device` (GPU memory, or RAM for the CPU)."""
+    if device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+        return 0.9 * (free / 2 ** 20 + torch.cuda.memory_allocated(device) / 2 ** 20)
+    import psutil
+    return 0.9 * (psutil.virtual_memory().available / 2 ** 20 + rss_mb())
+
+
+class PeakMemory:
+    """
+    Peak memory of the code inside the `with` block in MB: allocated CUDA memory, or the
+    process RSS on the CPU (sampled on a thread, torch allocations don't go through tracemalloc).
+    """
+    def __init__(self, device, interval=0.005):
+        self.device = device
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+        else:
+            self.peak = rss_mb()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            self.peak = torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, rss_mb())
+        return False
+
+
+def _tensors(out):
+    if isinstance(out, torch.Tensor):
+        return [out]
+    if isinstance(out, dict):
+        out = list(out.values())
+    if isinstance(out, (list, tuple)):
+        return [t for o in out for t in _tensors(o)]
+    return []
+
+
+# --- Activation checkpointing ---
+
+def enable_checkpoint_patch():
+    """
+    Make C3k2 blocks flagged with `checkpoint_activations` recompute their activations in the
+    backward pass instead of storing them. Only applies in training with gradients enabled, so
+    validation, the EMA copy and exported models are unaffected.
+    (BatchNorm running stats see the recomputed forward once more, which only changes their
+    moving average marginally.)
+    """
+    from torch.utils.checkpoint import checkpoint
+    from ultralytics.nn.modules.block import C3k2
+
+    if getattr(C3k2, '_checkpoint_patched', False):
+        return
+    forward = C3k2.forward
+
+    def checkpointed_forward(self, x):
+        if getattr(self, 'checkpoint_activations', False) and self.training and torch.is_grad_enabled():
+            return checkpoint(forward, self, x, use_reentrant=False)
+        return forward(self, x)
+
+    C3k2.forward = checkpointed_forward
+    C3k2._checkpoint_patched = True
+
+
+def high_res_blocks(model, max_stride=4, imgsz=64):
+    """C3k2 modules of a DetectionModel whose output stride is <= `max_stride` (found with a dummy forward)."""
+    from ultralytics.nn.modules.block import C3k2
+
+    strides, hooks = {}, []
+    for m in model.modules():
+        if isinstance(m, C3k2):
+            hooks.append(m.register_forward_hook(lambda mod, _, out: strides.__setitem__(mod, imgsz / out.shape[-1])))
+    p = next(model.parameters())
+    was_training = model.training
+    model.eval()
+    with torch.no_grad():
+        model(torch.zeros(1, 3, imgsz, imgsz, device=p.device, dtype=p.dtype))
+    model.train(was_training)
+    for h in hooks:
+        h.remove()
+    return [m for m, s in strides.items() if s <= max_stride]
+
+
+def set_checkpointing(model, enabled, max_stride=4):
+    """Flag (or unflag) the high-resolution C3k2 blocks of `model`; returns how many were flagged."""
+    enable_checkpoint_patch()
+    blocks = high_res_blocks(model, max_stride)
+    for m in blocks:
+        m.checkpoint_activations = enabled
+    return len(blocks) if enabled else 0
+
+
+# --- Micro-batch probe ---
+
+def measure(model, batch, imgsz, device, amp=False):
+    """
+    Peak memory (MB) and images/s of one forward + backward pass over `batch` random images,
+    or None if it ran out of memory. The second of two passes is timed (the first one pays for
+    cuDNN autotuning and allocator growth).
+    """
+    x = torch.rand(batch, 3, imgsz, imgsz, device=device)
+    try:
+        with PeakMemory(device) as mem:
+            for _ in range(2):
+                t0 = time.perf_counter()
+                with torch.autocast(device.type, enabled=amp and device.type == 'cuda'):
+                    out = model(x)
+                sum(t.float().sum() for t in _tensors(out)).backward()
+                if device.type == 'cuda':
+                    torch.cuda.synchronize(device)
+                dt = time.perf_counter() - t0
+                model.zero_grad(set_to_none=False) # Gradients stay allocated, as they do while training
+    except RuntimeError as e:
+        if 'out of memory' not in str(e).lower():
+            raise
+        return None
+    finally:
+        del x
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+    return mem.peak, batch / dt
+
+
+def divisor_at_most(n, limit):
+    """Largest divisor of `n` that is <= `limit` (micro-batches that add up to exactly `n`)."""
+    return max(d for d in range(1, max(1, min(n, limit)) + 1) if n % d == 0)
+
+
+def probe_batch(model, imgsz, device, budget_mb, effective_batch=64, max_batch=64, amp=False, log=print):
+    """
+    Doubles the micro-batch until the measured peak memory (plus the optimizer state) leaves the
+    budget, then takes the largest batch the linear memory model still fits, rounded down to a
+    divisor of `effective_batch`. A batch is only tried when the fit says it should fit, so the
+    probe itself never goes far over budget (on the CPU there is no OOM error to recover from).
+    Returns:
+        (int | None, list): Chosen micro-batch (None if not even 1 fits) and the measured points.
+    """
+    # AdamW keeps two moments per parameter, SGD one; reserve for the larger
+    optimizer_mb = 2 * sum(p.numel() * p.element_size() for p in model.parameters()) / 2 ** 20
+    points = []
+
+    def run(batch):
+        r = measure(model, batch, imgsz, device, amp)
+        point = {'batch': batch, 'peak_mb': None if r is None else round(r[0] + optimizer_mb, 1),
+                 'img_per_s': None if r is None else round(r[1], 2)}
+        point['fits'] = r is not None and point['peak_mb'] <= budget_mb
+        points.append(point)
+        log(f"   batch {batch:>4}: " + (f"{point['peak_mb']:>9.0f} MB {point['img_per_s']:>8.1f} img/s"
+                                        if r is not None else '      out of memory') +
+            ('' if point['fits'] else '  (over budget)'))
+        return point['fits']
+
+    def fitted():
+        ok = [p for p in points if p['fits']]
+        if len(ok) < 2:
+            return None
+        (b0, m0), (b1, m1) = [(p['batch'], p['peak_mb']) for p in ok[-2:]]
+        slope = max((m1 - m0) / (b1 - b0), 1e-6)
+        return m1 - slope * b1, slope
+
+    batch = 1
+    while batch <= max_batch:
+        fit = fitted()
+        if fit and fit[0] + fit[1] * batch > budget_mb:
+            break
+        if not run(batch):
+            break
+        batch *= 2
+
+    ok = [p['batch'] for p in points if p['fits']]
+    if not ok:
+        return None, points
+    best = max(ok)
+    fit = fitted()
+    if fit:
+        limit = min(max_batch, int((budget_mb - fit[0]) / fit[1]))
+        candidate = divisor_at_most(effective_batch, limit)
+        if candidate > best and candidate not in [p['batch'] for p in points] and run(candidate):
+            best = candidate
+    return divisor_at_most(effective_batch, best), points
+
+
+def plan_batch(model, cfg, budget_cfg, log=print):
+    """
+    Probes the micro-batch for the config's model (with and/or without checkpointing, see
+    `checkpoint`) and returns the plan: micro-batch, accumulation steps, checkpointing and the
+    probe measurements.
+    """
+    device = training_device(cfg['device'])
+    budget_mb = 1024 * budget_cfg['budget_gb'] if budget_cfg.get('budget_gb') else default_budget_mb(device)
+    effective = int(budget_cfg.get('effective_batch') or 64)
+    amp = (cfg.get('train_args') or {}).get('amp', True)
+    mode = budget_cfg.get('checkpoint', False)
+    options = [False, True] if mode == 'auto' else [bool(mode)]
+
+    net = copy.deepcopy(model.model).to(device).float().train()
+    for p in net.parameters():
+        p.requires_grad_(True)
+
+    log(f"🧮 Memory budget: {budget_mb:.0f} MB on {device}, effective batch {effective}, imgsz {cfg['imgsz']}")
+    probes = {}
+    for use_checkpoint in options:
+        n = set_checkpointing(net, use_checkpoint, budget_cfg.get('checkpoint_stride', 4))
+        log(f"  checkpointing {'on (' + str(n) + ' blocks)' if use_checkpoint else 'off'}:")
+        batch, points = probe_batch(net, cfg['imgsz'], device, budget_mb, effective,
+                                    budget_cfg.get('max_batch', 64), amp, log)
+        probes[use_checkpoint] = {'batch': batch, 'points': points}
+        if batch is not None and batch >= min(effective, budget_cfg.get('max_batch', 64)):
+            break # Checkpointing only pays for itself if it buys a larger micro-batch
+    del net
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+
+    fitting = [(p['batch'], c) for c, p in probes.items() if p['batch'] is not None]
+    if not fitting:
+        raise RuntimeError(f"Even a micro-batch of 1 needs more than the {budget_mb:.0f} MB budget at imgsz "
+                           f"{cfg['imgsz']}; raise memory_budget.budget_gb, enable checkpoint or lower imgsz")
+    batch, use_checkpoint = max(fitting, key=lambda bc: (bc[0], not bc[1])) # Ties: without recomputation
+    plan = {
+        'budget_mb': round(budget_mb, 1),
+        'device': str(device),
+        'batch': batch,
+        'accumulate': effective // batch, # batch divides effective, see divisor_at_most
+        'effective_batch': effective,
+        'checkpoint': use_checkpoint,
+        'checkpoint_stride': budget_cfg.get('checkpoint_stride', 4),
+        'probe': {('checkpoint' if c else 'no_checkpoint'): p for c, p in probes.items()},
+    }
+    log(f"  -> micro-batch {batch} x {plan['accumulate']} accumulation steps = {batch * plan['accumulate']} "
+        f"images per step, checkpointing {'on' if use_checkpoint else 'off'}")
+    return plan
+
+
+class TrainMemoryMonitor:
+    """
+    Ultralytics callbacks: flag the checkpointed blocks on the trainer's model and log the
+    peak memory and throughput of every epoch (also written to memory_budget.json in the run dir).
+    """
+    def __init__(self, plan):
+        self.plan = plan
+        self.epochs = []
+        self.device = torch.device(plan['device'])
+        self._t0 = None
+        self._peak = 0.0
+
+    def register(self, model):
+        model.add_callback('on_pretrain_routine_end', self.on_pretrain_routine_end)
+        model.add_callback('on_train_epoch_start', self.on_train_epoch_start)
+        model.add_callback('on_train_batch_end', self.on_train_batch_end)
+        model.add_callback('on_train_epoch_end', self.on_train_epoch_end)
+
+    def on_pretrain_routine_end(self, trainer):
+        # After the EMA copy is taken, so the saved (EMA) weights carry no flags
+        if self.plan['checkpoint']:
+            model = trainer.model.module if hasattr(trainer.model, 'module') else trainer.model
+            set_checkpointing(model, True, self.plan['checkpoint_stride'])
+
+    def on_train_epoch_start(self, trainer):
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self._peak = rss_mb()
+        self._t0 = time.perf_counter()
+
+    def on_train_batch_end(self, trainer):
+        if self.device.type != 'cuda':
+            self._peak = max(self._peak, rss_mb())
+
+    def on_train_epoch_end(self, trainer):
+        seconds = time.perf_counter() - self._t0
+        peak = (torch.cuda.max_memory_allocated(self.device) / 2 ** 20 if self.device.type == 'cuda'
+                else self._peak)
+        images = len(trainer.train_loader.dataset)
+        epoch = {'epoch': trainer.epoch + 1, 'peak_mb': round(peak, 1), 'img_per_s': round(images / seconds, 2),
+                 'seconds': round(seconds, 1)}
+        self.epochs.append(epoch)
+        print(f"🧮 Epoch {epoch['epoch']}: peak {epoch['peak_mb']:.0f} MB, {epoch['img_per_s']:.1f} img/s "
+              f"(micro-batch {trainer.batch_size} x {trainer.accumulate})")
+        with open(os.path.join(trainer.save_dir, 'memory_budget.json'), 'w', encoding='utf-8') as f:
+            json.dump({**self.plan, 'epochs': self.epochs}, f, indent=2)
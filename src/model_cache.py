@@ -0,0 +1,63 @@
+import collections
+import os
+import threading
+import time
+
+from backends import artifact_path, load_model
+
+
+class ModelCache:
+    """
+    LRU of loaded models keyed by (artifact path, backend, mtime), so switching back to a model
+    costs a dict lookup while a retrained (overwritten) file is loaded again.
+    Models are warmed up with a dummy forward pass on load, which moves the one-off graph
+    setup / kernel selection out of the first real frame.
+    """
+    def __init__(self, size=3, warmup=True, imgsz=640):
+        self.size = max(1, int(size))
+        self.warmup = warmup
+        self.imgsz = imgsz
+        self.models = collections.OrderedDict()
+        self.last = {} # How the last get() was served: hit, load_ms, warmup_ms
+        self._lock = threading.Lock()
+
+    def key(self, weights, backend='pt'):
+        path = artifact_path(weights, backend)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None # Hub name, downloaded on first load
+        return os.path.abspath(path), backend, mtime
+
+    def get(self, weights, backend='pt'):
+        key = self.key(weights, backend)
+        with self._lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                self.last = {'hit': True, 'load_ms': 0.0, 'warmup_ms': 0.0}
+                return self.models[key]
+
+        t0 = time.perf_counter()
+        model = load_model(weights, backend)
+        t1 = time.perf_counter()
+        if self.warmup:
+            import numpy as np
+            model(np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8), imgsz=self.imgsz, verbose=False)
+        t2 = time.perf_counter()
+
+        with self._lock:
+            # Older versions of the same file are stale now
+            for k in [k for k in self.models if k[:2] == key[:2]]:
+                del self.models[k]
+            self.models[key] = model
+            while len(self.models) > self.size:
+                self.models.popitem(last=False)
+            self.last = {'hit': False, 'load_ms': 1000 * (t1 - t0), 'warmup_ms': 1000 * (t2 - t1)}
+        return model
+
+    def __contains__(self, weights_backend):
+        return self.key(*weights_backend) in self.models
+
+    def clear(self):
+        with self._lock:
+            self.models.clear()
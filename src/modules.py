@@ -1,5 +1,6 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 class ChannelAttention(nn.Module):
     def __init__(self, in_planes, ratio=16):
@@ -13,10 +14,12 @@ class ChannelAttention(nn.Module):
         self.sigmoid = nn.Sigmoid()
 
     def forward(self, x):
-        avg_out = self.fc2(self.relu1(self.fc1(self.avg_pool(x))))
-        max_out = self.fc2(self.relu1(self.fc1(self.max_pool(x))))
-        out = avg_out + max_out
-        return self.sigmoid(out)
+        # The avg- and max-pooled descriptors share the MLP, so stack them along the
+        # batch dim and run fc1 -> relu -> fc2 once instead of twice
+        b = x.shape[0]
+        pooled = torch.cat([x.mean((2, 3), keepdim=True), x.amax((2, 3), keepdim=True)], 0)
+        out = self.fc2(self.relu1(self.fc1(pooled)))
+        return self.sigmoid(out[:b] + out[b:])
 
 class SpatialAttention(nn.Module):
     def __init__(self, kernel_size=7):
@@ -27,11 +30,12 @@ class SpatialAttention(nn.Module):
         self.sigmoid = nn.Sigmoid()
 
     def forward(self, x):
-        avg_out = torch.mean(x, dim=1, keepdim=True)
-        max_out, _ = torch.max(x, dim=1, keepdim=True)
-        x = torch.cat([avg_out, max_out], dim=1)
-        x = self.conv1(x)
-        return self.sigmoid(x)
+        # conv1 over cat([mean, max]) == conv(mean, w[:, :1]) + conv(max, w[:, 1:]),
+        # which skips materialising the 2-channel concat
+        w, pad = self.conv1.weight, self.conv1.padding
+        out = F.conv2d(x.mean(1, keepdim=True), w[:, :1], None, 1, pad)
+        out = out + F.conv2d(x.amax(1, keepdim=True), w[:, 1:], None, 1, pad)
+        return self.sigmoid(out)
 
 class CBAM(nn.Module):
     """
@@ -46,5 +50,20 @@ class CBAM(nn.Module):
 
     def forward(self, x):
         out = x * self.channel_attention(x)
-        out = out * self.spatial_attention(out)
-        return out
+        if torch.is_grad_enabled():
+            # Autograd needs `out` for the spatial-attention backward, so no in-place here
+            return out * self.spatial_attention(out)
+        # Inference: apply the spatial gate in place, one full-size allocation instead of two
+        return out.mul_(self.spatial_attention(out))
+
+def register_custom_modules():
+    """
+    Make the custom blocks visible to Ultralytics' YAML parser.
+    `parse_model` resolves module names from the globals of `ultralytics.nn.tasks`,
+    so CBAM has to be injected there before building the CBAM/P2 YAMLs.
+    """
+    import sys
+    from ultralytics.nn import tasks, modules
+    setattr(modules, 'CBAM', CBAM)
+    sys.modules['ultralytics.nn.modules'].CBAM = CBAM
+    setattr(tasks, 'CBAM', CBAM)
@@ -0,0 +1,218 @@
+import time
+
+import numpy as np
+
+from config import defaults
+
+# Defaults for the `motion:` section of the config
+MOTION_DEFAULTS = defaults('motion')
+
+
+def merge_boxes(boxes):
+    """Union overlapping (x1, y1, x2, y2) boxes until none overlap."""
+    boxes = [list(b) for b in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(b) for b in boxes]
+
+
+class MotionGate:
+    """
+    Decides per frame whether the detector has to run: 'skip' (nothing moved, reuse the last
+    detections), 'roi' (detect only inside the returned regions) or 'full'. One gate per camera;
+    it also counts the frames and pixels that were not sent to the detector.
+    """
+    def __init__(self, method='diff', width=320, pixel_threshold=25, min_area=0.0005, history=300,
+                 refresh=5.0, roi=True, roi_pad=32, max_roi_area=0.5, max_rois=4, **_):
+        import cv2
+
+        if method not in ('diff', 'mog2'):
+            raise ValueError(f"Unknown motion method '{method}', expected 'diff' or 'mog2'")
+        self.method = method
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_area = min_area
+        self.refresh = refresh
+        self.roi = roi
+        self.roi_pad = roi_pad
+        self.max_roi_area = max_roi_area
+        self.max_rois = max_rois
+        self.kernel = np.ones((3, 3), np.uint8)
+        self.subtractor = (cv2.createBackgroundSubtractorMOG2(history, pixel_threshold, detectShadows=False)
+                           if method == 'mog2' else None)
+        self.ref = None # Small blurred grey copy of the last frame sent to the detector (diff)
+        self.shape = None
+        self.last_full = None
+        self.frames = self.skipped = self.roi_frames = 0
+        self.pixels = self.skipped_pixels = 0
+        self.analysis_ms = 0.0
+
+    def moving_mask(self, small):
+        import cv2
+
+        if self.method == 'mog2':
+            return self.subtractor.apply(small)
+        if self.ref is None:
+            return np.full_like(small, 255)
+        return cv2.threshold(cv2.absdiff(small, self.ref), self.pixel_threshold, 255, cv2.THRESH_BINARY)[1]
+
+    def regions(self, small, mask, w, h):
+        """Moving blobs as padded full-resolution boxes."""
+        import cv2
+
+        mask = cv2.dilate(mask, self.kernel, iterations=2) # Join the fragments of one moving person
+        n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        min_px = self.min_area * mask.size
+        s = w / small.shape[1]
+        boxes = []
+        for x, y, bw, bh, area in stats[1:]:
+            if area >= min_px:
+                p = self.roi_pad
+                boxes.append((max(0, int(x * s) - p), max(0, int(y * s) - p),
+                              min(w, int((x + bw) * s) + p), min(h, int((y + bh) * s) + p)))
+        boxes = merge_boxes(boxes)
+        if len(boxes) > self.max_rois:
+            b = np.array(boxes)
+            boxes = [(b[:, 0].min(), b[:, 1].min(), b[:, 2].max(), b[:, 3].max())]
+        return boxes
+
+    def check(self, frame, t=None, force=False):
+        """
+        Returns:
+            (str, list): 'skip' | 'roi' | 'full' and the (x1, y1, x2, y2) regions for 'roi'.
+        """
+        import cv2
+
+        t = time.perf_counter() if t is None else t
+        t0 = time.perf_counter()
+        h, w = frame.shape[:2]
+        sh = max(1, round(h * self.width / w))
+        small = cv2.GaussianBlur(cv2.cvtColor(cv2.resize(frame, (self.width, sh), interpolation=cv2.INTER_AREA),
+                                              cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        mask = self.moving_mask(small)
+        boxes = self.regions(small, mask, w, h)
+
+        if force or self.shape != (h, w) or self.last_full is None or t - self.last_full >= self.refresh:
+            mode, boxes = 'full', []
+        elif not boxes:
+            mode = 'skip'
+        elif self.roi and sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in boxes) <= self.max_roi_area * w * h:
+            mode = 'roi'
+        else:
+            mode, boxes = 'full', []
+
+        self.frames += 1
+        self.pixels += w * h
+        if mode == 'skip':
+            self.skipped += 1
+            self.skipped_pixels += w * h
+        else:
+            self.ref = small # The detector sees this frame, later frames are compared against it
+            if mode == 'roi':
+                self.roi_frames += 1
+                self.skipped_pixels += w * h - sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in boxes)
+            else:
+                self.last_full, self.shape = t, (h, w)
+        ms = 1000 * (time.perf_counter() - t0)
+        self.analysis_ms = ms if self.frames == 1 else 0.9 * self.analysis_ms + 0.1 * ms
+        return mode, boxes
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'roi_frames': self.roi_frames,
+            'skipped_frames': self.skipped / max(self.frames, 1),
+            'skipped_pixels': self.skipped_pixels / max(self.pixels, 1),
+            'analysis_ms': self.analysis_ms,
+        }
+
+
+def reuse_result(result, frame):
+    """The detections of an earlier Results object on a new frame (Ultralytics Results)."""
+    from ultralytics.engine.results import Results
+
+    return Results(frame, path=result.path, names=result.names, boxes=result.boxes.data.clone(),
+                   speed={'preprocess': None, 'inference': None, 'postprocess': None})
+
+
+class MotionGatedPredictor:
+    """
+    Puts a MotionGate in front of a model (plain, tiled, ...). Static frames reuse the last
+    detections; with `roi` only the moving regions are detected, at the scale the full frame
+    would be (so a small region costs proportionally less), and detections elsewhere are kept.
+    Called like the model on single frames and returns Ultralytics Results.
+    With a TiledPredictor, a region that fits in one tile bypasses the tiler and runs on its plain
+    model at native resolution (the scale the tiles see it at, instead of being resized to the
+    tile size); larger regions are tiled, their full-frame pass at the full frame's scale.
+    NMS settings and the input size are passed on every call: Ultralytics keeps predictor
+    arguments between calls, so anything omitted would be whatever the last caller used.
+    """
+    def __init__(self, model, imgsz=640, **cfg):
+        self.model = model
+        self.imgsz = imgsz
+        self.gate = MotionGate(**cfg)
+        self.last = None
+        self.last_options = None
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def __call__(self, frame, conf=0.25, t=None, verbose=False, iou=0.7, max_det=300, **_):
+        import torch
+        from ultralytics.engine.results import Results
+        from tiling import TiledPredictor, add_speed, drop_cut_boxes, merge_detections
+
+        # A changed threshold invalidates the cached detections
+        options = {'conf': conf, 'iou': iou, 'max_det': max_det}
+        mode, rois = self.gate.check(frame, t, force=self.last is None or options != self.last_options)
+        if mode == 'skip':
+            return [reuse_result(self.last, frame)]
+        if mode == 'full':
+            res = self.model(frame, imgsz=self.imgsz, verbose=verbose, **options)[0]
+        else:
+            h, w = frame.shape[:2]
+            scale = min(self.imgsz / max(h, w), 1.0)
+            old = self.last.boxes.data.cpu().numpy()
+            inside = np.zeros(len(old), bool)
+            dets = []
+            speed = {'preprocess': 0.0, 'inference': 0.0, 'postprocess': 0.0}
+            for x1, y1, x2, y2 in rois:
+                # Grow the region over the previous boxes it touches, so those objects are seen whole
+                touch = (old[:, 0] < x2) & (old[:, 2] > x1) & (old[:, 1] < y2) & (old[:, 3] > y1)
+                if touch.any():
+                    p = self.gate.roi_pad
+                    x1, y1 = max(0, int(min(x1, old[touch, 0].min() - p))), max(0, int(min(y1, old[touch, 1].min() - p)))
+                    x2, y2 = min(w, int(max(x2, old[touch, 2].max() + p))), min(h, int(max(y2, old[touch, 3].max() + p)))
+                inside |= (old[:, 0] >= x1) & (old[:, 1] >= y1) & (old[:, 2] <= x2) & (old[:, 3] <= y2)
+                side = max(x2 - x1, y2 - y1)
+                if isinstance(self.model, TiledPredictor) and side <= self.model.tile:
+                    model, size = self.model.model, int(np.ceil(side / 32) * 32)
+                else:
+                    model, size = self.model, int(np.ceil(side * scale / 32) * 32) # Same object scale as the full pass
+                r = model(frame[y1:y2, x1:x2], imgsz=max(size, 64), verbose=verbose, **options)[0]
+                add_speed(speed, r.speed)
+                d = drop_cut_boxes(r.boxes.data.cpu().numpy(), (x1, y1, x2, y2), w, h)
+                d[:, [0, 2]] += x1
+                d[:, [1, 3]] += y1
+                dets.append(d)
+            # Detections of regions that moved are replaced, the rest of the frame is carried over
+            merged = merge_detections(np.concatenate(dets + [old[~inside]]).astype(np.float32), max_det=max_det)
+            res = Results(frame, path='', names=self.names, boxes=torch.from_numpy(merged), speed=speed)
+        self.last, self.last_options = res, options
+        return [res]
+
+    def stats(self):
+        return self.gate.stats()
@@ -0,0 +1,313 @@
+import argparse
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils import load_config
+from backends import BACKENDS, load_model, set_threads
+from config import add_override_argument
+from pipeline import LatestQueue, QueueClosed
+from motion import MOTION_DEFAULTS, MotionGate, reuse_result
+
+
+class StreamReader(threading.Thread):
+    """
+    Reads one source into a single-slot LatestQueue.
+    Source can be a file path, an RTSP/HTTP url, a camera index ("0")
+    or "synthetic[:WxH[@FPS]]" for a generated stand-in feed.
+    """
+    def __init__(self, stream_id, source, notify, loop=False):
+        super().__init__(daemon=True)
+        self.stream_id = stream_id
+        self.source = source
+        self.notify = notify # Shared event set whenever a new frame is ready
+        self.loop = loop
+        self.frames = LatestQueue(1)
+        self.stop_event = threading.Event()
+        self.frames_read = 0
+
+    def run(self):
+        try:
+            if str(self.source).startswith('synthetic'):
+                self._run_synthetic()
+            else:
+                self._run_capture()
+        finally:
+            self.frames.close()
+            self.notify.set()
+
+    def _publish(self, frame):
+        self.frames_read += 1
+        self.frames.put((self.frames_read, frame))
+        self.notify.set()
+
+    def _run_capture(self):
+        source = int(self.source) if str(self.source).isdigit() else self.source
+        cap = cv2.VideoCapture(source)
+        # Files are paced at their own frame rate so they behave like live feeds
+        fps = cap.get(cv2.CAP_PROP_FPS) if isinstance(source, str) and '://' not in source else 0
+        interval = 1.0 / fps if fps and fps > 0 else 0
+        next_t = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    if self.loop and isinstance(source, str):
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    break
+                self._publish(frame)
+                if interval:
+                    next_t += interval
+                    delay = next_t - time.perf_counter()
+                    if delay > 0:
+                        self.stop_event.wait(delay)
+                    else:
+                        next_t = time.perf_counter()
+        finally:
+            cap.release()
+
+    def _run_synthetic(self):
+        # synthetic:640x480@30
+        spec = str(self.source).partition(':')[2] or '640x480'
+        size, _, fps = spec.partition('@')
+        w, h = (int(v) for v in size.split('x'))
+        interval = 1.0 / float(fps or 30)
+        rng = np.random.default_rng(self.stream_id)
+        base = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+        while not self.stop_event.is_set():
+            # Roll the base image so every frame differs without paying for new noise each time
+            self._publish(np.roll(base, self.frames_read * 8, axis=1))
+            self.stop_event.wait(interval)
+
+
+class MultiStreamRunner:
+    """
+    Runs one model over many streams.
+    The newest frame of each stream is collected into a batch until either
+    `batch_size` frames are gathered or `max_wait` seconds passed since the
+    first one, then the batch goes through a single forward pass and every
+    result is handed back to `on_result(stream_id, frame_idx, frame, result)`.
+    With `motion` (MotionGate settings) every stream gets its own gate and frames in which
+    nothing moved skip the batch, their result is the stream's last one.
+    """
+    def __init__(self, model, sources, batch_size=8, max_wait=0.02, conf=0.25,
+                 device=None, imgsz=640, on_result=None, loop=False, motion=None):
+        self.model = model
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max_wait
+        self.conf = conf
+        self.device = device
+        self.imgsz = imgsz
+        self.on_result = on_result
+        self.new_frame = threading.Event()
+        self.readers = [StreamReader(i, src, self.new_frame, loop=loop) for i, src in enumerate(sources)]
+        self.stop_event = threading.Event()
+        self.thread = None
+        self._next = 0 # Round-robin start so no stream is starved when batch_size < len(sources)
+        # Batched frames are always full frames, so the gate only decides skip / detect here
+        self.gates = [MotionGate(**{**motion, 'roi': False}) for _ in sources] if motion else None
+        self.last = [None] * len(sources)
+
+        self.batches = 0
+        self.frames_processed = [0] * len(sources)
+        self.infer_time = 0.0
+        self.started = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.started = time.perf_counter()
+        for r in self.readers:
+            r.start()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for r in self.readers:
+            r.stop_event.set()
+        for r in self.readers:
+            r.join(timeout=1.0)
+        if self.thread:
+            self.thread.join(timeout=5.0)
+            self.thread = None
+
+    def alive(self):
+        return any(not r.frames.closed or r.frames.qsize() for r in self.readers)
+
+    def collect_batch(self):
+        """Gather up to batch_size (stream_id, frame_idx, frame) tuples."""
+        batch, taken = [], set()
+        deadline = None
+        n = len(self.readers)
+        while not self.stop_event.is_set():
+            for k in range(n):
+                i = (self._next + k) % n
+                if i in taken or len(batch) >= self.batch_size:
+                    continue
+                try:
+                    frame_idx, frame = self.readers[i].frames.get_nowait()
+                except (queue.Empty, QueueClosed):
+                    continue
+                batch.append((i, frame_idx, frame))
+                taken.add(i)
+            if len(batch) >= self.batch_size or len(taken) == n:
+                break
+            if not self.alive():
+                break
+
+            now = time.perf_counter()
+            if batch and deadline is None:
+                deadline = now + self.max_wait
+            timeout = deadline - now if deadline is not None else 0.1
+            if timeout <= 0:
+                break
+            self.new_frame.wait(timeout)
+            self.new_frame.clear()
+        self._next = (self._next + 1) % n
+        return batch
+
+    def run(self):
+        while not self.stop_event.is_set():
+            batch = self.collect_batch()
+            if not batch:
+                if not self.alive():
+                    break
+                continue
+
+            if self.gates:
+                moving = []
+                for stream_id, frame_idx, frame in batch:
+                    if self.gates[stream_id].check(frame, force=self.last[stream_id] is None)[0] == 'skip':
+                        self.emit(stream_id, frame_idx, frame, reuse_result(self.last[stream_id], frame))
+                    else:
+                        moving.append((stream_id, frame_idx, frame))
+                batch = moving
+                if not batch:
+                    continue
+
+            frames = [frame for _, _, frame in batch]
+            t0 = time.perf_counter()
+            results = self.model(frames, conf=self.conf, imgsz=self.imgsz, device=self.device, verbose=False)
+            self.infer_time += time.perf_counter() - t0
+            self.batches += 1
+
+            for (stream_id, frame_idx, frame), res in zip(batch, results):
+                self.last[stream_id] = res
+                self.emit(stream_id, frame_idx, frame, res)
+
+    def emit(self, stream_id, frame_idx, frame, result):
+        self.frames_processed[stream_id] += 1
+        if self.on_result:
+            self.on_result(stream_id, frame_idx, frame, result)
+
+    def stats(self):
+        elapsed = max(time.perf_counter() - (self.started or time.perf_counter()), 1e-6)
+        processed = sum(self.frames_processed)
+        inferred = processed - sum(g.skipped for g in self.gates) if self.gates else processed
+        return {
+            'streams': len(self.readers),
+            'elapsed_s': elapsed,
+            'frames': processed,
+            'aggregate_fps': processed / elapsed,
+            'per_stream_fps': [n / elapsed for n in self.frames_processed],
+            'avg_batch': inferred / max(self.batches, 1),
+            'infer_ms_per_batch': 1000 * self.infer_time / max(self.batches, 1),
+            'dropped': [r.frames.dropped for r in self.readers],
+            'motion': [g.stats() for g in self.gates] if self.gates else None,
+        }
+
+
+def benchmark(model, args):
+    """Aggregate FPS against stream count, each stream fed by a stand-in source."""
+    source = args.sources[0] if args.sources else f'synthetic:{args.synthetic_size}@{args.synthetic_fps}'
+    print(f"Benchmark source: {source} | batch={args.batch} max_wait={args.max_wait}s device={args.device}")
+
+    # Warmup so the first measurement does not include lazy init
+    model(np.zeros((args.imgsz, args.imgsz, 3), dtype=np.uint8), imgsz=args.imgsz, device=args.device, verbose=False)
+
+    print(f"{'streams':>8} {'agg FPS':>9} {'FPS/stream':>11} {'avg batch':>10} {'ms/batch':>9} {'dropped':>8}")
+    rows = []
+    for n in args.streams:
+        runner = MultiStreamRunner(model, [source] * n, batch_size=args.batch, max_wait=args.max_wait,
+                                   conf=args.conf, device=args.device, imgsz=args.imgsz, loop=True)
+        runner.start()
+        time.sleep(args.duration)
+        s = runner.stats()
+        runner.stop()
+        rows.append(s)
+        print(f"{n:>8} {s['aggregate_fps']:>9.1f} {s['aggregate_fps'] / n:>11.1f} {s['avg_batch']:>10.2f} "
+              f"{s['infer_ms_per_batch']:>9.1f} {sum(s['dropped']):>8}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched multi-stream inference")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--weights', type=str, default=None, help='Override weights from config')
+    parser.add_argument('--backend', type=str, default=None, choices=list(BACKENDS), help='Override backend from config')
+    parser.add_argument('--sources', nargs='*', default=[], help='Files, RTSP urls, camera indices or synthetic[:WxH[@FPS]]')
+    parser.add_argument('--batch', type=int, default=None, help='Max frames per forward pass')
+    parser.add_argument('--max-wait', type=float, default=None, help='Max seconds to wait for a batch to fill')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--imgsz', type=int, default=None)
+    parser.add_argument('--device', type=str, default=None, help='e.g. cpu or 0')
+    parser.add_argument('--loop', action='store_true', help='Restart file sources when they end')
+    parser.add_argument('--motion', action='store_true', help='Skip frames without motion (motion: section)')
+    parser.add_argument('--benchmark', action='store_true', help='Report aggregate FPS against stream count')
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 2, 4, 8], help='Stream counts to benchmark')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per benchmark point')
+    parser.add_argument('--synthetic-size', type=str, default='640x480')
+    parser.add_argument('--synthetic-fps', type=float, default=30.0)
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    ms_cfg = cfg.get('multi_stream') or {}
+    args.batch = args.batch or ms_cfg.get('batch', 8)
+    args.max_wait = args.max_wait if args.max_wait is not None else ms_cfg.get('max_wait', 0.02)
+    args.imgsz = args.imgsz or cfg.get('imgsz', 640)
+    if args.device is None:
+        args.device = 'cpu' if args.benchmark else cfg.get('device')
+
+    set_threads(cfg['threads'])
+    model = load_model(args.weights or cfg['weights'], args.backend or cfg.get('backend', 'pt'))
+
+    if args.benchmark:
+        benchmark(model, args)
+        return
+
+    if not args.sources:
+        parser.error("--sources is required unless --benchmark is given")
+
+    mcfg = {**MOTION_DEFAULTS, **(cfg.get('motion') or {})}
+    motion = mcfg if args.motion or mcfg['enabled'] else None
+
+    counts = [0] * len(args.sources)
+    def on_result(stream_id, frame_idx, frame, result):
+        counts[stream_id] += len(result.boxes)
+
+    runner = MultiStreamRunner(model, args.sources, batch_size=args.batch, max_wait=args.max_wait,
+                               conf=args.conf, device=args.device, imgsz=args.imgsz,
+                               on_result=on_result, loop=args.loop, motion=motion)
+    runner.start()
+    try:
+        while runner.thread.is_alive():
+            runner.thread.join(timeout=5.0)
+            s = runner.stats()
+            print(f"{s['aggregate_fps']:.1f} FPS total | avg batch {s['avg_batch']:.2f} | "
+                  f"detections {counts} | dropped {s['dropped']}")
+            if s['motion']:
+                print("  motion skipped " + ' '.join(
+                    f"[{i}] {100 * m['skipped_frames']:.0f}% frames" for i, m in enumerate(s['motion'])))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
+
+
+if __name__ == '__main__':
+    main()
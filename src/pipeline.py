@@ -0,0 +1,74 @@
+import collections
+import queue
+import threading
+
+
+class QueueClosed(Exception):
+    """Raised by LatestQueue.get() once the queue is closed and drained."""
+
+
+class LatestQueue:
+    """
+    Bounded queue that only keeps the newest items.
+    put() never blocks: when the queue is full the oldest item is discarded
+    and counted, so a slow consumer sees fresh frames instead of a backlog.
+    """
+    def __init__(self, maxsize=1):
+        self.maxsize = max(1, int(maxsize))
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+        self.total = 0
+
+    def put(self, item):
+        """
+        Add an item, evicting the oldest one if the queue is full.
+        Returns:
+            bool: True if an older item had to be dropped.
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            dropped = False
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+                dropped = True
+            self._items.append(item)
+            self.total += 1
+            self._cond.notify()
+            return dropped
+
+    def get(self, timeout=None):
+        """
+        Pop the oldest pending item.
+        Raises queue.Empty on timeout and QueueClosed once closed and empty.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                raise queue.Empty
+            if self._items:
+                return self._items.popleft()
+            raise QueueClosed
+
+    def get_nowait(self):
+        return self.get(timeout=0)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+    def close(self):
+        # Wake every waiting consumer; items already queued can still be drained
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        with self._cond:
+            return {'depth': len(self._items), 'dropped': self.dropped, 'total': self.total}
@@ -1,25 +1,201 @@
-from ultralytics import YOLO
+import argparse
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
 
 from utils import load_config
-    
-def predict():
+from backends import BACKENDS, load_from_config
+from sinks import make_sink, result_to_record, BackgroundWriter
+from tiling import maybe_tiled
+from telemetry import telemetry_from_config
+from video_job import run_videos
+from config import add_override_argument, defaults, save_resolved
+
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Defaults for the `predict:` section of the config
+PREDICT_DEFAULTS = defaults('predict')
+DEFAULT_OUTPUTS = {
+    'jsonl': 'runs/predict/predictions.jsonl',
+    'coco': 'runs/predict/predictions_coco.json',
+    'parquet': 'runs/predict/predictions_parquet', # Directory of part files
+}
+
+
+def list_images(source):
+    if os.path.isfile(source):
+        return [source]
+    paths = []
+    for root, _, files in os.walk(source):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMG_EXTS))
+    return sorted(paths)
+
+
+def read_image(path):
+    # np.fromfile + imdecode also handles non-ASCII paths on Windows
+    return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def prefetch_batches(paths, batch_size, workers, prefetch=2):
+    """
+    Decode images on a thread pool, keeping at most `prefetch` batches in
+    flight, and yield (paths, images) batches in order.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        it = iter(range(0, len(paths), batch_size))
+        def submit():
+            start = next(it, None)
+            if start is not None:
+                chunk = paths[start:start + batch_size]
+                pending.append((chunk, [pool.submit(read_image, p) for p in chunk]))
+        for _ in range(prefetch):
+            submit()
+        while pending:
+            chunk, futures = pending.pop(0)
+            submit()
+            images = [f.result() for f in futures]
+            # Skip unreadable files instead of aborting the whole run
+            ok = [(p, im) for p, im in zip(chunk, images) if im is not None]
+            for p, im in zip(chunk, images):
+                if im is None:
+                    print(f"Warning: could not read {p}, skipping")
+            if ok:
+                yield [p for p, _ in ok], [im for _, im in ok]
+
+
+def predict(cfg=None, resume=False):
     # Load configuration
-    cfg = load_config()
-    model_path = cfg['weights']
-    
-    # Load the model
-    # Note: Replace 'yolo11s.pt' with your trained weight path, e.g., 'runs/train/exp/weights/best.pt'
-    model = YOLO(model_path) 
+    cfg = cfg or load_config()
+    pcfg = {**PREDICT_DEFAULTS, **(cfg.get('predict') or {})}
 
-    # Predict
-    source = "datasets/Safety-Helmet-Wearing-Dataset.v3-base-dataset.yolov11/test/images" # Source directory
+    # Check the source before paying for the model load
+    source = pcfg['source']
     if not os.path.exists(source):
         print(f"Source directory {source} not found. Testing with a dummy image if possible or skip.")
         return
+    telemetry = telemetry_from_config(cfg)
+    telemetry.mark('start')
+
+    # Load the model (through the configured backend, e.g. an exported ONNX artifact)
+    # Note: Replace 'yolo11s.pt' with your trained weight path, e.g., 'runs/train/exp/weights/best.pt'
+    model = load_from_config(cfg)
+    # Sliced inference for high-resolution frames (tiling.enabled in the config)
+    model = maybe_tiled(model, cfg)
+    telemetry.mark('model_loaded')
+
+    output = pcfg['output'] or DEFAULT_OUTPUTS.get(pcfg['format'], 'runs/predict/predictions')
+    sink = make_sink(pcfg['format'], output, model.names, resume=resume)
+    paths = list_images(source)
+    if resume:
+        done = sink.completed()
+        paths = [p for p in paths if p not in done]
+        print(f"Resuming: {len(done)} images already done, {len(paths)} remaining.")
+
+    save_dir = os.path.join(os.path.dirname(os.path.abspath(output)), 'images') if pcfg['save_images'] else None
+    telemetry.start()
+    writer = BackgroundWriter(sink, save_dir=save_dir, source=source, maxsize=pcfg['write_queue'], telemetry=telemetry)
+    save_resolved(cfg, os.path.dirname(os.path.abspath(output)))
+
+    t0 = time.perf_counter()
+    n_images = n_dets = 0
+    try:
+        mark = time.perf_counter()
+        for batch_paths, images in prefetch_batches(paths, pcfg['batch'], pcfg['workers'], pcfg['prefetch']):
+            # Time spent waiting on the decode threads (non-zero means decoding is the bottleneck)
+            telemetry.observe('decode_wait', 1000 * (time.perf_counter() - mark))
+            results = model(images, conf=pcfg['conf'], imgsz=cfg.get('imgsz', 640), verbose=False)
+            with telemetry.stage('enqueue'):
+                for path, res in zip(batch_paths, results):
+                    telemetry.record_speed(res.speed)
+                    record = result_to_record(path, res)
+                    n_dets += len(record['detections'])
+                    writer.put(record, res)
+            n_images += len(batch_paths)
+            telemetry.frame_done(len(batch_paths))
+            telemetry.mark('first_batch')
+            telemetry.count('detections', sum(len(r.boxes) for r in results))
+            mark = time.perf_counter()
+        telemetry.count('unreadable_images', len(paths) - n_images)
+    finally:
+        writer.close()
+        telemetry.close()
+
+    elapsed = time.perf_counter() - t0
+    print(f"Prediction complete. {n_images} images, {n_dets} detections in {elapsed:.1f}s "
+          f"({n_images / max(elapsed, 1e-6):.1f} img/s). Results saved to {output}")
+    print_stage_summary(telemetry.snapshot())
+
+
+def print_stage_summary(snapshot):
+    print(f"{'stage':<12} {'n':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for name, h in snapshot['stages_ms'].items():
+        if 'p50' in h:
+            print(f"{name:<12} {h['n']:>7} {h['p50']:>8.2f} {h['p95']:>8.2f} {h['max']:>8.2f}")
+    print(f"RSS {snapshot['rss_mb']:.0f} MB")
+    if snapshot.get('timeline_s'):
+        print("Timeline: " + ", ".join(f"{k} {v:.2f}s" for k, v in snapshot['timeline_s'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming batch prediction")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--weights', type=str, default=None, help='Override weights from config')
+    parser.add_argument('--backend', type=str, default=None, choices=list(BACKENDS), help='Override backend from config')
+    parser.add_argument('--source', type=str, default=None, help='Image file or directory')
+    parser.add_argument('--batch', type=int, default=None, help='Images per forward pass')
+    parser.add_argument('--workers', type=int, default=None, help='Image decoding threads')
+    parser.add_argument('--format', type=str, default=None, choices=['jsonl', 'parquet', 'coco'])
+    parser.add_argument('--output', type=str, default=None, help='Output file (directory for parquet)')
+    parser.add_argument('--conf', type=float, default=None)
+    parser.add_argument('--save-images', action='store_true', default=None, help='Also write annotated images')
+    parser.add_argument('--resume', action='store_true', help='Skip images already present in the output')
+    parser.add_argument('--tiled', action='store_true', default=None, help='Sliced inference (see `tiling` in the config)')
+    parser.add_argument('--tile', type=int, default=None, help='Tile size in pixels')
+    parser.add_argument('--overlap', type=float, default=None, help='Tile overlap fraction')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve live metrics on this local port')
+    parser.add_argument('--telemetry-log', type=str, default=None, help='Append periodic JSON metric snapshots here')
+    parser.add_argument('--video', type=str, default=None, help='Video file or directory: headless video job (see `video`)')
+    parser.add_argument('--jobs', type=int, default=None, help='Videos processed concurrently')
+    parser.add_argument('--save-video', type=str, default=None, choices=['clips', 'full', 'none'],
+                        help='Write event clips, the whole annotated video or only events / detections')
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    if args.weights:
+        cfg['weights'] = args.weights
+    if args.backend:
+        cfg['backend'] = args.backend
+    pcfg = dict(cfg.get('predict') or {})
+    for key in ('source', 'batch', 'workers', 'format', 'output', 'conf', 'save_images'):
+        if getattr(args, key) is not None:
+            pcfg[key] = getattr(args, key)
+    cfg['predict'] = pcfg
+    tcfg = dict(cfg.get('tiling') or {})
+    for key, value in (('enabled', args.tiled), ('tile', args.tile), ('overlap', args.overlap)):
+        if value is not None:
+            tcfg[key] = value
+    cfg['tiling'] = tcfg
+    mcfg = dict(cfg.get('telemetry') or {})
+    for key, value in (('port', args.metrics_port), ('log', args.telemetry_log)):
+        if value is not None:
+            mcfg[key] = value
+    cfg['telemetry'] = mcfg
+    if args.video:
+        vcfg = dict(cfg.get('video') or {})
+        for key, value in (('save', args.save_video), ('batch', args.batch), ('conf', args.conf),
+                           ('output_dir', args.output)):
+            if value is not None:
+                vcfg[key] = value
+        cfg['video'] = vcfg
+        run_videos(cfg, args.video, args.jobs)
+        return
+    predict(cfg, resume=args.resume)
 
-    results = model.predict(source=source, save=True, conf=0.25)
-    print(f"Prediction complete. Results saved to {results[0].save_dir}")
 
 if __name__ == '__main__':
-    predict()
+    main()
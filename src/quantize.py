@@ -0,0 +1,252 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+from utils import load_config, resolve_split_dir
+from config import add_override_argument
+from modules import register_custom_modules
+from backends import artifact_path, load_model
+from export import export, run_detections, sample_images
+
+# Ops inside CBAM that stay in FP32: the sigmoid gates produce [0, 1] attention maps that get
+# multiplied into every feature, and the max-pool / channel-max paths are dominated by a few
+# outlier activations, so an 8-bit range calibrated on typical values clips exactly what CBAM keys on.
+CBAM_FP32_OPS = {'Sigmoid', 'Mul', 'MaxPool', 'GlobalMaxPool', 'ReduceMax', 'ReduceMean',
+                 'GlobalAveragePool', 'Add', 'Concat', 'Slice', 'Relu'}
+# Detect-head post-processing (DFL softmax, box decoding) is left in FP32 as well
+HEAD_FP32_OPS = {'Softmax', 'Sigmoid', 'Mul', 'Add', 'Sub', 'Div', 'Concat', 'Split', 'Slice', 'Transpose', 'Reshape'}
+
+
+class ImageCalibrationReader:
+    """Feeds letterboxed calibration images to the ONNX Runtime calibrator, one at a time."""
+    def __init__(self, paths, input_name, imgsz):
+        self.paths = paths
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._it = iter(paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def preprocess(self, path):
+        # Same preprocessing as Ultralytics' predictor: letterbox, BGR->RGB, CHW, [0, 1]
+        from ultralytics.data.augment import LetterBox
+        from predict import read_image
+
+        im = LetterBox((self.imgsz, self.imgsz), auto=False)(image=read_image(path))
+        im = im[..., ::-1].transpose(2, 0, 1)
+        return np.ascontiguousarray(im, dtype=np.float32)[None] / 255.0
+
+    def get_next(self):
+        path = next(self._it, None)
+        return None if path is None else {self.input_name: self.preprocess(path)}
+
+    def rewind(self):
+        self._it = iter(self.paths)
+
+
+def fp32_exclusions(onnx_path):
+    """
+    Names of nodes that must stay FP32: CBAM's gating/pooling paths and the Detect
+    head's decode. Node names come from the torch module path, e.g.
+    '/model.10/channel_attention/sigmoid/Sigmoid' or '/model.23/dfl/Softmax'.
+    """
+    import onnx
+
+    graph = onnx.load(onnx_path).graph
+    layers = {n.name: m.group(0) for n in graph.node for m in [re.match(r'/model\.(\d+)/', n.name)] if m}
+    head = max(set(layers.values()), key=lambda p: int(p.split('.')[1][:-1]), default=None)
+    # Whole CBAM layers, so the gate multiplications (x * attention) are covered too
+    cbam = {layers[n.name] for n in graph.node if 'attention' in n.name and n.name in layers}
+    excluded = []
+    for n in graph.node:
+        if layers.get(n.name) in cbam and n.op_type in CBAM_FP32_OPS:
+            excluded.append(n.name)
+        elif head and n.name.startswith(head) and n.op_type in HEAD_FP32_OPS and '/cv' not in n.name:
+            excluded.append(n.name) # Keep conv branches (cv2/cv3) quantized, only the decode stays FP32
+    return excluded
+
+
+def calibration_key(onnx_path, paths, imgsz, method):
+    """Cache key: model bytes + calibration image set + preprocessing + method."""
+    h = hashlib.sha1()
+    with open(onnx_path, 'rb') as f:
+        h.update(hashlib.sha1(f.read()).digest())
+    for p in paths:
+        st = os.stat(p)
+        h.update(f'{p}:{st.st_size}:{st.st_mtime_ns}'.encode())
+    h.update(f'{imgsz}:{method}'.encode())
+    return h.hexdigest()[:12]
+
+
+def quantize_op_types():
+    """Op types ONNX Runtime quantizes by default (what quantize_static uses when none are given)."""
+    from onnxruntime.quantization.registry import QDQRegistry, QLinearOpsRegistry
+
+    return sorted(set(QLinearOpsRegistry) | set(QDQRegistry))
+
+
+def calibrate(fp32, reader, method, cache):
+    """
+    Per-tensor activation ranges {name: (lowest, highest)} of `fp32`. Read from `cache` if it
+    exists, otherwise collected by running the ONNX Runtime calibrator over `reader` and saved there.
+    """
+    from onnxruntime.quantization import CalibrationMethod, create_calibrator
+
+    if os.path.exists(cache):
+        print(f"Calibration cache: {cache} (hit)")
+        with open(cache, 'r', encoding='utf-8') as f:
+            return {k: tuple(v) for k, v in json.load(f)['ranges'].items()}
+
+    print(f"Calibration cache: {cache} (miss, calibrating on {len(reader)} images)")
+    with tempfile.TemporaryDirectory(prefix='calib-') as tmp:
+        calibrator = create_calibrator(fp32, quantize_op_types(), os.path.join(tmp, 'augmented.onnx'),
+                                       calibrate_method=getattr(CalibrationMethod, method))
+        calibrator.collect_data(reader)
+        data = calibrator.compute_data()
+        del calibrator # Holds a session on the augmented model inside tmp
+    # TensorsData (onnxruntime >= 1.17) or a plain {name: (lowest, highest)} dict before that
+    data = getattr(data, 'data', data)
+    ranges = {k: tuple(np.asarray(x, np.float32).item() for x in getattr(v, 'range_value', v)[:2])
+              for k, v in data.items()}
+    with open(cache + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'method': method, 'ranges': ranges}, f)
+    os.replace(cache + '.tmp', cache)
+    return ranges
+
+
+def quantize_with_ranges(fp32, int8, ranges, method, nodes_to_exclude):
+    """
+    QDQ INT8 model from precomputed activation `ranges`: the quantization half of
+    onnxruntime's quantize_static, without its calibration pass.
+    """
+    from pathlib import Path
+    from onnxruntime.quantization import CalibrationMethod, QuantType, quant_utils
+    from onnxruntime.quantization.qdq_quantizer import QDQQuantizer
+
+    model = quant_utils.load_model_with_shape_infer(Path(fp32))
+    weight_type, activation_type = QuantType.QInt8, QuantType.QUInt8 # U8 activations / S8 weights: the fast path on x86 CPUs
+    if hasattr(quant_utils, 'update_opset_version'):
+        model = quant_utils.update_opset_version(model, weight_type, activation_type)
+    try:
+        from onnxruntime.quantization.calibrate import TensorData, TensorsData
+        tensors_range = TensorsData(getattr(CalibrationMethod, method), {
+            k: TensorData(lowest=np.float32(lo), highest=np.float32(hi)) for k, (lo, hi) in ranges.items()})
+    except ImportError: # onnxruntime < 1.17 takes plain tuples
+        tensors_range = {k: (np.float32(lo), np.float32(hi)) for k, (lo, hi) in ranges.items()}
+    kwargs = dict(model=model, per_channel=True, reduce_range=False, mode=quant_utils.QuantizationMode.QLinearOps,
+                  static=True, weight_qType=weight_type, activation_qType=activation_type,
+                  tensors_range=tensors_range, nodes_to_quantize=[], nodes_to_exclude=nodes_to_exclude,
+                  op_types_to_quantize=quantize_op_types(), extra_options={})
+    # `mode` and `static` were dropped from the constructor in newer onnxruntime releases
+    params = inspect.signature(QDQQuantizer.__init__).parameters
+    quantizer = QDQQuantizer(**{k: v for k, v in kwargs.items() if k in params})
+    quantizer.quantize_model()
+    quantizer.model.save_model_to_file(int8, False)
+
+
+def quantize_static_int8(weights, calib_dir, n_calib=200, imgsz=640, method='MinMax', seed=0):
+    """
+    Static INT8 (QDQ) ONNX model with calibrated activation ranges.
+    The ranges are cached next to the model as JSON, keyed by calibration_key(), so
+    re-running with the same model and images skips calibration entirely.
+    Returns:
+        str: Path of the INT8 model.
+    """
+    import onnx
+    from predict import list_images
+
+    fp32 = artifact_path(weights, 'onnx')
+    if not os.path.exists(fp32) or os.path.getmtime(fp32) < os.path.getmtime(weights):
+        fp32 = export(weights, ['onnx'], imgsz)['onnx']
+    int8 = artifact_path(weights, 'onnx-int8-static')
+
+    paths = list_images(calib_dir)
+    if not paths:
+        raise FileNotFoundError(f"No calibration images found in {calib_dir}")
+    rng = np.random.default_rng(seed)
+    paths = [paths[i] for i in sorted(rng.choice(len(paths), min(n_calib, len(paths)), replace=False))]
+
+    model = onnx.load(fp32)
+    reader = ImageCalibrationReader(paths, model.graph.input[0].name, imgsz)
+    cache = os.path.splitext(fp32)[0] + f'-calib-{calibration_key(fp32, paths, imgsz, method)}.json'
+
+    ranges = calibrate(fp32, reader, method, cache)
+    quantize_with_ranges(fp32, int8, ranges, method, fp32_exclusions(fp32))
+
+    # Carry over Ultralytics metadata so YOLO() can load the INT8 model directly
+    q = onnx.load(int8)
+    del q.metadata_props[:]
+    q.metadata_props.extend(model.metadata_props)
+    onnx.save(q, int8)
+    return int8
+
+
+def evaluate(weights, backends, data, imgsz, images):
+    """mAP on the validation split plus median latency for each backend."""
+    report = {}
+    for backend in backends:
+        model = load_model(weights, backend)
+        metrics = model.val(data=data, imgsz=imgsz, batch=1, device='cpu', plots=False, verbose=False)
+        _, times = run_detections(model, images, imgsz, conf=0.25)
+        report[backend] = {'map50': float(metrics.box.map50), 'map50_95': float(metrics.box.map),
+                           'p50_ms': 1000 * float(np.median(times))}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post-training static INT8 quantization (ONNX Runtime)")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--weights', type=str, default=None, help='Override weights from config')
+    parser.add_argument('--calib-images', type=str, default=None, help='Defaults to the valid/images split of `data`')
+    parser.add_argument('--n-calib', type=int, default=200, help='Number of calibration images')
+    parser.add_argument('--method', type=str, default='MinMax', choices=['MinMax', 'Entropy', 'Percentile'])
+    parser.add_argument('--imgsz', type=int, default=None)
+    parser.add_argument('--no-eval', action='store_true', help='Skip the mAP / latency comparison')
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    weights = args.weights or cfg['weights']
+    imgsz = args.imgsz or cfg.get('imgsz', 640)
+    calib_dir = args.calib_images or resolve_split_dir(cfg['data'], 'val')
+    register_custom_modules()
+
+    t0 = time.perf_counter()
+    int8 = quantize_static_int8(weights, calib_dir, args.n_calib, imgsz, args.method)
+    print(f"Static INT8 model: {int8} ({time.perf_counter() - t0:.1f}s)")
+    if args.no_eval:
+        return
+
+    images = sample_images(calib_dir, 50, imgsz, seed=1)
+    report = evaluate(weights, ['onnx', 'onnx-int8-static'], cfg['data'], imgsz, images)
+    fp, q = report['onnx'], report['onnx-int8-static']
+    report['delta'] = {
+        'map50': q['map50'] - fp['map50'],
+        'map50_95': q['map50_95'] - fp['map50_95'],
+        'speedup': fp['p50_ms'] / q['p50_ms'],
+        'size_ratio': os.path.getsize(artifact_path(weights, 'onnx')) / os.path.getsize(int8),
+    }
+    print(f"{'model':<18} {'mAP@0.5':>8} {'mAP@0.5:0.95':>13} {'p50 ms':>8}")
+    for name in ('onnx', 'onnx-int8-static'):
+        r = report[name]
+        print(f"{name:<18} {r['map50']:>8.4f} {r['map50_95']:>13.4f} {r['p50_ms']:>8.1f}")
+    d = report['delta']
+    print(f"INT8 vs FP32: mAP@0.5 {d['map50']:+.4f}, mAP@0.5:0.95 {d['map50_95']:+.4f}, "
+          f"{d['speedup']:.2f}x faster, {d['size_ratio']:.1f}x smaller")
+
+    out = os.path.splitext(int8)[0] + '-report.json'
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report saved to {out}")
+
+
+if __name__ == '__main__':
+    main()
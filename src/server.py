@@ -0,0 +1,397 @@
+import argparse
+import http.client
+import json
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout # builtin TimeoutError only from 3.11
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+
+from utils import load_config
+from config import add_override_argument, defaults, fingerprint
+
+# Defaults for the `server:` section of the config
+SERVER_DEFAULTS = defaults('server')
+# Ultralytics predict arguments a request may set (conf is handled separately, see DynamicBatcher)
+PREDICT_OPTIONS = {'imgsz': int, 'iou': float, 'max_det': int, 'agnostic_nms': lambda v: str(v).lower() == 'true'}
+# Values of the options above for a request that leaves them out (imgsz: the server's). Every batch
+# passes all of them, since Ultralytics keeps predictor arguments from one call to the next,
+# so an option one client sets would otherwise apply to every later request
+PREDICT_DEFAULTS = {'iou': 0.7, 'max_det': 300, 'agnostic_nms': False}
+
+
+class Overloaded(Exception):
+    """The server queue is full (HTTP 503), retry later."""
+
+
+class DynamicBatcher:
+    """
+    Collects concurrent requests into batches: a batch is run as soon as it has `max_batch`
+    requests or its first request has waited `max_wait_ms`. At most `max_queue` requests wait,
+    further ones are rejected at once, so an overloaded server answers quickly instead of
+    building an ever longer backlog. Requests with different confidence thresholds share a
+    forward pass (run at the lowest one, filtered per request); other options split the batch.
+    """
+    def __init__(self, model, max_batch=8, max_wait_ms=10, max_queue=32, imgsz=640, telemetry=None):
+        self.model = model
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait_ms / 1000
+        self.imgsz = imgsz
+        self.telemetry = telemetry
+        self.q = queue.Queue(maxsize=max(1, int(max_queue)))
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.batches = 0
+        self.requests = 0
+
+    def submit(self, frame, conf=0.25, options=None):
+        """Queue one BGR frame; returns a Future of (Results, timing). Raises Overloaded when full."""
+        future = Future()
+        try:
+            # Fully resolved, so requests that spell out a default batch with those that omit it
+            options = {'imgsz': self.imgsz, **PREDICT_DEFAULTS, **(options or {})}
+            self.q.put_nowait((frame, conf, tuple(sorted(options.items())), future, time.perf_counter()))
+        except queue.Full:
+            if self.telemetry:
+                self.telemetry.count('rejected')
+            raise Overloaded from None
+        return future
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def collect(self):
+        try:
+            first = self.q.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[4] + self.max_wait # Budget counts from the arrival, queueing included
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.perf_counter()
+                batch.append(self.q.get(timeout=remaining) if remaining > 0 else self.q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            batch = self.collect()
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[2], []).append(item)
+            for options, items in groups.items():
+                self.run_group(dict(options), items)
+
+    def run_group(self, options, items):
+        t0 = time.perf_counter()
+        try:
+            results = self.model([it[0] for it in items], conf=min(it[1] for it in items),
+                                 **options, verbose=False)
+        except Exception as e:
+            for it in items:
+                it[3].set_exception(e)
+            return
+        infer_ms = 1000 * (time.perf_counter() - t0)
+        self.batches += 1
+        self.requests += len(items)
+        if self.telemetry:
+            self.telemetry.observe('batch_inference', infer_ms)
+            self.telemetry.gauge('batch_size', len(items))
+            self.telemetry.gauge('queue_depth', self.q.qsize())
+            self.telemetry.frame_done(len(items))
+        for (_, conf, _, future, t_in), res in zip(items, results):
+            queue_ms = 1000 * (t0 - t_in)
+            if self.telemetry:
+                self.telemetry.observe('queue', queue_ms)
+                self.telemetry.record_speed(res.speed)
+            res = res[res.boxes.conf >= conf] if len(res.boxes) else res
+            future.set_result((res, {'queue_ms': round(queue_ms, 2), 'infer_ms': round(infer_ms, 2),
+                                     'batch': len(items)}))
+
+
+def read_shared_frame(name, shape, dtype='uint8'):
+    """Copy a frame out of a client's shared memory block (the client keeps ownership of the block)."""
+    from multiprocessing import resource_tracker, shared_memory
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        # Attaching registers the block with this process' resource tracker (Python < 3.13), which
+        # would unlink the client's memory when the server exits
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+
+
+def decode_request(headers, body):
+    """
+    Request body -> BGR frame. Accepts an encoded image (Content-Type image/*), raw pixels
+    (application/octet-stream + X-Shape: HxWxC) or a shared memory handle
+    (application/json {"shm": name, "shape": [h, w, c], "dtype": "uint8"}).
+    """
+    import cv2
+
+    ctype = (headers.get('Content-Type') or '').split(';')[0].strip()
+    if ctype == 'application/json':
+        spec = json.loads(body)
+        return read_shared_frame(spec['shm'], tuple(spec['shape']), spec.get('dtype', 'uint8'))
+    if ctype == 'application/octet-stream':
+        shape = tuple(int(v) for v in headers.get('X-Shape', '').split('x'))
+        return np.frombuffer(body, dtype=np.uint8).reshape(shape)
+    frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError('Body is not a decodable image')
+    return frame
+
+
+def make_server(batcher, info, telemetry, host='127.0.0.1', port=8510, timeout=10.0):
+    """
+    HTTP API: POST /predict?conf=0.25[&imgsz=&iou=&max_det=] -> detections JSON,
+    GET /health -> model info, GET /metrics (Prometheus text) and /metrics.json.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from sinks import result_to_record
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # Keep-alive, clients reuse their connection
+
+        def reply(self, code, payload, ctype='application/json', headers=()):
+            body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in headers:
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/health':
+                self.reply(200, {**info, 'queue_depth': batcher.q.qsize()})
+            elif path == '/metrics.json':
+                self.reply(200, telemetry.snapshot())
+            elif path == '/metrics':
+                self.reply(200, telemetry.prometheus().encode(), 'text/plain; version=0.0.4')
+            else:
+                self.reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if url.path != '/predict':
+                self.reply(404, {'error': 'not found'})
+                return
+            t0 = time.perf_counter()
+            try:
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                options = {k: cast(query[k]) for k, cast in PREDICT_OPTIONS.items() if k in query}
+                frame = decode_request(self.headers, body)
+                future = batcher.submit(frame, float(query.get('conf', 0.25)), options)
+            except Overloaded:
+                self.reply(503, {'error': 'overloaded'}, headers=[('Retry-After', '1')])
+                return
+            except Exception as e:
+                self.reply(400, {'error': f"{type(e).__name__}: {e}"})
+                return
+            try:
+                res, timing = future.result(timeout=max(0.0, timeout - (time.perf_counter() - t0)))
+            except FutureTimeout:
+                telemetry.count('timeouts')
+                self.reply(504, {'error': 'timeout'})
+                return
+            except Exception as e:
+                self.reply(500, {'error': f"{type(e).__name__}: {e}"})
+                return
+            record = result_to_record(None, res)
+            record['server'] = {**timing, 'total_ms': round(1000 * (time.perf_counter() - t0), 2)}
+            self.reply(200, record)
+
+        def log_message(self, *args):
+            pass # Requests are counted in the metrics instead
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def release_blocks(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+    blocks.clear()
+
+
+class RemoteModel:
+    """
+    Thin client with the call signature of an Ultralytics model: model(frame or [frames], conf=...)
+    returns Results, computed by a running server.py. Frames of one call are sent as concurrent
+    requests, so the server batches them. On the same machine pixels go through shared memory.
+    """
+    def __init__(self, url, transport='auto', timeout=30.0, retries=3, workers=8):
+        u = urlparse(url if '://' in url else 'http://' + url)
+        self.host, self.port = u.hostname, u.port or 80
+        local = self.host in ('127.0.0.1', 'localhost', '::1')
+        self.transport = ('shm' if local else 'raw') if transport == 'auto' else transport
+        self.timeout = timeout
+        self.retries = retries
+        self.workers = workers
+        self._local = threading.local() # Connection + shared memory block per calling thread
+        self._blocks = []
+        self._release = weakref.finalize(self, release_blocks, self._blocks) # Also on garbage collection / exit
+        self._pool = None
+        self.info = json.loads(self.request('GET', '/health')[1])
+        self.names = {int(k): v for k, v in self.info['names'].items()}
+
+    def connection(self):
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._local.conn
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in range(2): # Once more on a fresh connection if the server closed the kept-alive one
+            conn = self.connection()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                return resp.status, resp.read(), resp
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def encode(self, frame):
+        frame = np.ascontiguousarray(frame)
+        if self.transport == 'shm':
+            from multiprocessing import shared_memory
+            shm = getattr(self._local, 'shm', None)
+            if shm is None or shm.size < frame.nbytes:
+                shm = self._local.shm = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+                self._blocks.append(shm)
+            np.ndarray(frame.shape, frame.dtype, buffer=shm.buf)[:] = frame # Server copies it before replying
+            body = json.dumps({'shm': shm.name, 'shape': list(frame.shape), 'dtype': str(frame.dtype)}).encode()
+            return body, {'Content-Type': 'application/json'}
+        if self.transport == 'jpeg':
+            import cv2
+            return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes(), {'Content-Type': 'image/jpeg'}
+        return frame.tobytes(), {'Content-Type': 'application/octet-stream', 'X-Shape': 'x'.join(map(str, frame.shape))}
+
+    def predict_one(self, frame, conf=0.25, **options):
+        """Detections of one frame as the server's JSON record. Raises Overloaded once retries are used up."""
+        query = urlencode({'conf': conf, **{k: v for k, v in options.items() if k in PREDICT_OPTIONS and v is not None}})
+        body, headers = self.encode(frame)
+        for attempt in range(self.retries + 1):
+            status, data, resp = self.request('POST', f'/predict?{query}', body, headers)
+            if status == 200:
+                return json.loads(data)
+            if status != 503:
+                raise RuntimeError(f"Inference server error {status}: {data.decode(errors='replace')}")
+            if attempt < self.retries:
+                time.sleep(float(resp.getheader('Retry-After') or 1) * 0.1 * 2 ** attempt) # Back off
+        raise Overloaded(f"Inference server at {self.host}:{self.port} is overloaded")
+
+    def to_results(self, frame, record):
+        import torch
+        from ultralytics.engine.results import Results
+
+        rows = [[*d['box'], d['conf'], d['cls']] for d in record['detections']]
+        boxes = torch.tensor(rows, dtype=torch.float32).reshape(-1, 6)
+        s = record.get('server') or {}
+        speed = {'preprocess': None, 'inference': s.get('infer_ms', 0) / max(s.get('batch', 1), 1), 'postprocess': None}
+        return Results(frame, path='', names=self.names, boxes=boxes, speed=speed)
+
+    def __call__(self, source, conf=0.25, verbose=False, **options):
+        import cv2
+
+        frames = [source] if isinstance(source, (str, np.ndarray)) else list(source)
+        frames = [cv2.imread(f) if isinstance(f, str) else f for f in frames]
+        run = lambda f: self.to_results(f, self.predict_one(f, conf, **options))
+        if len(frames) == 1:
+            return [run(frames[0])]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers)
+        return list(self._pool.map(run, frames))
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown()
+        self._release()
+
+
+def serve(cfg, host=None, port=None):
+    from backends import load_model, set_threads
+    from telemetry import telemetry_from_config
+
+    scfg = {**SERVER_DEFAULTS, **(cfg.get('server') or {})}
+    telemetry = telemetry_from_config({**cfg, 'telemetry': {**(cfg.get('telemetry') or {}), 'port': None}})
+    telemetry.mark('start')
+    backend = cfg.get('backend', 'pt')
+    set_threads(cfg.get('threads'))
+    model = load_model(cfg['weights'], backend) # Loaded once, shared by every client
+    imgsz = cfg.get('imgsz', 640)
+    model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False) # Warmup
+    telemetry.mark('model_ready')
+    batcher = DynamicBatcher(model, scfg['max_batch'], scfg['max_wait_ms'], scfg['max_queue'], imgsz, telemetry)
+    info = {'status': 'ok', 'weights': cfg['weights'], 'backend': backend, 'imgsz': imgsz,
+            'names': model.names, 'max_batch': batcher.max_batch, 'max_wait_ms': scfg['max_wait_ms'],
+            'max_queue': scfg['max_queue'], 'config': fingerprint(cfg)}
+    host, port = host or scfg['host'], port or scfg['port']
+    server = make_server(batcher, info, telemetry, host, port, scfg['timeout'])
+    batcher.start()
+    telemetry.start()
+    print(f"Serving {cfg['weights']} ({backend}) on http://{host}:{port} "
+          f"(batch <= {batcher.max_batch}, wait <= {scfg['max_wait_ms']} ms, queue <= {scfg['max_queue']})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        telemetry.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local inference server with dynamic batching")
+    parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to config file')
+    parser.add_argument('--weights', type=str, default=None, help='Override weights from config')
+    parser.add_argument('--backend', type=str, default=None, help='Override backend from config')
+    parser.add_argument('--host', type=str, default=None)
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--max-batch', type=int, default=None)
+    parser.add_argument('--max-wait-ms', type=float, default=None)
+    parser.add_argument('--max-queue', type=int, default=None)
+    add_override_argument(parser)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.set)
+    if args.weights:
+        cfg['weights'] = args.weights
+    if args.backend:
+        cfg['backend'] = args.backend
+    scfg = dict(cfg.get('server') or {})
+    for key in ('max_batch', 'max_wait_ms', 'max_queue'):
+        if getattr(args, key) is not None:
+            scfg[key] = getattr(args, key)
+    cfg['server'] = scfg
+    serve(cfg, args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
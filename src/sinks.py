@@ -0,0 +1,239 @@
+import json
+import os
+import queue
+import threading
+import time
+
+
+def result_to_record(path, result):
+    """
+    Convert an Ultralytics `Results` into a plain, JSON-serialisable record.
+    Args:
+        path (str): Source image path (used as the record key).
+        result: ultralytics.engine.results.Results
+    Returns:
+        dict: {'image', 'width', 'height', 'detections': [{'cls', 'name', 'conf', 'box'}]}
+    """
+    h, w = result.orig_shape
+    data = result.boxes.data.cpu().numpy() if len(result.boxes) else []
+    detections = [{
+        'cls': int(d[5]),
+        'name': result.names[int(d[5])],
+        'conf': round(float(d[4]), 5),
+        'box': [round(float(v), 2) for v in d[:4]], # x1, y1, x2, y2 in pixels
+    } for d in data]
+    return {'image': path, 'width': int(w), 'height': int(h), 'detections': detections}
+
+
+class JsonlSink:
+    """Append-only JSON Lines sink: one line per image."""
+    def __init__(self, path, resume=False):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if resume and os.path.exists(path):
+            self._drop_partial_line()
+        self.f = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def _drop_partial_line(self):
+        # An interrupted run can leave a half-written last line; cut it off so appends stay valid
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def completed(self):
+        """Image paths already written by a previous run."""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    done.add(json.loads(line)['image'])
+        return done
+
+    def write(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def sync(self):
+        """Push buffered records to disk (called periodically by BackgroundWriter)."""
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class CocoSink(JsonlSink):
+    """
+    COCO-json sink. Records are appended to `<path>.parts.jsonl` while running
+    (so interrupted runs can resume) and assembled into `path` on close.
+    """
+    def __init__(self, path, names, resume=False):
+        self.coco_path = path
+        self.names = names
+        super().__init__(path + '.parts.jsonl', resume=resume)
+
+    def close(self):
+        super().close()
+        images, annotations = [], []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for image_id, line in enumerate(l for l in f if l.strip()):
+                rec = json.loads(line)
+                images.append({'id': image_id, 'file_name': rec['image'],
+                               'width': rec['width'], 'height': rec['height']})
+                for det in rec['detections']:
+                    x1, y1, x2, y2 = det['box']
+                    annotations.append({
+                        'id': len(annotations), 'image_id': image_id, 'category_id': det['cls'],
+                        'bbox': [x1, y1, round(x2 - x1, 2), round(y2 - y1, 2)],
+                        'area': round((x2 - x1) * (y2 - y1), 2), 'score': det['conf'], 'iscrowd': 0,
+                    })
+        categories = [{'id': int(k), 'name': v} for k, v in sorted(self.names.items())]
+        with open(self.coco_path, 'w', encoding='utf-8') as f:
+            json.dump({'images': images, 'annotations': annotations, 'categories': categories}, f)
+
+
+class ParquetSink:
+    """
+    Parquet sink. Every `rows_per_part` images are written as a new
+    `part-XXXXX.parquet` file under the output directory, so data on disk is
+    never rewritten and an interrupted run only loses its last, unwritten part.
+    Parts are only cut at `rows_per_part` and on close; `sync()` is a no-op,
+    since writing a part early would just fragment the output.
+    Requires pandas + pyarrow.
+    """
+    def __init__(self, out_dir, resume=False, rows_per_part=2048):
+        import pandas as pd # Optional dependency, only needed for this format
+        self.pd = pd
+        self.out_dir = out_dir
+        self.rows_per_part = rows_per_part
+        os.makedirs(out_dir, exist_ok=True)
+        parts = self._parts()
+        if not resume:
+            for p in parts:
+                os.remove(p)
+            parts = []
+        self.part_idx = len(parts)
+        self.rows = []
+
+    def _parts(self):
+        return sorted(os.path.join(self.out_dir, f) for f in os.listdir(self.out_dir)
+                      if f.startswith('part-') and f.endswith('.parquet'))
+
+    def completed(self):
+        done = set()
+        for p in self._parts():
+            done.update(self.pd.read_parquet(p, columns=['image'])['image'])
+        return done
+
+    def write(self, record):
+        dets = record['detections']
+        self.rows.append({
+            'image': record['image'], 'width': record['width'], 'height': record['height'],
+            'cls': [d['cls'] for d in dets], 'conf': [d['conf'] for d in dets],
+            'box': [d['box'] for d in dets],
+        })
+        if len(self.rows) >= self.rows_per_part:
+            self._write_part()
+
+    def sync(self):
+        pass
+
+    def _write_part(self):
+        if not self.rows:
+            return
+        path = os.path.join(self.out_dir, f'part-{self.part_idx:05d}.parquet')
+        # Write under a temp name first so a crash never leaves a truncated part behind
+        self.pd.DataFrame(self.rows).to_parquet(path + '.tmp', index=False, engine='pyarrow')
+        os.replace(path + '.tmp', path)
+        self.part_idx += 1
+        self.rows = []
+
+    def close(self):
+        self._write_part()
+
+
+def make_sink(fmt, output, names, resume=False):
+    """
+    Build a sink for `fmt` in {'jsonl', 'parquet', 'coco'}.
+    `output` is a file path for jsonl/coco and a directory for parquet.
+    """
+    if fmt == 'jsonl':
+        return JsonlSink(output, resume=resume)
+    if fmt == 'coco':
+        return CocoSink(output, names, resume=resume)
+    if fmt == 'parquet':
+        return ParquetSink(output, resume=resume)
+    raise ValueError(f"Unknown output format '{fmt}' (expected jsonl, parquet or coco)")
+
+
+class BackgroundWriter:
+    """
+    Drains records on a background thread so disk I/O (and optional
+    annotated-image rendering) never blocks inference. The queue is bounded,
+    so a slow disk applies backpressure instead of growing memory.
+    Annotated images keep their path relative to `source` under `save_dir`,
+    so equal file names in different folders don't overwrite each other.
+    """
+    def __init__(self, sink, save_dir=None, source=None, maxsize=256, sync_every=64, telemetry=None):
+        self.sink = sink
+        self.save_dir = save_dir
+        self.source = source if source and os.path.isdir(source) else None
+        self.telemetry = telemetry
+        self.sync_every = sync_every
+        self.q = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.written = 0
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, record, result=None):
+        if self.error:
+            raise self.error
+        # Only keep the Results object alive when its annotated image has to be saved
+        self.q.put((record, result if self.save_dir else None))
+
+    def _run(self):
+        import cv2
+        while True:
+            item = self.q.get()
+            if item is None:
+                break
+            if self.error:
+                continue # Keep draining so producers never block on a dead writer
+            record, result = item
+            try:
+                t0 = time.perf_counter()
+                self.sink.write(record)
+                if result is not None:
+                    t1 = time.perf_counter()
+                    plotted = result.plot()
+                    if self.telemetry:
+                        self.telemetry.observe('plot', 1000 * (time.perf_counter() - t1))
+                    save_path = os.path.join(self.save_dir, self._relative(record['image']))
+                    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                    cv2.imwrite(save_path, plotted)
+                if self.telemetry:
+                    self.telemetry.observe('write', 1000 * (time.perf_counter() - t0))
+                    self.telemetry.gauge('writer_queue_depth', self.q.qsize())
+                self.written += 1
+                if self.written % self.sync_every == 0:
+                    self.sink.sync()
+            except Exception as e:
+                self.error = e
+
+    def _relative(self, path):
+        if self.source:
+            rel = os.path.relpath(path, self.source)
+            if not rel.startswith(os.pardir):
+                return rel
+        return os.path.basename(path)
+
+    def close(self):
+        self.q.put(None)
+        self.thread.join()
+        self.sink.close()
+        if self.error:
+            raise self.error
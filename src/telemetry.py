@@ -0,0 +1,274 @@
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import defaults
+
+# Defaults for the `telemetry:` section of the config
+TELEMETRY_DEFAULTS = defaults('telemetry')
+# Cumulative bucket edges (ms) for the Prometheus histograms
+BUCKETS_MS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 250, 500, 1000, 2500)
+# Ultralytics Results.speed keys -> stage names (postprocess is where NMS runs)
+SPEED_STAGES = {'preprocess': 'preprocess', 'inference': 'inference', 'postprocess': 'nms'}
+
+
+def process_start():
+    """Wall-clock time this process started, so startup timelines include interpreter and import time."""
+    try:
+        import psutil
+        return psutil.Process().create_time()
+    except ImportError:
+        return time.time()
+
+
+def rss_mb():
+    """Resident memory of this process in MB (psutil ships with Ultralytics)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # Peak, not current, without psutil
+
+
+class StageHistogram:
+    """Rolling window of the latest samples plus Prometheus-style cumulative buckets."""
+    def __init__(self, window=512):
+        self.recent = collections.deque(maxlen=window)
+        self.buckets = [0] * (len(BUCKETS_MS) + 1) # Last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, ms):
+        self.recent.append(ms)
+        self.count += 1
+        self.sum += ms
+        for i, edge in enumerate(BUCKETS_MS):
+            if ms <= edge:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def summary(self):
+        if not self.recent:
+            return {'n': self.count}
+        a = np.fromiter(self.recent, dtype=np.float64)
+        p50, p95, p99 = np.percentile(a, (50, 95, 99))
+        return {'n': self.count, 'mean': float(a.mean()), 'p50': float(p50), 'p95': float(p95),
+                'p99': float(p99), 'max': float(a.max())}
+
+
+class Telemetry:
+    """
+    Shared runtime instrumentation for the demo and the batch predictor.
+    Stages (preprocess / inference / nms / plot / display / ...) are timed per frame into
+    rolling histograms; counters (frames, dropped frames, ...) and gauges (queue depth, ...)
+    sit alongside. Everything can be read as a dict, an overlay text, a periodic JSON log
+    and a local HTTP endpoint. All methods are thread-safe.
+    """
+    def __init__(self, window=512, log=None, log_every=10.0, port=None, overlay=True, prefix='helmet'):
+        self.window = window
+        self.log_path = log
+        self.log_every = log_every
+        self.port = port
+        self.overlay = overlay
+        self.prefix = prefix
+        self.stages = {}
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.frame_times = collections.deque(maxlen=window)
+        self.started = time.time()
+        self.process_started = process_start()
+        self.timeline = {} # Startup milestones, seconds since process start
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._server = None
+        self._overlay_cache = (0.0, [])
+
+    # ---- recording ----
+    def observe(self, stage, ms):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageHistogram(self.window)
+            self.stages[stage].observe(ms)
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, 1000 * (time.perf_counter() - t0))
+
+    def record_speed(self, speed, n=1):
+        """Per-image preprocess / inference / NMS times from an Ultralytics Results.speed dict."""
+        for key, stage in SPEED_STAGES.items():
+            ms = (speed or {}).get(key)
+            if ms is not None:
+                for _ in range(n):
+                    self.observe(stage, ms)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def mark(self, name):
+        """Record a startup milestone (first occurrence wins)."""
+        with self._lock:
+            self.timeline.setdefault(name, round(time.time() - self.process_started, 3))
+
+    def frame_done(self, n=1):
+        now = time.perf_counter()
+        with self._lock:
+            self.counters['frames'] += n
+            self.frame_times.extend([now] * n)
+
+    def fps(self):
+        with self._lock:
+            t = list(self.frame_times)
+        return (len(t) - 1) / (t[-1] - t[0]) if len(t) > 1 and t[-1] > t[0] else 0.0
+
+    # ---- reading ----
+    def snapshot(self):
+        with self._lock:
+            stages = {k: h.summary() for k, h in self.stages.items()}
+            counters, gauges = dict(self.counters), dict(self.gauges)
+            timeline = dict(self.timeline)
+        return {
+            'time': time.time(),
+            'uptime_s': time.time() - self.started,
+            'fps': self.fps(),
+            'rss_mb': rss_mb(),
+            'stages_ms': stages,
+            'counters': counters,
+            'gauges': gauges,
+            'timeline_s': timeline,
+        }
+
+    def overlay_lines(self, refresh=0.5):
+        """Short text lines for an on-screen overlay, recomputed at most every `refresh` seconds."""
+        t, lines = self._overlay_cache
+        if time.perf_counter() - t < refresh:
+            return lines
+        s = self.snapshot()
+        lines = [f"{s['fps']:.1f} FPS  RSS {s['rss_mb']:.0f} MB  dropped {s['counters'].get('dropped_frames', 0)}"]
+        for name, h in s['stages_ms'].items():
+            if 'p50' in h:
+                lines.append(f"{name:<10} p50 {h['p50']:6.1f}  p95 {h['p95']:6.1f} ms")
+        self._overlay_cache = (time.perf_counter(), lines)
+        return lines
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format."""
+        p = self.prefix
+        out = [f"# TYPE {p}_stage_ms histogram"]
+        with self._lock:
+            for name, h in self.stages.items():
+                acc = 0
+                for edge, n in zip(BUCKETS_MS + ('+Inf',), h.buckets):
+                    acc += n
+                    out.append(f'{p}_stage_ms_bucket{{stage="{name}",le="{edge}"}} {acc}')
+                out.append(f'{p}_stage_ms_sum{{stage="{name}"}} {h.sum:.3f}')
+                out.append(f'{p}_stage_ms_count{{stage="{name}"}} {h.count}')
+            counters, gauges = dict(self.counters), dict(self.gauges)
+            timeline = dict(self.timeline)
+        for name, v in counters.items():
+            out += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {v}"]
+        for name, v in gauges.items():
+            out += [f"# TYPE {p}_{name} gauge", f"{p}_{name} {v}"]
+        if timeline:
+            out.append(f"# TYPE {p}_startup_seconds gauge")
+            out += [f'{p}_startup_seconds{{milestone="{name}"}} {v}' for name, v in timeline.items()]
+        out += [f"# TYPE {p}_fps gauge", f"{p}_fps {self.fps():.3f}",
+                f"# TYPE {p}_rss_bytes gauge", f"{p}_rss_bytes {int(rss_mb() * 2 ** 20)}"]
+        return '\n'.join(out) + '\n'
+
+    # ---- export ----
+    def start(self):
+        """Start the periodic JSON log and the HTTP endpoint, if configured."""
+        self._stop.clear()
+        if self.log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+            t = threading.Thread(target=self._log_loop, daemon=True)
+            t.start()
+            self._threads.append(t)
+        if self.port:
+            self._server = make_metrics_server(self, self.port)
+            t = threading.Thread(target=self._server.serve_forever, daemon=True)
+            t.start()
+            self._threads.append(t)
+            print(f"Metrics at http://127.0.0.1:{self._server.server_address[1]}/metrics")
+        return self
+
+    def _log_loop(self):
+        while not self._stop.wait(self.log_every):
+            self.write_log()
+
+    def write_log(self):
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+    def close(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for t in self._threads:
+            t.join(timeout=1.0)
+        self._threads = []
+        if self.log_path:
+            self.write_log() # Final snapshot so short runs are logged too
+
+
+def make_metrics_server(telemetry, port):
+    """Local HTTP server: /metrics (Prometheus text) and /metrics.json (snapshot)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/metrics.json'):
+                body, ctype = json.dumps(telemetry.snapshot()).encode(), 'application/json'
+            elif self.path.startswith('/metrics'):
+                body, ctype = telemetry.prometheus().encode(), 'text/plain; version=0.0.4'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass # Keep scrapes out of the console
+
+    return ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+
+def draw_overlay(img, lines, origin=(8, 20), line_h=18):
+    """Draw overlay text in place onto a BGR/RGB image (dark outline so it reads on any background)."""
+    import cv2
+
+    x, y = origin
+    for line in lines:
+        cv2.putText(img, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 3, cv2.LINE_AA)
+        cv2.putText(img, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+        y += line_h
+    return img
+
+
+def telemetry_from_config(cfg):
+    """Telemetry configured from the `telemetry:` section (not started)."""
+    return Telemetry(**{**TELEMETRY_DEFAULTS, **(cfg.get('telemetry') or {})})
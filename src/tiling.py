@@ -0,0 +1,169 @@
+import time
+
+import numpy as np
+
+from config import defaults
+
+# Defaults for the `tiling:` section of the config
+TILING_DEFAULTS = defaults('tiling')
+
+
+def tile_grid(h, w, tile=640, overlap=0.2):
+    """
+    Overlapping tiles covering an h x w frame; the last row/column is aligned to the frame edge.
+    Returns:
+        list: (x1, y1, x2, y2) tile windows.
+    """
+    step = max(1, int(tile * (1 - overlap)))
+    def starts(size):
+        if size <= tile:
+            return [0]
+        s = list(range(0, size - tile, step))
+        return s + [size - tile]
+    return [(x, y, min(x + tile, w), min(y + tile, h)) for y in starts(h) for x in starts(w)]
+
+
+def weighted_box_fusion(dets, iou=0.5):
+    """
+    Weighted box fusion of (N, 6) x1, y1, x2, y2, conf, cls detections (class-aware).
+    Clusters are formed greedily by confidence; boxes are confidence-weighted means and the
+    cluster keeps its highest confidence.
+    """
+    from utils import box_iou
+
+    dets = dets[np.argsort(-dets[:, 4])]
+    out = []
+    for c in np.unique(dets[:, 5]):
+        d = dets[dets[:, 5] == c]
+        used = np.zeros(len(d), bool)
+        ious = box_iou(d[:, :4], d[:, :4])
+        for i in range(len(d)):
+            if used[i]:
+                continue
+            members = np.flatnonzero(~used & (ious[i] >= iou))
+            used[members] = True
+            w = d[members, 4:5]
+            out.append(np.concatenate([(d[members, :4] * w).sum(0) / w.sum(), [d[i, 4], c]]))
+    return np.array(out, dtype=np.float32).reshape(-1, 6)
+
+
+def merge_detections(dets, method='nms', iou=0.5, max_det=300):
+    """Merge detections gathered from overlapping tiles (and the full-frame pass) into one set."""
+    if len(dets) == 0:
+        return dets.reshape(0, 6)
+    if method == 'wbf':
+        merged = weighted_box_fusion(dets, iou)
+    else:
+        import torch
+        import torchvision
+
+        t = torch.from_numpy(dets)
+        keep = torchvision.ops.batched_nms(t[:, :4], t[:, 4], t[:, 5].long(), iou)
+        merged = dets[keep.numpy()]
+    return merged[np.argsort(-merged[:, 4])][:max_det]
+
+
+class TiledPredictor:
+    """
+    Sliced inference around a loaded YOLO model. Frames are cut into overlapping tiles, all
+    tiles (of all frames in the call) run through the model in batches of `batch`, and the
+    shifted detections are merged across tiles with NMS or WBF.
+    Called like the model itself and returns Ultralytics Results, so `.plot()` and the
+    prediction sinks work unchanged. `iou` and `max_det` apply to every tile's own NMS and to
+    the merge (without `iou`, tiles use Ultralytics' 0.7 and the merge the configured `iou`);
+    `imgsz` is the size of the full-frame pass, tiles always run at `tile`. Other model options
+    are not supported and raise.
+    """
+    def __init__(self, model, tile=640, overlap=0.2, batch=16, merge='nms', iou=0.5, full_frame=True, imgsz=640, **_):
+        if merge not in ('nms', 'wbf'):
+            raise ValueError(f"Unknown tile merge '{merge}', expected 'nms' or 'wbf'")
+        self.model = model
+        self.tile, self.overlap, self.batch = tile, overlap, batch
+        self.merge, self.iou, self.full_frame = merge, iou, full_frame
+        self.imgsz = imgsz
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def __call__(self, images, conf=0.25, iou=None, max_det=300, imgsz=None, verbose=False):
+        import torch
+        from ultralytics.engine.results import Results
+
+        # Always explicit: Ultralytics keeps predictor arguments from one call to the next
+        options = {'max_det': max_det, 'iou': 0.7 if iou is None else iou}
+        single = isinstance(images, np.ndarray)
+        images = [images] if single else list(images)
+        crops, owners = [], [] # owners: (image index, x offset, y offset, window or None for full frame)
+        for k, im in enumerate(images):
+            h, w = im.shape[:2]
+            windows = tile_grid(h, w, self.tile, self.overlap)
+            for x1, y1, x2, y2 in windows:
+                crops.append(im[y1:y2, x1:x2])
+                owners.append((k, x1, y1, (x1, y1, x2, y2) if len(windows) > 1 else None))
+
+        per_image = [[] for _ in images]
+        # Per-frame stage times: sum over the frame's tiles, merging is counted as postprocess
+        speeds = [{'preprocess': 0.0, 'inference': 0.0, 'postprocess': 0.0} for _ in images]
+        for s in range(0, len(crops), self.batch):
+            results = self.model(crops[s:s + self.batch], conf=conf, imgsz=self.tile, verbose=verbose, **options)
+            for (k, ox, oy, window), res in zip(owners[s:s + self.batch], results):
+                add_speed(speeds[k], res.speed)
+                d = res.boxes.data.cpu().numpy()
+                if window is not None:
+                    h, w = images[k].shape[:2]
+                    d = drop_cut_boxes(d, window, w, h) if self.full_frame else d
+                d[:, [0, 2]] += ox
+                d[:, [1, 3]] += oy
+                per_image[k].append(d)
+
+        if self.full_frame:
+            # One downscaled pass per frame for objects too large to fit inside a single tile
+            tiled = [k for k, im in enumerate(images) if max(im.shape[:2]) > self.tile]
+            for s in range(0, len(tiled), self.batch):
+                chunk = tiled[s:s + self.batch]
+                results = self.model([images[k] for k in chunk], conf=conf, imgsz=imgsz or self.imgsz,
+                                     verbose=verbose, **options)
+                for k, res in zip(chunk, results):
+                    add_speed(speeds[k], res.speed)
+                    per_image[k].append(res.boxes.data.cpu().numpy())
+
+        out = []
+        for im, dets, speed in zip(images, per_image, speeds):
+            t0 = time.perf_counter()
+            dets = np.concatenate(dets).astype(np.float32) if dets else np.zeros((0, 6), np.float32)
+            merged = merge_detections(dets, self.merge, self.iou if iou is None else iou, max_det)
+            speed['postprocess'] += 1000 * (time.perf_counter() - t0)
+            out.append(Results(im, path='', names=self.names, boxes=torch.from_numpy(merged), speed=speed))
+        return out
+
+
+def add_speed(total, speed):
+    for key in total:
+        total[key] += (speed or {}).get(key) or 0.0
+
+
+def drop_cut_boxes(dets, window, w, h, margin=2):
+    """
+    Drop tile detections that touch a tile edge lying inside the frame: such an object is cut
+    by the tile and is seen whole by a neighbouring tile (or by the full-frame pass).
+    """
+    x1, y1, x2, y2 = window
+    cut = np.zeros(len(dets), bool)
+    if x1 > 0:
+        cut |= dets[:, 0] <= margin
+    if y1 > 0:
+        cut |= dets[:, 1] <= margin
+    if x2 < w:
+        cut |= dets[:, 2] >= (x2 - x1) - margin
+    if y2 < h:
+        cut |= dets[:, 3] >= (y2 - y1) - margin
+    return dets[~cut]
+
+
+def maybe_tiled(model, cfg):
+    """Wrap `model` in a TiledPredictor when `tiling.enabled` is set in the config."""
+    tcfg = {**TILING_DEFAULTS, **(cfg.get('tiling') or {})}
+    if not tcfg['enabled']:
+        return model
+    return TiledPredictor(model, imgsz=cfg.get('imgsz', 640), **tcfg)
@@ -0,0 +1,239 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from utils import box_iou
+from config import defaults
+
+# Defaults for the `tracking:` section of the config
+TRACKING_DEFAULTS = defaults('tracking')
+
+
+class Track:
+    """One tracked head: box, constant-velocity motion model and smoothed class scores."""
+    def __init__(self, track_id, det, nc, t):
+        self.id = track_id
+        self.box = det[:4].astype(np.float64)
+        self.velocity = np.zeros(4)
+        self.conf = float(det[4])
+        self.scores = np.zeros(nc)
+        self.scores[int(det[5])] = 1.0
+        self.hits = 1
+        self.last_update = self.first_seen = t
+        self.last_box_t = t
+        self.no_helmet_since = None
+        self.helmet_since = None
+        self.reported = False
+
+    @property
+    def cls(self):
+        return int(np.argmax(self.scores))
+
+    def predicted(self, t):
+        return self.box + self.velocity * (t - self.last_box_t)
+
+    def update(self, det, t, alpha):
+        dt = t - self.last_box_t
+        if dt > 0:
+            # Velocity per second, smoothed so a single jittery box doesn't throw the track off
+            self.velocity = 0.5 * self.velocity + 0.5 * (det[:4] - self.box) / dt
+        self.box = det[:4].astype(np.float64)
+        self.last_box_t = self.last_update = t
+        self.conf = float(det[4])
+        onehot = np.zeros_like(self.scores)
+        onehot[int(det[5])] = det[4]
+        self.scores = (1 - alpha) * self.scores + alpha * onehot
+        self.hits += 1
+
+
+class IoUTracker:
+    """
+    ByteTrack-style association on IoU: confident detections are matched to the (motion
+    predicted) tracks first, low-confidence ones then only extend unmatched tracks, and only
+    confident detections start new tracks.
+    """
+    def __init__(self, nc, conf=0.25, low_conf=0.1, iou=0.3, max_age=1.0, min_hits=2, smoothing=0.3):
+        self.nc = nc
+        self.conf, self.low_conf = conf, low_conf
+        self.iou = iou
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.smoothing = smoothing
+        self.tracks = []
+        self.next_id = 1
+
+    def _match(self, tracks, dets, t):
+        if not tracks or not len(dets):
+            return [], list(range(len(tracks))), list(range(len(dets)))
+        iou = box_iou(np.array([tr.predicted(t) for tr in tracks]), dets[:, :4])
+        pairs = []
+        # Greedy by IoU is close to Hungarian at these densities and needs no extra dependency
+        for flat in np.argsort(-iou, axis=None):
+            i, j = divmod(int(flat), iou.shape[1])
+            if iou[i, j] < self.iou:
+                break
+            if all(i != a and j != b for a, b in pairs):
+                pairs.append((i, j))
+        mt, md = {a for a, _ in pairs}, {b for _, b in pairs}
+        return pairs, [i for i in range(len(tracks)) if i not in mt], [j for j in range(len(dets)) if j not in md]
+
+    def update(self, dets, t):
+        """Associate (N, 6) x1, y1, x2, y2, conf, cls detections taken at time `t`."""
+        dets = np.asarray(dets, dtype=np.float64).reshape(-1, 6)
+        high, low = dets[dets[:, 4] >= self.conf], dets[(dets[:, 4] < self.conf) & (dets[:, 4] >= self.low_conf)]
+
+        pairs, rest, new = self._match(self.tracks, high, t)
+        for i, j in pairs:
+            self.tracks[i].update(high[j], t, self.smoothing)
+        remaining = [self.tracks[i] for i in rest]
+        pairs2, _, _ = self._match(remaining, low, t)
+        for i, j in pairs2:
+            remaining[i].update(low[j], t, self.smoothing)
+        for j in new:
+            self.tracks.append(Track(self.next_id, high[j], self.nc, t))
+            self.next_id += 1
+        self.tracks = [tr for tr in self.tracks if t - tr.last_update <= self.max_age]
+
+    def active(self, t):
+        """Confirmed tracks at time `t` as (N, 7) x1, y1, x2, y2, id, conf, cls (boxes propagated to t)."""
+        rows = [[*tr.predicted(t), tr.id, tr.conf, tr.cls] for tr in self.tracks if tr.hits >= self.min_hits]
+        return np.array(rows, dtype=np.float32).reshape(-1, 7)
+
+
+class NoHelmetEvents:
+    """
+    Turns smoothed track classes into one "no helmet for N seconds" event per person and episode.
+    An episode only ends after the helmet class has held for `reset` seconds, so a brief
+    label flip does not produce a second event for the same person.
+    """
+    def __init__(self, cls_id, seconds=3.0, log_path=None, reset=1.0):
+        self.cls_id = cls_id
+        self.seconds = seconds
+        self.reset = reset
+        self.log_path = log_path
+        self.events = []
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+
+    def update(self, tracks, t, wall_time=None):
+        new = []
+        for tr in tracks:
+            if tr.cls != self.cls_id:
+                tr.helmet_since = t if tr.helmet_since is None else tr.helmet_since
+                if t - tr.helmet_since >= self.reset:
+                    tr.no_helmet_since, tr.reported = None, False # Helmet back on, a new episode can start
+                continue
+            tr.helmet_since = None
+            if tr.no_helmet_since is None:
+                tr.no_helmet_since = t
+            if not tr.reported and t - tr.no_helmet_since >= self.seconds:
+                tr.reported = True
+                new.append({
+                    'event': 'no_helmet', 'track_id': tr.id, 'seconds': round(t - tr.no_helmet_since, 2),
+                    'time': wall_time or time.time(), 'box': [round(float(v), 1) for v in tr.box],
+                    'conf': round(tr.conf, 3),
+                })
+        if new and self.log_path:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(e) + '\n' for e in new)
+        self.events += new
+        return new
+
+
+class AdaptiveStride:
+    """
+    Picks the detection stride k so that the average per-frame cost
+    (detect + (k - 1) * propagate) / k stays within the budget of the target FPS.
+    """
+    def __init__(self, stride=3, target_fps=None, max_stride=10):
+        self.stride = max(1, int(stride))
+        self.target_fps = target_fps
+        self.max_stride = max_stride
+        self.detect_ms = None
+        self.propagate_ms = None
+
+    def observe(self, ms, detected):
+        key = 'detect_ms' if detected else 'propagate_ms'
+        old = getattr(self, key)
+        setattr(self, key, ms if old is None else 0.8 * old + 0.2 * ms)
+        if self.target_fps and self.detect_ms is not None:
+            budget = 1000.0 / self.target_fps
+            prop = self.propagate_ms or 0.0
+            if self.detect_ms <= budget:
+                k = 1
+            elif prop >= budget:
+                k = self.max_stride # Can't keep up even without the detector
+            else:
+                k = int(np.ceil((self.detect_ms - prop) / (budget - prop)))
+            self.stride = int(np.clip(k, 1, self.max_stride))
+
+
+class TrackingDetector:
+    """
+    Runs the detector on every `stride`-th frame (or early when the scene changes), keeps
+    IoU tracks in between and returns Results whose boxes carry track ids and per-track
+    smoothed classes. New "no helmet" events of the last call are in `new_events`.
+    """
+    def __init__(self, model, names, stride=3, target_fps=None, max_stride=10, motion_threshold=8.0,
+                 low_conf=0.1, iou=0.3, max_age=1.0, min_hits=2, smoothing=0.3,
+                 no_helmet_class='person', no_helmet_seconds=3.0, event_log=None, **_):
+        self.model = model
+        self.names = names
+        self.stride = AdaptiveStride(stride, target_fps, max_stride)
+        self.motion_threshold = motion_threshold
+        self.low_conf = low_conf
+        self.tracker = IoUTracker(len(names), low_conf=low_conf, iou=iou, max_age=max_age,
+                                  min_hits=min_hits, smoothing=smoothing)
+        lookup = {v: k for k, v in names.items()} if isinstance(names, dict) else {v: k for k, v in enumerate(names)}
+        self.events = NoHelmetEvents(lookup.get(no_helmet_class, -1), no_helmet_seconds, event_log)
+        self.new_events = []
+        self.frames = 0
+        self.detections = 0
+        self.since_detect = None
+        self.ref = None # Small grey copy of the last detected frame, for the motion trigger
+
+    def scene_changed(self, frame):
+        import cv2
+
+        if not self.motion_threshold or self.ref is None:
+            return False
+        small = cv2.cvtColor(cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        return float(cv2.absdiff(small, self.ref).mean()) > self.motion_threshold
+
+    def __call__(self, frame, conf=0.25, t=None, verbose=False, iou=0.7, max_det=300, **_):
+        import cv2
+        import torch
+        from ultralytics.engine.results import Results
+
+        t = time.perf_counter() if t is None else t
+        t0 = time.perf_counter()
+        detect = self.since_detect is None or self.since_detect + 1 >= self.stride.stride or self.scene_changed(frame)
+        speed = {'preprocess': None, 'inference': None, 'postprocess': None}
+        if detect:
+            # iou / max_det always passed, Ultralytics would otherwise reuse the previous call's values
+            res = self.model(frame, conf=min(conf, self.low_conf), iou=iou, max_det=max_det, verbose=verbose)[0]
+            speed = res.speed
+            self.tracker.conf = conf
+            self.tracker.update(res.boxes.data.cpu().numpy(), t)
+            self.since_detect = 0
+            self.detections += 1
+            if self.motion_threshold:
+                self.ref = cv2.cvtColor(cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        else:
+            self.since_detect += 1
+        self.frames += 1
+        self.new_events = self.events.update(self.tracker.tracks, t)
+        boxes = self.tracker.active(t)
+        self.stride.observe(1000 * (time.perf_counter() - t0), detect)
+        return [Results(frame, path='', names=self.names, boxes=torch.from_numpy(boxes), speed=speed)]
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'detections': self.detections,
+            'stride': self.stride.stride,
+            'tracks': len(self.tracker.tracks),
+            'events': len(self.events.events),
+        }
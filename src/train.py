@@ -4,7 +4,7 @@ import os
 
 # Add local src to path if needed (implicit in current execution)
 # Import custom modules so they are available
-from modules import CBAM
+from modules import CBAM, register_custom_modules
 
 # Monkey patch to allow custom modules in dataset parsing if needed
 # Actually, for Ultralytics 8/11, it's safer to register the module or simple patch
@@ -23,19 +23,23 @@ from ultralytics.nn import tasks, modules
 
 import argparse
 from utils import load_config
+from config import add_override_argument, fingerprint, save_resolved
+from dataset_cache import build_index, use_dataset_cache
 from loss import CustomDetectionLoss
+from memory_budget import MEMORY_BUDGET_DEFAULTS, TrainMemoryMonitor, plan_batch
 from ultralytics.models.yolo.detect import DetectionTrainer
 
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', type=str, default='train_config.yaml', help='Path to training config file')
+    add_override_argument(parser)
     args = parser.parse_args()
 
-    # Load configuration
-    cfg = load_config(args.config)
+    # Load configuration (validated, with defaults / HELMET_* variables / --set applied)
+    cfg = load_config(args.config, args.set)
     
-    print(f"Loaded configuration from: {args.config}")
+    print(f"Loaded configuration from: {args.config} ({fingerprint(cfg)})")
     print(cfg)
     
     # Toggle Innovations based on config (Default to True if not specified)
@@ -46,37 +50,61 @@ def main():
         # --- Apply Monkey Patches for Innovations ---
         
         # 1. CBAM Injection
-        setattr(modules, 'CBAM', CBAM)
-        sys.modules['ultralytics.nn.modules'].CBAM = CBAM
-        setattr(tasks, 'CBAM', CBAM)
+        register_custom_modules()
         
         # 2. Loss Injection (Inner-WIoU)
+        # WIoU v3 non-monotonic focusing (off by default, plain Inner-WIoU v1 otherwise)
+        wiou_focusing = cfg.get('wiou_focusing', False)
         def custom_get_loss(self):
-            return CustomDetectionLoss(self)
+            return CustomDetectionLoss(self, focusing=wiou_focusing)
         DetectionTrainer.get_loss = custom_get_loss
         
     else:
         print("🛡️ Baseline Mode: Enabled (Original YOLOv11s)")
         # No patches applied - using standard Ultralytics components
     
+    # Pre-decoded image shards + label index (refreshed incrementally, only changed files are re-read)
+    cache_cfg = cfg.get('dataset_cache') or {}
+    if cache_cfg.get('enabled', False):
+        cache_root = build_index(cfg['data'], cfg['imgsz'], cache_cfg.get('dir'), use_hash=cache_cfg.get('hash', False))
+        use_dataset_cache(cache_root)
+        print(f"📦 Dataset cache: {cache_root}")
+
     # Load a model
     # 1. Build model from config
     model = YOLO(cfg['model_cfg'])
     
     # 2. Load pretrained weights (transfer learning)
     # This will load matching layers and ignore mismatched ones (like our new CBAM)
-    model.load(cfg['weights'])
+    # (weights: null trains from scratch, e.g. the ablation smoke runs)
+    if cfg.get('weights'):
+        model.load(cfg['weights'])
+
+    # Memory budget: probe the largest micro-batch that fits and accumulate gradients up to the
+    # effective batch (Ultralytics `nbs`), optionally recomputing the P2 activations
+    batch = cfg['batch']
+    train_args = dict(cfg.get('train_args') or {})
+    budget_cfg = {**MEMORY_BUDGET_DEFAULTS, **(cfg.get('memory_budget') or {})}
+    if budget_cfg['enabled']:
+        plan = plan_batch(model, cfg, budget_cfg)
+        batch = plan['batch']
+        train_args['nbs'] = plan['effective_batch']
+        TrainMemoryMonitor(plan).register(model)
+
+    # The resolved config lands next to Ultralytics' args.yaml in the run directory
+    model.add_callback('on_pretrain_routine_start', lambda trainer: save_resolved(cfg, trainer.save_dir))
 
     # Train the model
     results = model.train(
         data=cfg['data'],  # path to dataset YAML
         epochs=cfg['epochs'],  # number of epochs to train for
         imgsz=cfg['imgsz'],  # size of input images as integer
-        batch=cfg['batch'],  # number of images per batch
+        batch=batch,  # number of images per batch (micro-batch with a memory budget)
         device=cfg['device'],  # device to run on
         project=cfg['project'],  # project name
         name=cfg['name'],  # experiment name
         exist_ok=False,  # whether to overwrite existing experiment
+        **train_args,  # any other Ultralytics train argument, e.g. lr0, workers, plots
     )
 
 if __name__ == '__main__':
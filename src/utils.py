@@ -1,24 +1,64 @@
 import yaml
 import os
 
-def load_config(config_path="../train_config.yaml"):
+def load_config(config_path=None, overrides=None):
     """
-    Load YAML configuration file.
+    Load a YAML configuration file through the validated config layer (see config.py):
+    defaults <- YAML <- HELMET_* environment variables <- `overrides`.
     Args:
-        config_path (str): Relative or absolute path to the config file.
+        config_path (str): Path to the config file, absolute or relative to the working directory or
+            the project root; None = $HELMET_CONFIG or the project's train_config.yaml.
+        overrides (list): 'key.path=value' strings, e.g. from --set.
     Returns:
-        dict: Configuration dictionary.
+        dict: Configuration dictionary with every section filled in.
+    Raises:
+        FileNotFoundError: If the config file does not exist.
+        config.ConfigError: On an unknown key or a mistyped value.
     """
-    # Resolve absolute path if needed, assuming relative to this script or current working directory
-    # If run from src/, ../train_config.yaml is valid.
-    
-    if not os.path.exists(config_path):
-        # Try finding it relative to the script location if current dir fails
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        Project_root = os.path.dirname(script_dir)
-        possible_path = os.path.join(Project_root, "train_config.yaml")
-        if os.path.exists(possible_path):
-            config_path = possible_path
-            
-    with open(config_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+    from config import load
+
+    return load(config_path, overrides)
+
+
+def box_iou(a, b):
+    """
+    Pairwise IoU between two sets of boxes.
+    Args:
+        a (np.ndarray): (N, 4) boxes as x1, y1, x2, y2.
+        b (np.ndarray): (M, 4) boxes as x1, y1, x2, y2.
+    Returns:
+        np.ndarray: (N, M) IoU matrix.
+    """
+    import numpy as np
+
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    area_a = (a[:, 2:] - a[:, :2]).prod(-1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(-1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-7)
+
+
+def resolve_split_dir(data_yaml, split='val'):
+    """
+    Resolve the image directory of a dataset split from an Ultralytics data YAML.
+    Args:
+        data_yaml (str): Path to data.yaml.
+        split (str): 'train', 'val' or 'test'.
+    Returns:
+        str: Image directory of the split (may not exist if the dataset is missing).
+    """
+    with open(data_yaml, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    yaml_dir = os.path.dirname(os.path.abspath(data_yaml))
+    base = data.get('path') or yaml_dir
+    if not os.path.isabs(base):
+        base = os.path.join(yaml_dir, base)
+    rel = data[split]
+    candidate = os.path.normpath(os.path.join(base, rel))
+    if not os.path.exists(candidate) and rel.startswith('../'):
+        # Roboflow exports use '../valid/images' relative to the dataset folder
+        candidate = os.path.normpath(os.path.join(base, rel[3:]))
+    return candidate
@@ -0,0 +1,379 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from tracking import TRACKING_DEFAULTS, IoUTracker, NoHelmetEvents
+from vis import draw_detections
+from config import defaults, save_resolved
+
+VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.mpg', '.mpeg', '.wmv', '.ts')
+
+# Defaults for the `video:` section of the config
+VIDEO_DEFAULTS = defaults('video')
+
+
+def list_videos(source):
+    if os.path.isfile(source):
+        return [source]
+    paths = []
+    for root, _, files in os.walk(source):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(VIDEO_EXTS))
+    return sorted(paths)
+
+
+def open_capture(path, hw_accel=True):
+    """VideoCapture that uses any available hardware decoder, plain software decoding otherwise."""
+    if hw_accel and hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+        cap = cv2.VideoCapture(path, cv2.CAP_ANY, [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+    return cv2.VideoCapture(path)
+
+
+def open_writer(path, codec, fps, size, hw_accel=True):
+    """VideoWriter counterpart of open_capture()."""
+    fourcc = cv2.VideoWriter_fourcc(*codec)
+    if hw_accel and hasattr(cv2, 'VIDEOWRITER_PROP_HW_ACCELERATION'):
+        writer = cv2.VideoWriter(path, cv2.CAP_ANY, fourcc, fps, size,
+                                 [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if writer.isOpened():
+            return writer
+    writer = cv2.VideoWriter(path, fourcc, fps, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not open a '{codec}' video writer for {path}")
+    return writer
+
+
+class StageTimer:
+    """Busy time and frame count of one pipeline stage, for its own throughput."""
+    def __init__(self):
+        self.frames = 0
+        self.busy = 0.0
+
+    def add(self, seconds, frames=1):
+        self.busy += seconds
+        self.frames += frames
+
+    def fps(self):
+        return self.frames / self.busy if self.busy > 0 else 0.0
+
+
+class FrameReader(threading.Thread):
+    """Decodes a file into a bounded queue (blocks when inference falls behind, nothing is dropped)."""
+    def __init__(self, cap, maxsize=32):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.frames = queue.Queue(maxsize=maxsize)
+        self.timer = StageTimer()
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                t0 = time.perf_counter()
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                self.timer.add(time.perf_counter() - t0)
+                self.frames.put(frame)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.cap.release()
+            self.frames.put(None)
+
+    def batches(self, size):
+        """Yield lists of up to `size` frames until the file ends."""
+        batch = []
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            batch.append(frame)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        if self.error:
+            raise self.error
+
+
+class ClipRecorder:
+    """
+    Writes only the frames around events. The last `pre_frames` frames are kept JPEG-compressed,
+    so the pre-roll costs a few MB however long the video is. An event opens a clip that starts
+    with them and runs until `post_frames` after the last frame flagged as part of an event.
+    """
+    def __init__(self, out_dir, stem, fps, codec='mp4v', pre_frames=90, post_frames=90, hw_accel=True):
+        self.out_dir = out_dir
+        self.stem = stem
+        self.fps = fps
+        self.codec = codec
+        self.hw_accel = hw_accel
+        self.post_frames = post_frames
+        self.buffer = collections.deque(maxlen=max(0, pre_frames))
+        self.writer = None
+        self.end = None
+        self.clips = [] # {'path', 'start_frame', 'end_frame'}
+
+    def push(self, index, frame, event):
+        if event:
+            if self.writer is None:
+                start = index - len(self.buffer)
+                path = os.path.join(self.out_dir, f"{self.stem}_{start / self.fps:08.2f}s.mp4")
+                self.writer = open_writer(path, self.codec, self.fps, (frame.shape[1], frame.shape[0]), self.hw_accel)
+                self.clips.append({'path': path, 'start_frame': start, 'end_frame': None})
+                for data in self.buffer:
+                    self.writer.write(cv2.imdecode(data, cv2.IMREAD_COLOR))
+                self.buffer.clear()
+            self.end = index + self.post_frames
+        if self.writer is not None:
+            self.writer.write(frame)
+            if index >= self.end:
+                self.close(index)
+        elif self.buffer.maxlen:
+            self.buffer.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])[1])
+
+    def close(self, index):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+            self.clips[-1]['end_frame'] = index
+
+
+class FrameEncoder(threading.Thread):
+    """
+    Draws the tracked boxes and writes the annotated video (or event clips) and per-frame
+    detections on its own thread, fed through a bounded queue.
+    """
+    def __init__(self, names, out_dir, stem, fps, vcfg, maxsize=32):
+        super().__init__(daemon=True)
+        self.names = names
+        self.fps = fps
+        self.vcfg = vcfg
+        self.items = queue.Queue(maxsize=maxsize)
+        self.timer = StageTimer()
+        self.error = None
+        self.writer = None
+        self.video_path = os.path.join(out_dir, f"{stem}_annotated.mp4") if vcfg['save'] == 'full' else None
+        self.clips = ClipRecorder(out_dir, stem, fps, vcfg['codec'], round(vcfg['pre_roll'] * fps),
+                                  round(vcfg['post_roll'] * fps), vcfg['hw_accel']) if vcfg['save'] == 'clips' else None
+        self.detections = (open(os.path.join(out_dir, f"{stem}_detections.jsonl"), 'w', encoding='utf-8')
+                           if vcfg['save_detections'] else None)
+        self.last_index = -1
+
+    def put(self, index, frame, tracks, event):
+        if self.error:
+            raise self.error
+        self.items.put((index, frame, tracks, event))
+
+    def run(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                break
+            if self.error:
+                continue # Keep draining so inference never blocks on a dead encoder
+            try:
+                t0 = time.perf_counter()
+                self.encode(*item)
+                self.timer.add(time.perf_counter() - t0)
+            except Exception as e:
+                self.error = e
+
+    def encode(self, index, frame, tracks, event):
+        self.last_index = index
+        if self.detections:
+            self.detections.write(json.dumps({'frame': index, 't': round(index / self.fps, 3), 'detections': [{
+                'track_id': int(r[4]), 'cls': int(r[6]), 'name': self.names[int(r[6])], 'conf': round(float(r[5]), 5),
+                'box': [round(float(v), 2) for v in r[:4]]} for r in tracks]}) + '\n')
+        if self.video_path is None and self.clips is None:
+            return
+        # Only frames that end up in a video (or the pre-roll buffer) are drawn
+        draw_detections(frame, tracks[:, :4], tracks[:, 5], tracks[:, 6], self.names, ids=tracks[:, 4])
+        if self.video_path:
+            if self.writer is None:
+                self.writer = open_writer(self.video_path, self.vcfg['codec'], self.fps,
+                                          (frame.shape[1], frame.shape[0]), self.vcfg['hw_accel'])
+            self.writer.write(frame)
+        else:
+            self.clips.push(index, frame, event)
+
+    def close(self):
+        self.items.put(None)
+        self.join()
+        if self.writer is not None:
+            self.writer.release()
+        if self.clips:
+            self.clips.close(self.last_index)
+        if self.detections:
+            self.detections.close()
+        if self.error:
+            raise self.error
+
+
+def process_video(model, path, cfg, out_dir=None):
+    """
+    Decode -> batched inference + tracking -> annotate / encode for one file, each stage on its
+    own thread with bounded queues in between, so memory does not grow with the video length.
+    No-helmet events (see `tracking`) are appended to <stem>_events.jsonl.
+    Returns:
+        dict: Summary with frame / event / clip counts and the per-stage throughput.
+    """
+    vcfg = {**VIDEO_DEFAULTS, **(cfg.get('video') or {})}
+    tcfg = {**TRACKING_DEFAULTS, **(cfg.get('tracking') or {})}
+    stem = os.path.splitext(os.path.basename(path))[0]
+    out_dir = out_dir or vcfg['output_dir']
+    os.makedirs(out_dir, exist_ok=True)
+
+    cap = open_capture(path, vcfg['hw_accel'])
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    fps = fps if fps and fps > 0 else 25.0
+    names = model.names
+    lookup = {v: k for k, v in names.items()} if isinstance(names, dict) else {v: k for k, v in enumerate(names)}
+    tracker = IoUTracker(len(names), vcfg['conf'], tcfg['low_conf'], tcfg['iou'], tcfg['max_age'],
+                         tcfg['min_hits'], tcfg['smoothing'])
+    events = NoHelmetEvents(lookup.get(tcfg['no_helmet_class'], -1), tcfg['no_helmet_seconds'])
+    event_log = os.path.join(out_dir, f"{stem}_events.jsonl")
+
+    reader = FrameReader(cap, vcfg['queue'])
+    encoder = FrameEncoder(names, out_dir, stem, fps, vcfg, vcfg['queue'])
+    infer = StageTimer()
+    n_events = index = 0
+    t_start = time.perf_counter()
+    reader.start()
+    encoder.start()
+    try:
+        with open(event_log, 'w', encoding='utf-8') as log:
+            for frames in reader.batches(max(1, int(vcfg['batch']))):
+                t0 = time.perf_counter()
+                results = model(frames, conf=min(vcfg['conf'], tcfg['low_conf']), imgsz=cfg.get('imgsz', 640),
+                                verbose=False)
+                tracked = []
+                for frame, res in zip(frames, results):
+                    t = index / fps # Video time, so events and clips don't depend on processing speed
+                    tracker.update(res.boxes.data.cpu().numpy(), t)
+                    new = events.update(tracker.tracks, t)
+                    for e in new:
+                        e.update(video=path, frame=index, video_time=round(t, 3))
+                        log.write(json.dumps(e) + '\n')
+                    n_events += len(new)
+                    # A clip covers the whole violation: from the event until the person is gone or has a helmet on
+                    violating = bool(new) or any(tr.reported and tr.no_helmet_since is not None for tr in tracker.tracks)
+                    tracked.append((index, frame, tracker.active(t), violating))
+                    index += 1
+                infer.add(time.perf_counter() - t0, len(frames))
+                for item in tracked:
+                    encoder.put(*item)
+    finally:
+        reader.stop_event.set()
+        while reader.is_alive(): # Unblock a reader waiting on a full queue after an error
+            try:
+                reader.frames.get_nowait()
+            except queue.Empty:
+                time.sleep(0.01)
+        encoder.close()
+
+    wall = time.perf_counter() - t_start
+    return {
+        'video': path,
+        'frames': index,
+        'video_seconds': round(index / fps, 2),
+        'wall_seconds': round(wall, 2),
+        'fps': round(index / max(wall, 1e-6), 2),
+        'stage_fps': {'decode': round(reader.timer.fps(), 2), 'inference': round(infer.fps(), 2),
+                      'encode': round(encoder.timer.fps(), 2)},
+        'events': n_events,
+        'clips': encoder.clips.clips if encoder.clips else [],
+        'output': encoder.video_path,
+    }
+
+
+def report(s):
+    if 'error' in s:
+        print(f"{s['video']}: failed, {s['error']}")
+        return
+    stages = s['stage_fps']
+    bottleneck = min((v, k) for k, v in stages.items() if v > 0)[1] if any(stages.values()) else '-'
+    print(f"{os.path.basename(s['video'])}: {s['frames']} frames ({s['video_seconds']:.0f}s of video) in "
+          f"{s['wall_seconds']:.1f}s = {s['fps']:.1f} FPS | decode {stages['decode']:.1f} / inference "
+          f"{stages['inference']:.1f} / encode {stages['encode']:.1f} FPS (bottleneck: {bottleneck}) | "
+          f"{s['events']} events, {len(s['clips'])} clips")
+
+
+# --- Worker pool: one process (and model) per concurrently processed file ---
+
+_worker = {}
+
+
+def _init_worker(cfg):
+    from backends import load_from_config
+    from tiling import maybe_tiled
+
+    _worker['cfg'] = cfg
+    _worker['model'] = maybe_tiled(load_from_config(cfg), cfg) # Applies cfg['threads']
+
+
+def _process_in_worker(path, out_dir):
+    try:
+        return process_video(_worker['model'], path, _worker['cfg'], out_dir)
+    except Exception as e:
+        return {'video': path, 'error': f"{type(e).__name__}: {e}"}
+
+
+def run_videos(cfg, source, jobs=None):
+    """
+    Process every video of `source` (file or directory), `jobs` files at a time. Each worker
+    process loads the model once and gets an equal share of the CPU threads (or `threads` each).
+    Writes summary.json next to the outputs and returns the per-file summaries.
+    """
+    vcfg = {**VIDEO_DEFAULTS, **(cfg.get('video') or {})}
+    paths = list_videos(source)
+    if not paths:
+        print(f"No videos found in {source}")
+        return []
+    jobs = max(1, min(int(jobs or vcfg['jobs']), len(paths)))
+    out_root = vcfg['output_dir']
+    # Files with the same name in different folders get their own output directory
+    out_dirs = [os.path.join(out_root, os.path.splitext(os.path.relpath(p, source))[0]) if os.path.isdir(source)
+                else os.path.join(out_root, os.path.splitext(os.path.basename(p))[0]) for p in paths]
+
+    save_resolved(cfg, out_root)
+    t0 = time.perf_counter()
+    summaries = []
+    if jobs == 1:
+        _init_worker(cfg)
+        for path, out_dir in zip(paths, out_dirs):
+            summaries.append(_process_in_worker(path, out_dir))
+            report(summaries[-1])
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        cfg = {**cfg, 'threads': cfg.get('threads') or max(1, (os.cpu_count() or 1) // jobs)}
+        # spawn: forking a process that already runs torch threads can deadlock
+        with ProcessPoolExecutor(jobs, multiprocessing.get_context('spawn'), _init_worker, (cfg,)) as pool:
+            futures = [pool.submit(_process_in_worker, p, d) for p, d in zip(paths, out_dirs)]
+            for f in as_completed(futures):
+                summaries.append(f.result())
+                report(summaries[-1])
+
+    wall = time.perf_counter() - t0
+    ok = [s for s in summaries if 'error' not in s]
+    frames = sum(s['frames'] for s in ok)
+    print(f"Video job complete: {len(ok)}/{len(paths)} files, {frames} frames in {wall:.1f}s "
+          f"({frames / max(wall, 1e-6):.1f} FPS over {jobs} worker(s)), {sum(s['events'] for s in ok)} events. "
+          f"Outputs in {out_root}")
+    os.makedirs(out_root, exist_ok=True)
+    with open(os.path.join(out_root, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump({'jobs': jobs, 'wall_seconds': round(wall, 2), 'videos': summaries}, f, indent=2)
+    return summaries
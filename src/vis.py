@@ -0,0 +1,68 @@
+import numpy as np
+
+
+def draw_detections(img, boxes, confs, classes, names, scale=1.0, line_width=None, ids=None):
+    """
+    Draw boxes and 'name conf' labels in place onto a BGR image, in the Ultralytics palette.
+    Args:
+        img (np.ndarray): BGR image to draw on (usually the frame already resized for display).
+        boxes (np.ndarray): (N, 4) x1, y1, x2, y2 in original-frame pixels.
+        confs (np.ndarray): (N,) confidences.
+        classes (np.ndarray): (N,) class ids.
+        names (dict): Class id -> name.
+        scale (float): Factor from original-frame to `img` pixels.
+        ids (np.ndarray, optional): (N,) track ids, shown as 'id:3 hat 0.91'.
+    Returns:
+        np.ndarray: `img`.
+    """
+    import cv2
+    from ultralytics.utils.plotting import colors
+
+    lw = line_width or max(round(sum(img.shape[:2]) / 2 * 0.003), 2)
+    tf, sf = max(lw - 1, 1), lw / 3
+    ids = [None] * len(confs) if ids is None else ids
+    for (x1, y1, x2, y2), conf, c, tid in zip(np.asarray(boxes) * scale, confs, classes, ids):
+        c = int(c)
+        color = colors(c, True)
+        p1, p2 = (int(x1), int(y1)), (int(x2), int(y2))
+        cv2.rectangle(img, p1, p2, color, lw, cv2.LINE_AA)
+        label = f"{names.get(c, c) if isinstance(names, dict) else names[c]} {conf:.2f}"
+        label = f"id:{int(tid)} {label}" if tid is not None else label
+        w, h = cv2.getTextSize(label, 0, fontScale=sf, thickness=tf)[0]
+        outside = p1[1] >= h + 3 # Label above the box unless it would leave the image
+        p3 = (p1[0] + w, p1[1] - h - 3 if outside else p1[1] + h + 3)
+        cv2.rectangle(img, p1, p3, color, -1, cv2.LINE_AA)
+        text_color = (0, 0, 0) if sum(color) > 382 else (255, 255, 255) # Dark text on light colors
+        cv2.putText(img, label, (p1[0], p1[1] - 2 if outside else p1[1] + h + 2), 0, sf, text_color, tf, cv2.LINE_AA)
+    return img
+
+
+def draw_result(img, result, scale=1.0):
+    """draw_detections() for an Ultralytics Results object."""
+    b = result.boxes
+    if b is None or len(b) == 0:
+        return img
+    ids = b.id.cpu().numpy() if b.is_track else None
+    return draw_detections(img, b.xyxy.cpu().numpy(), b.conf.cpu().numpy(), b.cls.cpu().numpy(),
+                           result.names, scale, ids=ids)
+
+
+def fit_size(w, h, max_w, max_h):
+    """Largest (w, h) with the aspect ratio of w x h that fits into max_w x max_h, and its scale."""
+    scale = min(max_w / w, max_h / h)
+    return max(1, int(w * scale)), max(1, int(h * scale)), scale
+
+
+def resize_for_display(frame, max_w, max_h):
+    """
+    Resize once to the display size: INTER_AREA when shrinking (cheap and alias-free),
+    INTER_LINEAR when enlarging. Returns the resized frame and the scale factor.
+    """
+    import cv2
+
+    h, w = frame.shape[:2]
+    nw, nh, scale = fit_size(w, h, max_w, max_h)
+    if (nw, nh) == (w, h):
+        return frame.copy(), 1.0 # Copy so drawing never touches the decoded frame
+    interp = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(frame, (nw, nh), interpolation=interp), nw / w